@@ -0,0 +1,7 @@
+"""
+Off-deck tooling for the OT2-SARS-CoV2 protocols.
+
+These modules run on a workstation, not on the OT-2. They load the protocol
+scripts as they would be uploaded to the robot and simulate them, so that
+changes can be measured without robot time.
+"""
@@ -0,0 +1,170 @@
+"""
+Parallel simulation of many protocol configurations.
+
+Each configuration is recorded and measured as in benchmark.py, on a pool of
+worker processes. Every worker imports the opentrons stack and compiles the
+protocols once when it starts and then simulates configuration after
+configuration, so only the first run in each worker pays the startup cost
+that a separate opentrons_simulate invocation pays every time. Results are
+printed as they finish, in whatever order that is.
+
+Without configurations on the command line the benchmark matrix is run and
+compared against the benchmark baseline. A configuration is a protocol name
+or path, optionally followed by ":" and comma-separated run() arguments:
+
+    qpcr:num_samples=48,master_mix_first=True
+
+Usage:
+    python -m ot2_sars_cov2.batch                # the benchmark matrix
+    python -m ot2_sars_cov2.batch -k extraction -j 4
+    python -m ot2_sars_cov2.batch extraction:num_samples=96 qpcr --fake
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+)
+
+from ot2_sars_cov2.benchmark import (
+    BASELINE,
+    configs,
+    format_metrics,
+    measure,
+    regressions,
+)
+from ot2_sars_cov2.protocols import load_protocol, parse_params, resolve
+
+
+def parse_config(text: str) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Parses a configuration given on the command line.
+
+    Args:
+        text: The protocol, optionally followed by ":" and comma-separated
+            name=value run() arguments.
+
+    Returns:
+        (name, protocol, run() keyword arguments), named after the text.
+    """
+    protocol, _, arguments = text.partition(":")
+    # values may contain commas themselves, e.g. tuples of stage names
+    items = re.split(r",(?=\w+=)", arguments) if arguments else []
+    return text, protocol, parse_params(items)
+
+
+def warm_up(protocols: List[str], fake: bool):
+    """
+    Prepares a worker process before its first configuration.
+
+    Args:
+        protocols: The protocols the worker may be given.
+        fake: Whether the worker records against the fake context, which
+            needs no opentrons import.
+    """
+    if not fake:
+        import opentrons.simulate  # noqa: F401
+    for protocol in protocols:
+        load_protocol(protocol)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Simulate protocol configurations in parallel."
+    )
+    parser.add_argument(
+        "config",
+        nargs="*",
+        help="protocol[:name=value,...]; the benchmark matrix when omitted",
+    )
+    parser.add_argument(
+        "-k",
+        dest="pattern",
+        default="",
+        help="only run configurations whose name contains this string",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes",
+    )
+    parser.add_argument(
+        "--baseline", type=Path, default=BASELINE, help="baseline JSON file"
+    )
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="simulate with the fake context from ot2_sars_cov2.fake",
+    )
+    parser.add_argument(
+        "--json", type=Path, help="write the metrics of every run to this file"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        pool = [parse_config(text) for text in args.config] or configs()
+        for _, protocol, _ in pool:
+            resolve(protocol)
+    except ValueError as error:
+        parser.error(str(error))
+    pool = [config for config in pool if args.pattern in config[0]]
+    baseline = {}
+    if not args.config and args.baseline.is_file():
+        baseline = json.loads(args.baseline.read_text())
+
+    start = time.monotonic()
+    results = {}
+    failed = False
+    protocols = sorted({protocol for _, protocol, _ in pool})
+    with concurrent.futures.ProcessPoolExecutor(
+        args.jobs, initializer=warm_up, initargs=(protocols, args.fake)
+    ) as executor:
+        # the largest runs go first so no worker is left with one at the end
+        futures = {
+            executor.submit(measure, protocol, params, args.fake): name
+            for name, protocol, params in sorted(
+                pool, key=lambda config: -config[2].get("num_samples", 0)
+            )
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as error:
+                failed = True
+                print(
+                    "{}: FAILED {}: {}".format(
+                        name, type(error).__name__, error
+                    )
+                )
+                continue
+            print(format_metrics(name, results[name]), flush=True)
+            if name in baseline:
+                for problem in regressions(baseline[name], results[name]):
+                    failed = True
+                    print("  REGRESSION {}".format(problem))
+
+    print(
+        "{} configurations in {:.1f}s on {} workers".format(
+            len(pool), time.monotonic() - start, args.jobs
+        )
+    )
+    if args.json:
+        args.json.write_text(
+            json.dumps(results, indent=2, sort_keys=True) + "\n"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+Simulation benchmarks with regression thresholds.
+
+Each configuration from configs() is recorded with opentrons.simulate and reduced
+to a set of metrics: command count, tips used per rack, aspirate, dispense
+and mix counts, the estimated run time and the part of it spent on gantry
+travel, and the CPU time the simulation took.
+The results are compared against the committed baseline and the run fails
+when a metric grows past its threshold.
+
+Usage:
+    python -m ot2_sars_cov2.benchmark            # compare with the baseline
+    python -m ot2_sars_cov2.benchmark --update   # rewrite the baseline
+    python -m ot2_sars_cov2.benchmark --fake     # use the fake context
+"""
+import argparse
+import collections
+import json
+import sys
+import time
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+)
+
+from ot2_sars_cov2.estimator import estimate
+from ot2_sars_cov2.fake import ProtocolContext
+from ot2_sars_cov2.protocols import ROOT
+from ot2_sars_cov2.recorder import record
+
+BASELINE = ROOT / "benchmarks" / "baseline.json"
+
+SAMPLE_COUNTS = (8, 48, 96)
+MODES = {
+    "extraction": {
+        "default": {},
+        "distribute": {
+            "small_vol_mode": "distribute",
+            "wash_mode": "distribute",
+        },
+        "combined": {
+            "small_vol_mode": "combined",
+            "wash_mode": "distribute",
+        },
+        "fill_delays": {
+            "small_vol_mode": "combined",
+            "wash_mode": "distribute",
+            "fill_delays": True,
+        },
+        "qpcr_setup": {"qpcr_setup": True},
+        "park_tips": {"park_tips": True},
+        "nearest_tips": {
+            "nearest_tip_stages": (
+                "add_proteinase_k",
+                "add_beads",
+                "add_ms2",
+                "discard_supernatant",
+                "wash_beads",
+                "elute",
+                "make_qPCR_plate",
+            ),
+        },
+        # the distribute modes, which merge_aspirations repacks
+        "plan_passes": {
+            "small_vol_mode": "distribute",
+            "wash_mode": "distribute",
+            "plan_passes": (
+                "drop_mixes",
+                "merge_aspirations",
+                "drop_blow_outs",
+                "resuspend",
+            ),
+        },
+    },
+    "qpcr": {
+        "default": {},
+        "master_mix_first": {"master_mix_first": True},
+        "nearest_tips": {
+            "master_mix_first": True,
+            "nearest_tip_stages": ("distribute_master_mix", "aliquot_eluent"),
+        },
+    },
+}
+
+# Allowed relative growth per metric before it counts as a regression. CPU
+# time depends on the machine, so it only catches gross slowdowns.
+THRESHOLDS = {
+    "commands": 0.0,
+    "tips": 0.0,
+    "aspirates": 0.0,
+    "dispenses": 0.0,
+    "mixes": 0.0,
+    "estimated_s": 0.01,
+    "travel_s": 0.01,
+    "cpu_s": 1.0,
+}
+# Growth below these absolute amounts is never reported, to ignore timer noise
+# on short simulations.
+TOLERANCES = {
+    "cpu_s": 0.5,
+}
+
+
+def configs() -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Lists the benchmark configurations.
+
+    Returns:
+        (name, protocol, run() keyword arguments) for every configuration.
+    """
+    result = []
+    for protocol, modes in MODES.items():
+        for mode, params in modes.items():
+            for num_samples in SAMPLE_COUNTS:
+                name = "{}-{}-{}".format(protocol, mode, num_samples)
+                result.append(
+                    (name, protocol, dict(params, num_samples=num_samples))
+                )
+    return result
+
+
+def tips_used(trace: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Counts the tips a run uses up, per rack.
+
+    Args:
+        trace: The command trace from record().
+
+    Returns:
+        The number of tips picked up from each rack, by rack label. A tip
+        returned to its rack well and picked up from there again, e.g. a
+        parked supernatant tip, counts once.
+    """
+    tips_per_rack = collections.Counter()
+    returned = set()
+    for entry in trace:
+        tip = (entry.get("labware"), entry.get("well"))
+        if entry["command"] == "return_tip":
+            returned.add(tip)
+        elif entry["command"] == "pick_up_tip" and tip in returned:
+            returned.remove(tip)
+        elif entry["command"] == "pick_up_tip":
+            tips_per_rack[entry["labware"]] += 1
+    return tips_per_rack
+
+
+def measure(
+    protocol: str, params: Dict[str, Any], fake: bool = False
+) -> Dict[str, Any]:
+    """
+    Simulates one configuration and collects its metrics.
+
+    Args:
+        protocol: The protocol name or path.
+        params: Keyword arguments for the protocol's run().
+        fake: Record against the fake context instead of opentrons.simulate.
+
+    Returns:
+        The metrics for the configuration.
+    """
+    start = time.process_time()
+    context = ProtocolContext() if fake else None
+    trace = record(protocol, context, **params)
+    cpu_s = time.process_time() - start
+
+    counts = collections.Counter(entry["command"] for entry in trace)
+    estimated = estimate(trace)
+    tips_per_rack = tips_used(trace)
+    return {
+        "commands": len(trace),
+        "tips": sum(tips_per_rack.values()),
+        "tips_per_rack": dict(sorted(tips_per_rack.items())),
+        "aspirates": counts["aspirate"],
+        "dispenses": counts["dispense"],
+        "mixes": counts["mix"],
+        "estimated_s": round(estimated["total"], 1),
+        "travel_s": round(estimated["travel"], 1),
+        "cpu_s": round(cpu_s, 2),
+    }
+
+
+def regressions(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """
+    Compares metrics against the baseline.
+
+    Args:
+        baseline: The baseline metrics for one configuration.
+        current: The current metrics for the same configuration.
+
+    Returns:
+        A description of every metric that grew past its threshold.
+    """
+    found = []
+    for metric, threshold in THRESHOLDS.items():
+        before, after = baseline[metric], current[metric]
+        if after > before * (1 + threshold) + TOLERANCES.get(metric, 0):
+            found.append(
+                "{}: {} -> {} (+{:.1%}, allowed {:.0%})".format(
+                    metric,
+                    before,
+                    after,
+                    (after - before) / before if before else float("inf"),
+                    threshold,
+                )
+            )
+    for rack, count in current["tips_per_rack"].items():
+        if count > baseline["tips_per_rack"].get(rack, 0):
+            found.append(
+                "tips from {}: {} -> {}".format(
+                    rack, baseline["tips_per_rack"].get(rack, 0), count
+                )
+            )
+    return found
+
+
+def format_metrics(name: str, metrics: Dict[str, Any]) -> str:
+    """
+    Formats the metrics of one configuration as a report line.
+    """
+    return (
+        "{}: {} commands, {} tips, {} aspirates, {} dispenses, {} mixes, "
+        "est {:.0f}s, travel {:.0f}s, cpu {:.2f}s".format(
+            name,
+            metrics["commands"],
+            metrics["tips"],
+            metrics["aspirates"],
+            metrics["dispenses"],
+            metrics["mixes"],
+            metrics["estimated_s"],
+            metrics["travel_s"],
+            metrics["cpu_s"],
+        )
+    )
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Run the simulation benchmarks."
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="write the results as the new baseline",
+    )
+    parser.add_argument(
+        "--baseline", type=Path, default=BASELINE, help="baseline JSON file"
+    )
+    parser.add_argument(
+        "-k",
+        dest="pattern",
+        default="",
+        help="only run configurations whose name contains this string",
+    )
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="simulate with the fake context from ot2_sars_cov2.fake",
+    )
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline.is_file():
+        baseline = json.loads(args.baseline.read_text())
+
+    results = {}
+    failed = False
+    for name, protocol, params in configs():
+        if args.pattern not in name:
+            continue
+        results[name] = measure(protocol, params, args.fake)
+        metrics = results[name]
+        print(format_metrics(name, metrics))
+        if not args.update and name in baseline:
+            for problem in regressions(baseline[name], metrics):
+                failed = True
+                print("  REGRESSION {}".format(problem))
+
+    if args.update:
+        baseline.update(results)
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(
+            json.dumps(baseline, indent=2, sort_keys=True) + "\n"
+        )
+        print("Wrote {}".format(args.baseline))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
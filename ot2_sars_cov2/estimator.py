@@ -0,0 +1,267 @@
+"""
+Static run-duration estimate for the protocols.
+
+The protocol is recorded against a simulated context (see recorder.py) and a
+cost model is applied to the trace:
+
+- aspirate, dispense, mix and blow out time from the volume and the flow rate
+  in effect when the command was issued,
+- a fixed cost for tip pick up and drop, touch tip and air gap,
+- gantry travel between consecutive command locations, arcing over the deck
+  whenever the pipette moves to a different labware,
+- protocol delays, magnet engage/disengage and temperature module ramps.
+
+Operator pauses are counted but not timed.
+
+Usage:
+    python -m ot2_sars_cov2.estimator extraction -p num_samples=30
+    python -m ot2_sars_cov2.estimator extraction --fake
+"""
+import argparse
+import collections
+import math
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+)
+
+# Gantry
+XY_SPEED = 400.0  # mm/s
+Z_SPEED = 125.0  # mm/s
+SAFE_Z = 120.0  # mm, arc height when moving between labware
+MOVE_OVERHEAD_S = 0.3  # acceleration and settling per move
+
+# Pipetting
+PLUNGER_OVERHEAD_S = 0.3  # per aspirate or dispense stroke
+PICK_UP_TIP_S = 3.0  # pressing onto the tip, excluding travel
+DROP_TIP_S = 2.5  # ejecting the tip, excluding travel
+TOUCH_TIP_S = 2.0
+AIR_GAP_S = 1.0
+
+# Modules
+ENGAGE_S = 5.0
+DISENGAGE_S = 5.0
+START_TEMP = 25.0  # C, modules start the run at room temperature
+# Temperature Module ramp rates (C/s) by temperature range, following the
+# GEN2 Temperature Module white paper.
+TEMP_RATE_BELOW_25 = 0.0875
+TEMP_RATE_25_TO_37 = 0.2
+TEMP_RATE_ABOVE_37 = 0.3611
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Formats a duration as e.g. "1h02m03s" or "14m32s".
+
+    Args:
+        seconds: The duration in seconds.
+
+    Returns:
+        The formatted duration.
+    """
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return "{}h{:02d}m{:02d}s".format(hours, minutes, seconds)
+    return "{}m{:02d}s".format(minutes, seconds)
+
+
+def ramp_seconds(start: float, target: float) -> float:
+    """
+    Time for a temperature module to go from start to target.
+
+    Args:
+        start: The starting temperature in C.
+        target: The target temperature in C.
+
+    Returns:
+        The ramp time in seconds.
+    """
+    low, high = sorted((start, target))
+    seconds = 0.0
+    for lower, upper, rate in (
+        (-math.inf, 25.0, TEMP_RATE_BELOW_25),
+        (25.0, 37.0, TEMP_RATE_25_TO_37),
+        (37.0, math.inf, TEMP_RATE_ABOVE_37),
+    ):
+        span = min(high, upper) - max(low, lower)
+        if span > 0:
+            seconds += span / rate
+    return seconds
+
+
+def travel_seconds(previous: Dict[str, Any], entry: Dict[str, Any]) -> float:
+    """
+    Gantry travel time between two trace entries.
+
+    Args:
+        previous: The entry the pipette is moving from.
+        entry: The entry the pipette is moving to.
+
+    Returns:
+        The travel time in seconds.
+    """
+    if "point" not in previous or "point" not in entry:
+        return 0.0
+    x0, y0, z0 = previous["point"]
+    x1, y1, z1 = entry["point"]
+    xy = math.hypot(x1 - x0, y1 - y0)
+    if xy == 0 and z0 == z1:
+        return 0.0
+    if previous.get("labware") != entry.get("labware"):
+        z = max(SAFE_Z - z0, 0) + max(SAFE_Z - z1, 0)
+    else:
+        z = abs(z1 - z0)
+    return xy / XY_SPEED + z / Z_SPEED + MOVE_OVERHEAD_S
+
+
+def command_seconds(entry: Dict[str, Any]) -> float:
+    """
+    Time spent on a liquid handling or module command, excluding travel and
+    temperature ramps.
+
+    Args:
+        entry: The trace entry.
+
+    Returns:
+        The command time in seconds.
+    """
+    command = entry["command"]
+    volume = entry.get("volume") or 0.0
+    if command in ("aspirate", "dispense"):
+        return volume / entry["flow_rate"] + PLUNGER_OVERHEAD_S
+    if command == "mix":
+        stroke = volume / entry["flow_rate"] + volume / entry["dispense_rate"]
+        return entry["repetitions"] * (stroke + 2 * PLUNGER_OVERHEAD_S)
+    if command == "blow_out":
+        return PLUNGER_OVERHEAD_S + 1.0
+    if command == "pick_up_tip":
+        return PICK_UP_TIP_S
+    if command in ("drop_tip", "return_tip"):
+        return DROP_TIP_S
+    if command == "touch_tip":
+        return TOUCH_TIP_S
+    if command == "air_gap":
+        return AIR_GAP_S
+    if command == "delay":
+        return entry["seconds"]
+    if command == "engage":
+        return ENGAGE_S
+    if command == "disengage":
+        return DISENGAGE_S
+    return 0.0
+
+
+def estimate(trace: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Applies the cost model to a command trace.
+
+    Args:
+        trace: The command trace from recorder.record().
+
+    Returns:
+        A dict with the per-stage durations in run order ("stages", a list of
+        (name, seconds) pairs), the "total" duration in seconds, the part of
+        it spent on gantry "travel", the number of operator "pauses" and the
+        per-command durations ("durations").
+    """
+    clock = 0.0
+    temps = collections.defaultdict(lambda: START_TEMP)
+    ramps_done = {}  # module slot -> clock time the ramp finishes
+    previous = {}
+    travel = 0.0
+    stages = collections.OrderedDict()
+    durations = []
+    pauses = 0
+    for entry in trace:
+        seconds = command_seconds(entry)
+        if "mount" in entry:
+            moving = travel_seconds(previous, entry)
+            travel += moving
+            seconds += moving
+            previous = entry
+
+        command = entry["command"]
+        if command in ("set_temperature", "start_set_temperature"):
+            module = entry["module"]
+            ramp = ramp_seconds(temps[module], entry["celsius"])
+            temps[module] = entry["celsius"]
+            ramps_done[module] = clock + ramp
+            if command == "set_temperature":
+                seconds += ramp
+        elif command == "await_temperature":
+            seconds += max(0.0, ramps_done.get(entry["module"], 0.0) - clock)
+        elif command == "pause":
+            pauses += 1
+
+        clock += seconds
+        durations.append(seconds)
+        stages[entry["stage"]] = stages.get(entry["stage"], 0.0) + seconds
+    return {
+        "stages": list(stages.items()),
+        "total": clock,
+        "travel": travel,
+        "pauses": pauses,
+        "durations": durations,
+    }
+
+
+def report(result: Dict[str, Any]) -> List[str]:
+    """
+    Formats an estimate as report lines.
+
+    Args:
+        result: The result of estimate().
+
+    Returns:
+        One line per stage followed by the gantry travel and the total.
+    """
+    lines = [
+        "{}: {}".format(stage, format_duration(seconds))
+        for stage, seconds in result["stages"]
+        if seconds
+    ]
+    lines.append("gantry travel: {}".format(format_duration(result["travel"])))
+    lines.append(
+        "total: {} ({} operator pauses not included)".format(
+            format_duration(result["total"]), result["pauses"]
+        )
+    )
+    return lines
+
+
+def main(argv: List[str] = None):
+    from ot2_sars_cov2.fake import ProtocolContext
+    from ot2_sars_cov2.protocols import parse_params
+    from ot2_sars_cov2.recorder import record
+
+    parser = argparse.ArgumentParser(
+        description="Estimate the run duration of a protocol."
+    )
+    parser.add_argument(
+        "protocol", help="extraction, qpcr or a path to a protocol file"
+    )
+    parser.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        default=[],
+        help="run() keyword argument as name=value, e.g. num_samples=30",
+    )
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="simulate with the fake context from ot2_sars_cov2.fake",
+    )
+    args = parser.parse_args(argv)
+    context = ProtocolContext() if args.fake else None
+    trace = record(args.protocol, context, **parse_params(args.param))
+    for line in report(estimate(trace)):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
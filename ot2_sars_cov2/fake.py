@@ -0,0 +1,586 @@
+"""
+A lightweight stand-in for the Opentrons ProtocolContext.
+
+opentrons.simulate sets up a simulated hardware controller for every context,
+which takes far longer than the protocols' own logic. The classes here
+implement only the parts of the Protocol API that the two protocols and the
+recorder use, on top of the labware, module, deck and pipette definitions from
+opentrons_shared_data, so well positions, volumes and default flow rates match
+a simulated run. Nothing moves and no command messages are built; record() a
+protocol against a ProtocolContext from this module to get its command trace:
+
+    trace = record("extraction", context=ProtocolContext(), num_samples=48)
+
+The pipettes still check what the robot would refuse: picking up a tip with
+one attached, running out of tips, handling liquid without a tip and
+aspirating more than the tip holds.
+"""
+import functools
+import math
+import types
+from typing import (
+    Any,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+from opentrons_shared_data.deck import load as load_deck
+from opentrons_shared_data.labware import load_definition
+from opentrons_shared_data.module import load_definition as load_module_def
+from opentrons_shared_data.pipette import name_config
+
+API_VERSION = "2.7"
+DECK_TYPE = "ot2_standard"
+FIXED_TRASH_SLOT = 12
+LABWARE_VERSION = 1
+
+# load_module() names, as the protocols spell them, and their definitions
+MODULE_MODELS = {
+    "magdeck": "magneticModuleV1",
+    "magnetic module": "magneticModuleV1",
+    "magnetic module gen2": "magneticModuleV2",
+    "tempdeck": "temperatureModuleV1",
+    "temperature module": "temperatureModuleV1",
+    "temperature module gen2": "temperatureModuleV2",
+}
+MODULE_SCHEMA = "2"
+
+
+class OutOfTipsError(Exception):
+    """
+    Raised when a pipette has no tips left in its tip racks.
+    """
+
+
+class Point(NamedTuple):
+    x: float
+    y: float
+    z: float
+
+
+class Location(NamedTuple):
+    """
+    A point within a well; the well stands in for the opentrons LabwareLike.
+    """
+
+    point: Point
+    labware: "Well"
+
+
+@functools.lru_cache(maxsize=None)
+def labware_definition(load_name: str) -> Dict[str, Any]:
+    return load_definition(load_name, LABWARE_VERSION)
+
+
+@functools.lru_cache(maxsize=None)
+def module_definition(model: str) -> Dict[str, Any]:
+    return load_module_def(MODULE_SCHEMA, model)
+
+
+@functools.lru_cache(maxsize=None)
+def slot_positions() -> Dict[int, Point]:
+    return {
+        int(slot["id"]): Point(*slot["position"])
+        for slot in load_deck(DECK_TYPE)["locations"]["orderedSlots"]
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def pipette_config(name: str) -> Dict[str, Any]:
+    return name_config()[name]
+
+
+def api_level_value(setting: Dict[str, Any], api_version: str) -> float:
+    """
+    Picks the value of a pipette setting for an API level.
+
+    Args:
+        setting: The setting from the pipette name config.
+        api_version: The protocol's API level, e.g. "2.7".
+
+    Returns:
+        The value for the highest level at or below api_version.
+    """
+    level = tuple(int(part) for part in api_version.split("."))
+    values = sorted(
+        (tuple(int(part) for part in key.split(".")), value)
+        for key, value in setting.get("valuesByApiLevel", {}).items()
+    )
+    result = setting["value"]
+    for key, value in values:
+        if key <= level:
+            result = value
+    return result
+
+
+class Well:
+    """
+    A well of a Labware, positioned in deck coordinates.
+    """
+
+    is_empty = False
+
+    def __init__(self, parent: "Labware", name: str, definition: dict, origin):
+        self.parent = parent
+        self.well_name = name
+        self.depth = definition["depth"]
+        self.max_volume = definition["totalLiquidVolume"]
+        self.diameter = definition.get("diameter")
+        self.length = definition.get("xDimension")
+        self.width = definition.get("yDimension")
+        self.has_tip = parent.is_tiprack
+        # summed in the order opentrons' WellGeometry does, so positions agree
+        # to the last bit
+        self._top = Point(
+            definition["x"] + origin.x,
+            definition["y"] + origin.y,
+            definition["z"] + self.depth + origin.z,
+        )
+
+    def __repr__(self):
+        return "{} of {}".format(self.well_name, self.parent)
+
+    def top(self, z: float = 0.0) -> Location:
+        x, y, top = self._top
+        return Location(Point(x, y, top + z), self)
+
+    def bottom(self, z: float = 0.0) -> Location:
+        x, y, top = self._top
+        return Location(Point(x, y, top - self.depth + z), self)
+
+    def center(self) -> Location:
+        x, y, top = self._top
+        return Location(Point(x, y, top - self.depth / 2.0), self)
+
+    def get_parent_labware_and_well(self):
+        return self.parent, self
+
+    def first_parent(self) -> str:
+        return self.parent.slot
+
+
+class Labware:
+    """
+    A labware on the deck or on a module, built from its definition.
+    """
+
+    def __init__(
+        self,
+        load_name: str,
+        parent: Union[str, "ModuleGeometry"],
+        label: str = None,
+    ):
+        definition = labware_definition(load_name)
+        self.load_name = load_name
+        self.name = label or load_name
+        self.parent = parent
+        self.is_tiprack = definition["parameters"]["isTiprack"]
+        if isinstance(parent, ModuleGeometry):
+            self.slot = parent.parent
+            offset = parent.labware_offset
+        else:
+            self.slot = str(parent)
+            offset = slot_positions()[int(parent)]
+        corner = definition["cornerOffsetFromSlot"]
+        origin = Point(
+            offset.x + corner["x"],
+            offset.y + corner["y"],
+            offset.z + corner["z"],
+        )
+        self._columns = [
+            [
+                Well(self, name, definition["wells"][name], origin)
+                for name in col
+            ]
+            for col in definition["ordering"]
+        ]
+        self._wells = [well for column in self._columns for well in column]
+        self._by_name = {well.well_name: well for well in self._wells}
+        row_names = sorted({name[0] for name in self._by_name})
+        self._rows = [
+            [well for well in self._wells if well.well_name[0] == row]
+            for row in row_names
+        ]
+
+    def __repr__(self):
+        return "{} on {}".format(self.name, self.slot)
+
+    def __getitem__(self, name: str) -> Well:
+        return self._by_name[name]
+
+    def wells(self) -> List[Well]:
+        return list(self._wells)
+
+    def wells_by_name(self) -> Dict[str, Well]:
+        return dict(self._by_name)
+
+    def columns(self) -> List[List[Well]]:
+        return [list(column) for column in self._columns]
+
+    def rows(self) -> List[List[Well]]:
+        return [list(row) for row in self._rows]
+
+    def next_tip(self, num_tips: int = 1) -> Well:
+        """
+        The first well starting num_tips tips in a row down one column, as in
+        opentrons.protocol_api.labware.Labware.next_tip().
+        """
+        for column in self._columns:
+            run = []
+            for well in column:
+                if well.has_tip:
+                    run.append(well)
+                elif run:
+                    break
+            if len(run) >= num_tips:
+                return run[0]
+        return None
+
+    def use_tips(self, start_well: Well, num_channels: int = 1):
+        for column in self._columns:
+            if start_well in column:
+                start = column.index(start_well)
+                for well in column[start : start + num_channels]:
+                    well.has_tip = False
+
+    def return_tips(self, start_well: Well, num_channels: int = 1):
+        for column in self._columns:
+            if start_well in column:
+                start = column.index(start_well)
+                for well in column[start : start + num_channels]:
+                    well.has_tip = True
+
+    def reset(self):
+        for well in self._wells:
+            well.has_tip = self.is_tiprack
+
+
+class InstrumentContext:
+    """
+    A pipette that keeps track of its tip and the volume it holds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        mount: str,
+        tip_racks: List[Labware],
+        trash: Labware,
+        api_version: str = API_VERSION,
+    ):
+        config = pipette_config(name)
+        self.name = name
+        self.mount = mount
+        self.channels = config["channels"]
+        self.max_volume = config["maxVolume"]
+        self.min_volume = config["minVolume"]
+        self.tip_racks = list(tip_racks or [])
+        self.trash_container = trash
+        self.flow_rate = types.SimpleNamespace(
+            aspirate=api_level_value(
+                config["defaultAspirateFlowRate"], api_version
+            ),
+            dispense=api_level_value(
+                config["defaultDispenseFlowRate"], api_version
+            ),
+            blow_out=api_level_value(
+                config["defaultBlowOutFlowRate"], api_version
+            ),
+        )
+        self.well_bottom_clearance = types.SimpleNamespace(
+            aspirate=1.0, dispense=1.0
+        )
+        self.current_volume = 0.0
+        self._api_level = tuple(int(part) for part in api_version.split("."))
+        self._tip_volume = None  # type: Optional[float]
+        self._last_tip_picked_up_from = None  # type: Optional[Well]
+
+    def __repr__(self):
+        return "{} on {}".format(self.name, self.mount)
+
+    @property
+    def has_tip(self) -> bool:
+        return self._tip_volume is not None
+
+    @property
+    def hw_pipette(self) -> Dict[str, Any]:
+        working_volume = min(self.max_volume, self._tip_volume or math.inf)
+        return {
+            "name": self.name,
+            "channels": self.channels,
+            "max_volume": self.max_volume,
+            "min_volume": self.min_volume,
+            "working_volume": working_volume,
+            "available_volume": working_volume - self.current_volume,
+            "current_volume": self.current_volume,
+            "has_tip": self.has_tip,
+        }
+
+    def _require_tip(self, action: str):
+        if not self.has_tip:
+            raise RuntimeError(
+                "Cannot {} without a tip attached to {}".format(action, self)
+            )
+
+    def _take(self, volume: float):
+        available = self.hw_pipette["available_volume"]
+        volume = volume or available
+        if volume > available + 1e-9:
+            raise RuntimeError(
+                "Cannot aspirate {}uL into {} holding {}uL of {}uL".format(
+                    volume,
+                    self,
+                    self.current_volume,
+                    self.hw_pipette["working_volume"],
+                )
+            )
+        self.current_volume += volume
+
+    def pick_up_tip(self, location=None, presses=None, increment=None):
+        if self.has_tip:
+            raise RuntimeError("{} already has a tip attached".format(self))
+        if location is None:
+            for rack in self.tip_racks:
+                well = rack.next_tip(self.channels)
+                if well is not None:
+                    break
+            else:
+                raise OutOfTipsError(
+                    "{} has no tips left in {}".format(self, self.tip_racks)
+                )
+        elif isinstance(location, Location):
+            well = location.labware
+        else:
+            well = location
+        well.parent.use_tips(well, self.channels)
+        self._tip_volume = well.parent.wells()[0].max_volume
+        self._last_tip_picked_up_from = well
+        return self
+
+    def drop_tip(self, location=None, home_after=True):
+        self._tip_volume = None
+        self.current_volume = 0.0
+        well = location.labware if isinstance(location, Location) else location
+        # Like the real API, a tip dropped into a tip rack is only available
+        # again below API level 2.2; from 2.2 on, return_tip() leaves the well
+        # marked used and the tip can only be picked up again by location.
+        if (
+            isinstance(well, Well)
+            and well.parent.is_tiprack
+            and self._api_level < (2, 2)
+        ):
+            well.parent.return_tips(well, self.channels)
+        return self
+
+    def return_tip(self, home_after=True):
+        self._require_tip("return a tip")
+        return self.drop_tip(self._last_tip_picked_up_from)
+
+    def reset_tipracks(self):
+        for rack in self.tip_racks:
+            rack.reset()
+
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        self._require_tip("aspirate")
+        self._take(volume)
+        return self
+
+    def dispense(self, volume=None, location=None, rate=1.0):
+        self._require_tip("dispense")
+        volume = volume or self.current_volume
+        self.current_volume = max(0.0, self.current_volume - volume)
+        return self
+
+    def mix(self, repetitions=1, volume=None, location=None, rate=1.0):
+        self._require_tip("mix")
+        volume = volume or self.hw_pipette["available_volume"]
+        if self.current_volume + volume > self.hw_pipette["working_volume"]:
+            raise RuntimeError("Cannot mix {}uL with {}".format(volume, self))
+        return self
+
+    def blow_out(self, location=None):
+        self.current_volume = 0.0
+        return self
+
+    def touch_tip(self, location=None, radius=1.0, v_offset=-1.0, speed=60.0):
+        self._require_tip("touch tip")
+        return self
+
+    def air_gap(self, volume=None, height=None):
+        self._require_tip("air gap")
+        self._take(volume)
+        return self
+
+    def move_to(self, location, force_direct=False, minimum_z_height=None):
+        return self
+
+
+class ModuleGeometry:
+    """
+    Where a module sits and where its labware goes.
+    """
+
+    def __init__(self, model: str, slot: int):
+        definition = module_definition(model)
+        self.model = model
+        self.display_name = definition["displayName"]
+        self.parent = str(slot)
+        position = slot_positions()[slot]
+        offset = definition["labwareOffset"]
+        self.labware_offset = Point(
+            position.x + offset["x"],
+            position.y + offset["y"],
+            position.z + offset["z"],
+        )
+
+    def __str__(self):
+        return "{} on {}".format(self.display_name, self.parent)
+
+
+class ModuleContext:
+    """
+    A module holding at most one labware.
+    """
+
+    def __init__(self, model: str, slot: int):
+        self.geometry = ModuleGeometry(model, slot)
+        self.labware = None  # type: Optional[Labware]
+
+    def load_labware(self, name: str, label: str = None, **kwargs) -> Labware:
+        if self.labware is not None:
+            raise ValueError("{} already holds a labware".format(self.geometry))
+        self.labware = Labware(name, self.geometry, label)
+        return self.labware
+
+
+class MagneticModuleContext(ModuleContext):
+    status = "disengaged"
+
+    def engage(self, height=None, offset=None, height_from_base=None):
+        self.status = "engaged"
+
+    def disengage(self):
+        self.status = "disengaged"
+
+
+class TemperatureModuleContext(ModuleContext):
+    temperature = 25.0
+    target = None
+
+    def set_temperature(self, celsius: float):
+        self.temperature = self.target = celsius
+
+    def start_set_temperature(self, celsius: float):
+        self.target = celsius
+
+    def await_temperature(self, celsius: float):
+        self.temperature = celsius
+
+    def deactivate(self):
+        self.target = None
+
+
+class ProtocolContext:
+    """
+    The deck, modules and pipettes of a run; delays and pauses return at once.
+    """
+
+    def __init__(self, api_version: str = API_VERSION):
+        self.api_version = api_version
+        self.deck = {}  # type: Dict[int, Union[Labware, ModuleContext]]
+        self.fixed_trash = self.load_labware(
+            "opentrons_1_trash_1100ml_fixed", FIXED_TRASH_SLOT
+        )
+        self._instruments = {}  # type: Dict[str, InstrumentContext]
+
+    def _claim(self, location) -> int:
+        slot = int(location)
+        if slot not in slot_positions():
+            raise ValueError("No deck slot {}".format(location))
+        if slot in self.deck:
+            raise ValueError(
+                "Slot {} already holds {}".format(slot, self.deck[slot])
+            )
+        return slot
+
+    def is_simulating(self) -> bool:
+        return True
+
+    def load_labware(
+        self, load_name: str, location, label: str = None, **kwargs
+    ) -> Labware:
+        slot = self._claim(location)
+        self.deck[slot] = Labware(load_name, str(slot), label)
+        return self.deck[slot]
+
+    def load_module(
+        self, module_name: str, location=None, configuration=None
+    ) -> ModuleContext:
+        model = MODULE_MODELS[module_name.lower()]
+        slot = self._claim(location)
+        if model.startswith("magnetic"):
+            self.deck[slot] = MagneticModuleContext(model, slot)
+        else:
+            self.deck[slot] = TemperatureModuleContext(model, slot)
+        return self.deck[slot]
+
+    def load_instrument(
+        self,
+        instrument_name: str,
+        mount: str,
+        tip_racks: List[Labware] = None,
+        replace: bool = False,
+    ) -> InstrumentContext:
+        mount = mount.lower()
+        if mount in self._instruments and not replace:
+            raise ValueError(
+                "A pipette is already on the {} mount".format(mount)
+            )
+        self._instruments[mount] = InstrumentContext(
+            instrument_name,
+            mount,
+            tip_racks,
+            self.fixed_trash,
+            self.api_version,
+        )
+        return self._instruments[mount]
+
+    @property
+    def loaded_instruments(self) -> Dict[str, InstrumentContext]:
+        return dict(self._instruments)
+
+    @property
+    def loaded_modules(self) -> Dict[int, ModuleContext]:
+        return {
+            slot: item
+            for slot, item in self.deck.items()
+            if isinstance(item, ModuleContext)
+        }
+
+    @property
+    def loaded_labwares(self) -> Dict[int, Labware]:
+        labwares = {}
+        for slot, item in sorted(self.deck.items()):
+            if isinstance(item, ModuleContext):
+                item = item.labware
+            if item is not None:
+                labwares[slot] = item
+        return labwares
+
+    def comment(self, msg: str):
+        pass
+
+    def pause(self, msg: str = None):
+        pass
+
+    def resume(self):
+        pass
+
+    def delay(self, seconds: float = 0, minutes: float = 0, msg: str = None):
+        pass
+
+    def home(self):
+        pass
@@ -0,0 +1,395 @@
+"""
+Deck layout search for the least gantry travel.
+
+The protocol is recorded once with its own slot constants. Every move of the
+gantry between two deck slots in the trace is kept relative to the slots it
+starts and ends in, so the travel of any other arrangement of the same slots
+follows by moving the slot positions. A layout swaps the contents of slots
+1 to 11, with modules only going to the side columns; the fixed trash stays
+in slot 12. Moves within one slot and the arcs over the deck do not depend
+on the layout, so the search minimizes the XY travel.
+
+The search climbs from the current layout and from random ones by swapping
+pairs of slots while that shortens the travel. The best layout is simulated
+again with the new slots to confirm it runs, and the slot constants are
+printed as a block to paste into the protocol. The layout is only searched
+for the run() arguments and SETTINGS values given; constants that are not
+loaded for them are left out.
+
+Usage:
+    python -m ot2_sars_cov2.layout extraction -p num_samples=96
+    python -m ot2_sars_cov2.layout qpcr --restarts 50 --fake
+    python -m ot2_sars_cov2.layout qpcr -s TIP_MAX_DETOUR_MM=100 --fake
+"""
+import argparse
+import collections
+import copy
+import itertools
+import json
+import math
+import random
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+)
+
+from ot2_sars_cov2.estimator import SAFE_Z, XY_SPEED, estimate, format_duration
+from ot2_sars_cov2.fake import (
+    DECK_TYPE,
+    FIXED_TRASH_SLOT,
+    ProtocolContext,
+    load_deck,
+    slot_positions,
+)
+from ot2_sars_cov2.protocols import load_protocol, parse_params
+from ot2_sars_cov2.recorder import record
+from ot2_sars_cov2.sweep import apply_settings
+
+SLOTS = tuple(range(1, FIXED_TRASH_SLOT))
+# The deck definition accepts modules in any slot, but like the Protocol
+# Designer we keep them to the side columns so their cables reach
+MODULE_SLOTS = (1, 3, 4, 6, 7, 9, 10)
+# Module contexts by class name, for both opentrons.simulate and the fake
+MODULE_TYPES = {
+    "MagneticModuleContext": "magneticModuleType",
+    "TemperatureModuleContext": "temperatureModuleType",
+}
+
+# (from slot, to slot) -> [(x, y, number of moves)], with x and y the move in
+# mm less the offset between the two slots
+Moves = Dict[Tuple[int, int], List[Tuple[float, float, int]]]
+
+
+def module_slots() -> Dict[str, List[int]]:
+    """
+    Lists the slots each module type may be placed in.
+
+    Returns:
+        The slots by module type.
+    """
+    allowed = collections.defaultdict(list)
+    for slot in load_deck(DECK_TYPE)["locations"]["orderedSlots"]:
+        for module_type in slot["compatibleModuleTypes"]:
+            if int(slot["id"]) in MODULE_SLOTS:
+                allowed[module_type].append(int(slot["id"]))
+    return dict(allowed)
+
+
+def slot_moves(trace: List[Dict[str, Any]]) -> Tuple[Moves, float, float]:
+    """
+    Collects the gantry moves between slots from a command trace.
+
+    Consecutive pipette commands are paired up as in estimator.estimate().
+
+    Args:
+        trace: The command trace from recorder.record().
+
+    Returns:
+        The moves between different slots, the XY travel within slots in mm
+        and the Z travel in mm.
+    """
+    positions = slot_positions()
+    moves = collections.defaultdict(collections.Counter)
+    within_xy = z_travel = 0.0
+    previous = {}
+    for entry in trace:
+        if "mount" not in entry:
+            continue
+        if "point" in previous and "point" in entry:
+            x0, y0, z0 = previous["point"]
+            x1, y1, z1 = entry["point"]
+            if previous.get("labware") != entry.get("labware"):
+                z_travel += max(SAFE_Z - z0, 0) + max(SAFE_Z - z1, 0)
+            else:
+                z_travel += abs(z1 - z0)
+            start, end = int(previous["slot"]), int(entry["slot"])
+            if start == end:
+                within_xy += math.hypot(x1 - x0, y1 - y0)
+            else:
+                dx = x1 - x0 - (positions[end].x - positions[start].x)
+                dy = y1 - y0 - (positions[end].y - positions[start].y)
+                moves[start, end][round(dx, 1), round(dy, 1)] += 1
+        previous = entry
+    return (
+        {
+            pair: [(dx, dy, n) for (dx, dy), n in counts.items()]
+            for pair, counts in moves.items()
+        },
+        within_xy,
+        z_travel,
+    )
+
+
+def travel(moves: Moves, layout: Dict[int, int]) -> float:
+    """
+    XY travel in mm between slots with the slot contents rearranged.
+
+    Args:
+        moves: The moves from slot_moves().
+        layout: The slot each slot's contents move to.
+
+    Returns:
+        The travel in mm.
+    """
+    positions = slot_positions()
+    total = 0.0
+    for (start, end), offsets in moves.items():
+        a = positions[layout.get(start, start)]
+        b = positions[layout.get(end, end)]
+        ox, oy = b.x - a.x, b.y - a.y
+        total += sum(n * math.hypot(dx + ox, dy + oy) for dx, dy, n in offsets)
+    return total
+
+
+def valid(layout: Dict[int, int], modules: Dict[int, str]) -> bool:
+    """
+    Checks that every module goes to a slot it may be placed in.
+    """
+    allowed = module_slots()
+    return all(layout[slot] in allowed[kind] for slot, kind in modules.items())
+
+
+def random_layout(
+    modules: Dict[int, str], rng: random.Random
+) -> Dict[int, int]:
+    """
+    Picks a random valid layout.
+
+    Args:
+        modules: The module type in each slot that holds a module.
+        rng: The random number generator.
+
+    Returns:
+        The slot each slot's contents move to.
+    """
+    allowed = module_slots()
+    while True:
+        layout = {}
+        free = list(SLOTS)
+        for slot, kind in modules.items():
+            layout[slot] = rng.choice([s for s in allowed[kind] if s in free])
+            free.remove(layout[slot])
+        rng.shuffle(free)
+        layout.update(zip([s for s in SLOTS if s not in layout], free))
+        if valid(layout, modules):
+            return layout
+
+
+def climb(
+    moves: Moves, modules: Dict[int, str], layout: Dict[int, int]
+) -> Tuple[float, Dict[int, int]]:
+    """
+    Swaps pairs of slots while that shortens the travel.
+
+    Args:
+        moves: The moves from slot_moves().
+        modules: The module type in each slot that holds a module.
+        layout: The layout to start from.
+
+    Returns:
+        The travel in mm and the layout it climbed to.
+    """
+    best = travel(moves, layout)
+    improved = True
+    while improved:
+        improved = False
+        for a, b in itertools.combinations(SLOTS, 2):
+            candidate = dict(layout)
+            candidate[a], candidate[b] = layout[b], layout[a]
+            if not valid(candidate, modules):
+                continue
+            distance = travel(moves, candidate)
+            if distance < best - 1e-6:
+                best, layout, improved = distance, candidate, True
+    return best, layout
+
+
+def slot_constants(
+    module, context, trace: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Finds the protocol's slot constants that the run loaded.
+
+    Constants are dicts with a "SLOT", or lists of them. Labware constants
+    count as loaded when a labware with their label was on their slot;
+    module constants, which have no label, when a module was. A list counts
+    when all of its items were loaded.
+
+    Args:
+        module: The protocol module.
+        context: The ProtocolContext the protocol was run against.
+        trace: The command trace of the run.
+
+    Returns:
+        The constants by name.
+    """
+    labels = {
+        (int(entry["slot"]), entry["labware"])
+        for entry in trace
+        if "slot" in entry and "labware" in entry
+    }
+    labels.update(
+        (int(slot), labware.name)
+        for slot, labware in context.loaded_labwares.items()
+    )
+    module_slots_used = {int(slot) for slot in context.loaded_modules}
+
+    def loaded(item):
+        if "LABEL" in item:
+            return (item["SLOT"], item["LABEL"]) in labels
+        return item["SLOT"] in module_slots_used
+
+    found = {}
+    for name, value in vars(module).items():
+        items = value if isinstance(value, list) else [value]
+        if not name.isupper() or not items:
+            continue
+        if not all(isinstance(i, dict) and "SLOT" in i for i in items):
+            continue
+        if all(loaded(item) for item in items):
+            found[name] = value
+    return found
+
+
+def apply_layout(value, layout: Dict[int, int]):
+    """
+    Copies a slot constant with its slots moved to the new layout.
+    """
+    value = copy.deepcopy(value)
+    for item in value if isinstance(value, list) else [value]:
+        item["SLOT"] = layout.get(item["SLOT"], item["SLOT"])
+    return value
+
+
+def format_constant(name: str, value) -> str:
+    """
+    Formats a slot constant as protocol source, wrapped at 80 columns.
+
+    Args:
+        name: The constant's name.
+        value: A dict or a list of dicts.
+
+    Returns:
+        The assignment.
+    """
+
+    def one_line(item):
+        return "{{{}}}".format(
+            ", ".join(
+                "{}: {}".format(json.dumps(k), json.dumps(v))
+                for k, v in item.items()
+            )
+        )
+
+    def expanded(item, indent):
+        lines = [
+            "{}{}: {},".format(indent + "    ", json.dumps(k), json.dumps(v))
+            for k, v in item.items()
+        ]
+        return "{{\n{}\n{}}}".format("\n".join(lines), indent)
+
+    if isinstance(value, dict):
+        line = "{} = {}".format(name, one_line(value))
+        if len(line) <= 80:
+            return line
+        return "{} = {}".format(name, expanded(value, ""))
+    items = ["    {},".format(expanded(item, "    ")) for item in value]
+    return "{} = [\n{}\n]".format(name, "\n".join(items))
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        description="Search deck layouts for the least gantry travel."
+    )
+    parser.add_argument(
+        "protocol", help="extraction, qpcr or a path to a protocol file"
+    )
+    parser.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        default=[],
+        help="run() keyword argument as name=value, e.g. num_samples=30",
+    )
+    parser.add_argument(
+        "-s",
+        "--setting",
+        action="append",
+        default=[],
+        help='SETTINGS value as path=value, with "." between the keys of '
+        "nested dicts, e.g. TIP_MAX_DETOUR_MM=100",
+    )
+    parser.add_argument(
+        "--restarts",
+        type=int,
+        default=20,
+        help="random layouts to climb from besides the current one",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="search seed")
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="simulate with the fake context from ot2_sars_cov2.fake",
+    )
+    args = parser.parse_args(argv)
+    params = parse_params(args.param)
+    settings = parse_params(args.setting)
+
+    def run(protocol):
+        protocol.SETTINGS = apply_settings(protocol.SETTINGS, settings)
+        if args.fake:
+            context = ProtocolContext()
+        else:
+            import opentrons.simulate
+
+            context = opentrons.simulate.get_protocol_api(
+                protocol.metadata["apiLevel"]
+            )
+        return context, record(protocol, context, **params)
+
+    protocol = load_protocol(args.protocol)
+    context, trace = run(protocol)
+    moves, within_xy, z_travel = slot_moves(trace)
+    modules = {
+        int(slot): MODULE_TYPES[type(module).__name__]
+        for slot, module in context.loaded_modules.items()
+    }
+    current = {slot: slot for slot in SLOTS}
+    before = travel(moves, current)
+
+    rng = random.Random(args.seed)
+    starts = [current] + [
+        random_layout(modules, rng) for _ in range(args.restarts)
+    ]
+    after, layout = min(
+        (climb(moves, modules, start) for start in starts),
+        key=lambda result: result[0],
+    )
+
+    constants = slot_constants(protocol, context, trace)
+    moved = load_protocol(args.protocol)
+    for name, value in constants.items():
+        setattr(moved, name, apply_layout(value, layout))
+    _, moved_trace = run(moved)
+
+    print(
+        "XY travel {:.0f}mm -> {:.0f}mm, Z travel {:.0f}mm".format(
+            before + within_xy, after + within_xy, z_travel
+        )
+    )
+    print(
+        "estimate {} -> {} ({:.0f}s less gantry travel)".format(
+            format_duration(estimate(trace)["total"]),
+            format_duration(estimate(moved_trace)["total"]),
+            (before - after) / XY_SPEED,
+        )
+    )
+    print()
+    for name, value in constants.items():
+        print(format_constant(name, apply_layout(value, layout)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Locating and loading the protocol scripts.
+
+Protocols are single files uploaded to the OT-2, so they are not importable
+packages. They are executed into a fresh module object each time they are
+loaded, which keeps one simulation from leaking state into the next.
+"""
+import ast
+import functools
+import types
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    List,
+    Union,
+)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROTOCOLS = {
+    "extraction": ROOT / "rna_extraction_magmax" / "rna_extraction_magmax.py",
+    "qpcr": ROOT / "qPCR_taqpath_multiplex" / "qPCR_taqpath_multiplex.py",
+}
+
+
+def resolve(protocol: Union[str, Path]) -> Path:
+    """
+    Resolves a protocol short name or a path to the protocol file.
+
+    Args:
+        protocol: One of the PROTOCOLS names, or a path to a protocol file.
+
+    Returns:
+        The path to the protocol file.
+    """
+    if str(protocol) in PROTOCOLS:
+        return PROTOCOLS[str(protocol)]
+    path = Path(protocol)
+    if not path.is_file():
+        raise ValueError(
+            "Unknown protocol {}; expected a file or one of {}".format(
+                protocol, ", ".join(PROTOCOLS)
+            )
+        )
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def compile_protocol(path: Path, mtime: float) -> types.CodeType:
+    """
+    Compiles a protocol file; cached until the file changes.
+
+    Args:
+        path: The protocol file.
+        mtime: The modification time of the file, part of the cache key.
+
+    Returns:
+        The compiled module code.
+    """
+    # some of the protocol files are saved with a byte order mark
+    source = path.read_text(encoding="utf-8-sig")
+    return compile(source, str(path), "exec")
+
+
+def load_protocol(protocol: Union[str, Path]) -> types.ModuleType:
+    """
+    Executes a protocol file into a new module.
+
+    Args:
+        protocol: One of the PROTOCOLS names, or a path to a protocol file.
+
+    Returns:
+        The loaded protocol module.
+    """
+    path = resolve(protocol)
+    module = types.ModuleType(path.stem)
+    module.__file__ = str(path)
+    exec(compile_protocol(path, path.stat().st_mtime), module.__dict__)
+    return module
+
+
+def parse_params(items: List[str]) -> Dict[str, Any]:
+    """
+    Parses "name=value" pairs into keyword arguments for a protocol's run().
+
+    Values are read as Python literals where possible, otherwise as strings.
+
+    Args:
+        items: The "name=value" strings.
+
+    Returns:
+        The keyword arguments.
+    """
+    params = {}
+    for item in items:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError("Expected name=value, got {}".format(item))
+        try:
+            params[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            params[name] = value
+    return params
@@ -0,0 +1,350 @@
+"""
+Recording a protocol run as a command trace.
+
+The protocol's run() is executed against an opentrons.simulate context
+wrapped in recording proxies. Every instrument, module and protocol call the
+protocol makes is appended to the trace as a plain dict:
+
+    {
+        "stage": "add_beads",   # outermost protocol function being run
+        "command": "aspirate",
+        "mount": "left",
+        "volume": 138.0,
+        "flow_rate": 94.0,      # uL/s, including any rate multiplier
+        "labware": "Reagent Reservoir",
+        "slot": "11",
+        "well": "A1",
+        "point": [146.4, 314.4, 4.5],
+        ...
+    }
+
+Commands issued directly by run() are attributed to the "run" stage.
+"""
+import functools
+import inspect
+import types
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Union,
+)
+
+from ot2_sars_cov2.protocols import load_protocol
+
+RUN_STAGE = "run"
+
+
+class Recorder:
+    """
+    Collects trace entries and tracks which protocol stage is running.
+    """
+
+    def __init__(self):
+        self.trace = []  # type: List[Dict[str, Any]]
+        self._stages = []  # type: List[str]
+
+    @property
+    def stage(self) -> str:
+        return self._stages[0] if self._stages else RUN_STAGE
+
+    def add(self, command: str, **fields) -> Dict[str, Any]:
+        entry = {"stage": self.stage, "command": command}
+        entry.update(fields)
+        self.trace.append(entry)
+        return entry
+
+    def wrap_stage(self, name: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._stages.append(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._stages.pop()
+
+        return wrapper
+
+
+def describe(location) -> Dict[str, Any]:
+    """
+    Describes a Well or Location as trace fields.
+
+    Args:
+        location: The Well or Location a command was issued at.
+
+    Returns:
+        The labware label, deck slot, well name and point of the location.
+    """
+    if location is None:
+        return {}
+    if hasattr(location, "point"):
+        point = location.point
+        labware_like = location.labware
+    else:
+        point = location.top().point
+        labware_like = location.top().labware
+    fields = {"point": [point.x, point.y, point.z]}
+    if labware_like is not None and not labware_like.is_empty:
+        labware, well = labware_like.get_parent_labware_and_well()
+        fields["slot"] = labware_like.first_parent()
+        if labware is not None:
+            fields["labware"] = labware.name
+        if well is not None:
+            fields["well"] = well.well_name
+    return fields
+
+
+class _Proxy:
+    """
+    Forwards every attribute to the wrapped object.
+    """
+
+    def __init__(self, target, recorder: Recorder):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_recorder", recorder)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def __setattr__(self, name, value):
+        if hasattr(type(self), name):
+            # a recorded method wrapped by the protocol, e.g. its journal
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._target, name, value)
+
+
+class RecordingInstrument(_Proxy):
+    """
+    Records the liquid handling calls made on an InstrumentContext.
+    """
+
+    def _add(self, command: str, location=None, **fields):
+        target = self._target
+        fields.update(describe(location))
+        if "point" not in fields and self._recorder.trace:
+            # commands without a location happen where the pipette already is
+            for entry in reversed(self._recorder.trace):
+                if entry.get("mount") == target.mount and "point" in entry:
+                    fields.update(
+                        {
+                            k: entry[k]
+                            for k in ("point", "labware", "slot", "well")
+                            if k in entry
+                        }
+                    )
+                    break
+        return self._recorder.add(command, mount=target.mount, **fields)
+
+    def pick_up_tip(self, *args, **kwargs):
+        result = self._target.pick_up_tip(*args, **kwargs)
+        self._add("pick_up_tip", self._target._last_tip_picked_up_from)
+        return self if result is self._target else result
+
+    def drop_tip(self, location=None, *args, **kwargs):
+        self._target.drop_tip(location, *args, **kwargs)
+        if location is None:
+            location = self._target.trash_container.wells()[0]
+        self._add("drop_tip", location)
+        return self
+
+    def return_tip(self, *args, **kwargs):
+        location = self._target._last_tip_picked_up_from
+        self._target.return_tip(*args, **kwargs)
+        self._add("return_tip", location)
+        return self
+
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        self._target.aspirate(volume, location, rate)
+        self._add(
+            "aspirate",
+            location,
+            volume=volume,
+            flow_rate=self._target.flow_rate.aspirate * rate,
+        )
+        return self
+
+    def dispense(self, volume=None, location=None, rate=1.0):
+        self._target.dispense(volume, location, rate)
+        self._add(
+            "dispense",
+            location,
+            volume=volume,
+            flow_rate=self._target.flow_rate.dispense * rate,
+        )
+        return self
+
+    def mix(self, repetitions=1, volume=None, location=None, rate=1.0):
+        if volume is None:
+            volume = self._target.hw_pipette["working_volume"]
+        self._target.mix(repetitions, volume, location, rate)
+        self._add(
+            "mix",
+            location,
+            repetitions=repetitions,
+            volume=volume,
+            flow_rate=self._target.flow_rate.aspirate * rate,
+            dispense_rate=self._target.flow_rate.dispense * rate,
+        )
+        return self
+
+    def blow_out(self, location=None):
+        self._target.blow_out(location)
+        self._add(
+            "blow_out", location, flow_rate=self._target.flow_rate.blow_out
+        )
+        return self
+
+    def touch_tip(self, location=None, radius=1.0, v_offset=-1.0, speed=60.0):
+        self._target.touch_tip(location, radius, v_offset, speed)
+        self._add("touch_tip", location, radius=radius, speed=speed)
+        return self
+
+    def air_gap(self, volume=None, height=None):
+        self._target.air_gap(volume, height)
+        self._add(
+            "air_gap", volume=volume, flow_rate=self._target.flow_rate.aspirate
+        )
+        return self
+
+    def move_to(self, location, *args, **kwargs):
+        self._target.move_to(location, *args, **kwargs)
+        self._add("move_to", location)
+        return self
+
+
+class RecordingModule(_Proxy):
+    """
+    Records the calls made on a magnetic or temperature module context.
+    """
+
+    def _add(self, command: str, **fields):
+        slot = str(self._target.geometry.parent)
+        return self._recorder.add(command, module=slot, **fields)
+
+    def engage(self, *args, **kwargs):
+        self._target.engage(*args, **kwargs)
+        self._add("engage", height=kwargs.get("height"))
+
+    def disengage(self):
+        self._target.disengage()
+        self._add("disengage")
+
+    def set_temperature(self, celsius):
+        self._target.set_temperature(celsius)
+        self._add("set_temperature", celsius=celsius)
+
+    def start_set_temperature(self, celsius):
+        self._target.start_set_temperature(celsius)
+        self._add("start_set_temperature", celsius=celsius)
+
+    def await_temperature(self, celsius):
+        self._target.await_temperature(celsius)
+        self._add("await_temperature", celsius=celsius)
+
+    def deactivate(self):
+        self._target.deactivate()
+        self._add("deactivate")
+
+
+class RecordingProtocol(_Proxy):
+    """
+    Records the protocol-level calls and hands out recording instruments and
+    modules.
+    """
+
+    def __init__(self, target, recorder: Recorder):
+        super().__init__(target, recorder)
+        object.__setattr__(self, "_proxies", {})
+
+    def _proxy(self, obj, cls):
+        if id(obj) not in self._proxies:
+            self._proxies[id(obj)] = cls(obj, self._recorder)
+        return self._proxies[id(obj)]
+
+    def load_instrument(self, *args, **kwargs):
+        instrument = self._target.load_instrument(*args, **kwargs)
+        return self._proxy(instrument, RecordingInstrument)
+
+    def load_module(self, *args, **kwargs):
+        module = self._target.load_module(*args, **kwargs)
+        return self._proxy(module, RecordingModule)
+
+    @property
+    def loaded_instruments(self):
+        return {
+            mount: self._proxy(instrument, RecordingInstrument)
+            for mount, instrument in self._target.loaded_instruments.items()
+        }
+
+    @property
+    def loaded_modules(self):
+        return {
+            slot: self._proxy(module, RecordingModule)
+            for slot, module in self._target.loaded_modules.items()
+        }
+
+    def delay(self, seconds=0, minutes=0, msg=None):
+        self._target.delay(seconds=seconds, minutes=minutes, msg=msg)
+        self._recorder.add("delay", seconds=seconds + 60 * minutes)
+
+    def pause(self, msg=None):
+        self._target.pause(msg)
+        self._recorder.add("pause", text=msg)
+
+    def comment(self, msg):
+        self._target.comment(msg)
+        self._recorder.add("comment", text=msg)
+
+
+def stage_functions(module: types.ModuleType) -> Dict[str, Callable]:
+    """
+    Lists the functions defined by a protocol module, other than run().
+
+    Args:
+        module: The loaded protocol module.
+
+    Returns:
+        The functions by name.
+    """
+    return {
+        name: func
+        for name, func in vars(module).items()
+        if inspect.isfunction(func)
+        and func.__module__ == module.__name__
+        and name != "run"
+    }
+
+
+def record(
+    protocol: Union[str, Path, types.ModuleType], context=None, **params
+) -> List[Dict[str, Any]]:
+    """
+    Runs a protocol against a recording context.
+
+    Args:
+        protocol: A protocol name, path or already loaded protocol module.
+        context: The ProtocolContext to record against; a fresh
+            opentrons.simulate context when not given.
+        **params: Keyword arguments for the protocol's run().
+
+    Returns:
+        The command trace.
+    """
+    if not isinstance(protocol, types.ModuleType):
+        protocol = load_protocol(protocol)
+    if context is None:
+        import opentrons.simulate
+
+        context = opentrons.simulate.get_protocol_api(
+            protocol.metadata["apiLevel"]
+        )
+    recorder = Recorder()
+    for name, func in stage_functions(protocol).items():
+        setattr(protocol, name, recorder.wrap_stage(name, func))
+    protocol.run(RecordingProtocol(context, recorder), **params)
+    return recorder.trace
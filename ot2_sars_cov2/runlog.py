@@ -0,0 +1,732 @@
+"""
+Analytics over the trace files of real runs.
+
+With TRACE switched on, the protocols append a JSON line per pipette, module,
+delay and pause call to a trace file on the robot. Every line carries the
+stage function the call was made from, the labware and plate column, the
+start time and the duration, and every run starts with a "run" line naming
+the protocol, its revision and the run() arguments.
+
+"ingest" reads trace files, or the directories holding them, into an SQLite
+index. Files already indexed are skipped unless they grew since, as the
+robot appends to the same file run after run. Traces written before the
+"run" lines existed are split into runs at gaps of more than RUN_GAP_S and
+filed under an unknown protocol.
+
+Runs made without TRACE are read from their run log as exported by the
+Opentrons App (.json files, next to or instead of the trace files). The
+export lists the commands the robot ran, with their times, but not the
+stage or plate column they belong to. Those come from a simulation of the
+same protocol file, given with --protocol: the exported commands are
+aligned with the simulated ones in order, by command type, by well for tip
+pick-ups, aspirations and dispenses and by text for comments, and each takes
+the stage, labware and column of the simulated command it lines up with.
+Commands run from within another one, e.g. the aspirations of a mix, are
+left out first, as in the traces. An export of which less than ALIGN_MIN of
+the commands line up, or that lines up with less than ALIGN_MIN of the
+simulated commands up to where the run stopped, is from another protocol,
+revision or set of run() arguments and is skipped.
+
+"report" summarizes the index, per protocol:
+
+- stage time: the time spent in the calls of each stage, as the median,
+  90th percentile and longest over the runs,
+- slowest columns: the plate columns whose calls take longest per run,
+- pause responses: the time from each pause until the call after it ends;
+  the robot waits for the operator in the first move after a pause,
+- revisions: the runs and median run time of each protocol revision, in the
+  order they were first run, with the stages that changed the most against
+  the revision before.
+
+Usage:
+    python -m ot2_sars_cov2.runlog ingest /path/to/traces --db runs.sqlite
+    python -m ot2_sars_cov2.runlog ingest /path/to/exports \
+        --protocol old/rna_extraction_magmax.py -p num_samples=96
+    python -m ot2_sars_cov2.runlog report --db runs.sqlite -p extraction
+"""
+import argparse
+import collections
+import datetime
+import difflib
+import hashlib
+import json
+import math
+import re
+import sqlite3
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+)
+
+from ot2_sars_cov2.estimator import format_duration
+from ot2_sars_cov2.fake import ProtocolContext
+from ot2_sars_cov2.protocols import load_protocol, parse_params, resolve
+from ot2_sars_cov2.recorder import RUN_STAGE, record
+
+DATABASE = Path("runs.sqlite")
+RUN_GAP_S = 3 * 3600  # splits traces without "run" lines
+UNKNOWN = "unknown"
+SLOWEST_COLUMNS = 10
+# Stage time changes between revisions smaller than this are not listed
+REVISION_CHANGE = 0.05
+# Least part of the recorded commands of an export, and of the simulated
+# commands up to the last one it lines up with, that must line up
+ALIGN_MIN = 0.9
+SUFFIXES = (".jsonl", ".json")  # trace files and App exports
+
+# App export command types, and the legacy command names older robot
+# software exports API 2.7 commands under, by the command they record
+EXPORT_COMMANDS = {
+    "pick_up_tip": ("pickUpTip", "command.PICK_UP_TIP"),
+    "drop_tip": ("dropTip", "command.DROP_TIP"),
+    "return_tip": ("command.RETURN_TIP",),
+    "aspirate": ("aspirate", "command.ASPIRATE"),
+    "dispense": ("dispense", "command.DISPENSE"),
+    "mix": ("command.MIX",),
+    "blow_out": ("blowout", "blowOut", "command.BLOW_OUT"),
+    "touch_tip": ("touchTip", "command.TOUCH_TIP"),
+    "air_gap": ("command.AIR_GAP",),
+    "move_to": ("moveToWell", "command.MOVE_TO"),
+    "engage": ("magneticModule/engage", "command.MAGDECK_ENGAGE"),
+    "disengage": ("magneticModule/disengage", "command.MAGDECK_DISENGAGE"),
+    "set_temperature": (
+        "temperatureModule/setTargetTemperature",
+        "command.TEMPDECK_SET_TEMP",
+    ),
+    "await_temperature": (
+        "temperatureModule/waitForTemperature",
+        "command.TEMPDECK_AWAIT_TEMP",
+    ),
+    "deactivate": (
+        "temperatureModule/deactivate",
+        "command.TEMPDECK_DEACTIVATE",
+    ),
+    "delay": ("waitForDuration", "delay", "command.DELAY"),
+    "pause": ("waitForResume", "pause", "command.PAUSE"),
+    "comment": ("comment", "command.COMMENT"),
+}
+# Recorded commands that the export does not tell apart
+RECORDED_AS = {"start_set_temperature": "set_temperature"}
+# Commands aligned by their well as well as their type; the export names the
+# well of these in every robot software version. Comments are aligned by
+# their text.
+WELL_COMMANDS = ("pick_up_tip", "aspirate", "dispense")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, size INTEGER, mtime REAL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, path TEXT, protocol TEXT, revision TEXT,
+    start REAL, end REAL, params TEXT
+);
+CREATE TABLE IF NOT EXISTS calls (
+    run INTEGER, stage TEXT, command TEXT, target TEXT, labware TEXT,
+    col INTEGER, volume REAL, start REAL, duration REAL
+);
+CREATE INDEX IF NOT EXISTS calls_run ON calls (run);
+"""
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    """
+    Opens the index, creating it if needed.
+    """
+    db = sqlite3.connect(str(path))
+    db.executescript(SCHEMA)
+    return db
+
+
+def read_runs(path: Path) -> List[Dict[str, Any]]:
+    """
+    Splits a trace file into runs.
+
+    Args:
+        path: The trace file.
+
+    Returns:
+        The runs in file order, each with its "protocol", "revision",
+        "start", "params" and "calls"; the calls are rows for the calls
+        table, less the run.
+    """
+    runs = []
+    run = None
+    with path.open() as trace_file:
+        for line in trace_file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry["command"] == "run":
+                run = {
+                    "protocol": entry["protocol"],
+                    "revision": entry["revision"],
+                    "start": entry["start"],
+                    "params": entry.get("params", {}),
+                    "calls": [],
+                }
+                runs.append(run)
+                continue
+            start = entry["start"]
+            if run is None or (
+                run["protocol"] == UNKNOWN
+                and run["calls"]
+                and start - run["end"] > RUN_GAP_S
+            ):
+                run = {
+                    "protocol": UNKNOWN,
+                    "revision": UNKNOWN,
+                    "start": start,
+                    "params": {},
+                    "calls": [],
+                }
+                runs.append(run)
+            duration = entry.get("duration_s") or 0.0
+            run["end"] = start + duration
+            run["calls"].append(
+                (
+                    entry.get("stage"),
+                    entry["command"],
+                    entry.get("mount", entry.get("module")),
+                    entry.get("labware"),
+                    entry.get("column"),
+                    entry.get("volume"),
+                    start,
+                    duration,
+                )
+            )
+    for run in runs:
+        run.setdefault("end", run["start"])
+    return runs
+
+
+def parse_time(text: str) -> float:
+    """
+    Reads an ISO 8601 time from an App export as a Unix timestamp; None when
+    not given.
+    """
+    if not text:
+        return None
+    match = re.match(r"(.*T\d\d:\d\d:\d\d)(?:\.(\d+))?(.*)", text)
+    if match is None:
+        raise ValueError("Unknown time: {}".format(text))
+    # fromisoformat() in Python 3.7 only takes whole microseconds and no "Z"
+    zone = match.group(3).replace("Z", "+00:00")
+    fraction = (match.group(2) or "")[:6].ljust(6, "0")
+    return datetime.datetime.fromisoformat(
+        "{}.{}{}".format(match.group(1), fraction, zone)
+    ).timestamp()
+
+
+def export_commands(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Lists the commands of an App run log export that ran, less those run
+    from within another command.
+
+    Args:
+        data: The export; the run with its "commands", or the same wrapped
+            in "data".
+
+    Returns:
+        The commands in the order they ran, with the recorded "command" they
+        stand for (None for others, e.g. loading labware), the "well" where
+        the export names one, the "text", "start" and "end".
+    """
+    kinds = {
+        name: command
+        for command, names in EXPORT_COMMANDS.items()
+        for name in names
+    }
+    run = data.get("data", data)
+    commands = run.get("commands", [])
+    if isinstance(commands, dict):
+        commands = commands.get("data", [])
+    result = []
+    running = []  # the commands still running, outermost first
+    for command in commands:
+        start = parse_time(command.get("startedAt"))
+        if start is None:
+            continue
+        end = parse_time(command.get("completedAt")) or start
+        while running and running[-1] <= start:
+            running.pop()
+        nested = bool(running) and end <= running[-1]
+        running.append(end)
+        if nested:
+            # run from within the command before, e.g. the aspirate of a mix
+            continue
+        params = command.get("params", {})
+        name = command.get("commandType")
+        if name == "custom":
+            name = params.get("legacyCommandType")
+        text = params.get("legacyCommandText", params.get("message"))
+        # e.g. "Aspirating 5.0 uL from A1 of Reagent Plate on 3 at 3.78..."
+        well = re.search(r"\b([A-P]\d{1,2}) of ", text or "")
+        result.append(
+            {
+                "type": name,
+                "command": kinds.get(name),
+                "well": params.get("wellName", well and well.group(1)),
+                "text": text,
+                "start": start,
+                "end": end,
+            }
+        )
+    return result
+
+
+def simulate(
+    protocol: str, params: Dict[str, Any] = None, fake: bool = False
+) -> Dict[str, Any]:
+    """
+    Simulates a protocol file for aligning App exports with.
+
+    Args:
+        protocol: A protocol name or the path to the protocol file the runs
+            were made with.
+        params: Keyword arguments for the protocol's run(); the robot runs
+            it with its defaults.
+        fake: Simulate with the fake context instead of opentrons.simulate.
+
+    Returns:
+        The "protocol" name, its "revision", the "params" and the command
+        "trace".
+    """
+    params = params or {}
+    module = load_protocol(protocol)
+    if hasattr(module, "protocol_revision"):
+        # before record() wraps the stage functions
+        revision = module.protocol_revision()
+    else:
+        # written before the protocols named their revisions
+        source = resolve(protocol).read_bytes()
+        revision = hashlib.sha1(source).hexdigest()[:12]
+    context = ProtocolContext() if fake else None
+    return {
+        "protocol": module.metadata["protocolName"],
+        "revision": revision,
+        "params": params,
+        "trace": record(module, context, **params),
+    }
+
+
+def read_export(path: Path, reference: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reads an App run log export as a run, aligned with a simulation.
+
+    Args:
+        path: The export file.
+        reference: The simulation of the protocol, from simulate().
+
+    Returns:
+        The run as from read_runs(), or None when the export does not line
+        up with the simulation.
+    """
+    commands = export_commands(json.loads(path.read_text()))
+    trace = reference["trace"]
+
+    def token(step):
+        command = RECORDED_AS.get(step["command"], step["command"])
+        if command in WELL_COMMANDS:
+            return command, step.get("well")
+        if command == "comment":
+            return command, step.get("text")
+        return command, None
+
+    matcher = difflib.SequenceMatcher(
+        None,
+        [token(entry) for entry in trace],
+        [token(command) for command in commands],
+        autojunk=False,
+    )
+    matched = {}
+    reached = 0
+    for a, b, size in matcher.get_matching_blocks():
+        for i in range(size):
+            matched[b + i] = trace[a + i]
+        if size:
+            reached = a + size
+    # runs stopped early only line up with the start of the simulation
+    recorded = sum(command["command"] is not None for command in commands)
+    if not reached or len(matched) < ALIGN_MIN * max(reached, recorded):
+        return None
+
+    calls = []
+    stage = RUN_STAGE
+    for i, command in enumerate(commands):
+        entry = matched.get(i)
+        if entry is not None:
+            stage = entry["stage"]
+        else:
+            # e.g. homing, or a command the simulation did not make
+            entry = {"command": command["command"] or command["type"]}
+        calls.append(
+            (
+                stage,
+                entry["command"],
+                entry.get("mount", entry.get("module")),
+                entry.get("labware"),
+                int(entry["well"][1:]) - 1 if "well" in entry else None,
+                entry.get("volume"),
+                command["start"],
+                command["end"] - command["start"],
+            )
+        )
+    return {
+        "protocol": reference["protocol"],
+        "revision": reference["revision"],
+        "start": commands[0]["start"],
+        "end": max(command["end"] for command in commands),
+        "params": reference["params"],
+        "calls": calls,
+    }
+
+
+def trace_files(paths: Iterable[Path]) -> List[Path]:
+    """
+    Lists the trace files and App exports given directly or found under the
+    given directories.
+    """
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(
+                sorted(f for f in path.rglob("*.json*") if f.suffix in SUFFIXES)
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def ingest(
+    db: sqlite3.Connection,
+    paths: Iterable[Path],
+    reference: Dict[str, Any] = None,
+) -> Tuple[int, int, List[Path]]:
+    """
+    Reads trace files and App exports into the index.
+
+    Args:
+        db: The index.
+        paths: Trace files, exports or directories holding them.
+        reference: The simulation the exports are aligned with, from
+            simulate(); needed when there are exports.
+
+    Returns:
+        The number of files read, the number of runs added and the exports
+        skipped because they do not line up with the simulation.
+    """
+    files = runs = 0
+    skipped = []
+    with db:
+        for path in trace_files(paths):
+            key = str(path.resolve())
+            stat = path.stat()
+            known = db.execute(
+                "SELECT size, mtime FROM files WHERE path = ?", (key,)
+            ).fetchone()
+            if known == (stat.st_size, stat.st_mtime):
+                continue
+            # the robot appends to the same file, so read it again in full
+            db.execute(
+                "DELETE FROM calls WHERE run IN "
+                "(SELECT id FROM runs WHERE path = ?)",
+                (key,),
+            )
+            db.execute("DELETE FROM runs WHERE path = ?", (key,))
+            if path.suffix == ".jsonl":
+                found = read_runs(path)
+            elif reference is None:
+                raise ValueError(
+                    "{} is an App export; give the protocol it ran with "
+                    "--protocol".format(path)
+                )
+            else:
+                found = [read_export(path, reference)]
+                if found[0] is None:
+                    skipped.append(path)
+                    continue
+            for run in found:
+                cursor = db.execute(
+                    "INSERT INTO runs (path, protocol, revision, start, end, "
+                    "params) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        run["protocol"],
+                        run["revision"],
+                        run["start"],
+                        run["end"],
+                        json.dumps(run["params"], sort_keys=True),
+                    ),
+                )
+                db.executemany(
+                    "INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((cursor.lastrowid,) + call for call in run["calls"]),
+                )
+                runs += 1
+            db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (key, stat.st_size, stat.st_mtime),
+            )
+            files += 1
+    return files, runs, skipped
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    The value below which the given fraction of the values lie, interpolating
+    between the nearest two.
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    low, high = math.floor(position), math.ceil(position)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def stage_times(
+    db: sqlite3.Connection, protocol: str
+) -> Dict[int, Dict[str, float]]:
+    """
+    Time spent in the calls of each stage.
+
+    Args:
+        db: The index.
+        protocol: The protocol name.
+
+    Returns:
+        The seconds by stage, by run id. Stages are in the order they ran.
+    """
+    times = collections.defaultdict(collections.OrderedDict)
+    for run, stage, seconds in db.execute(
+        "SELECT c.run, c.stage, SUM(c.duration) FROM calls c "
+        "JOIN runs r ON r.id = c.run WHERE r.protocol = ? "
+        "GROUP BY c.run, c.stage ORDER BY c.run, MIN(c.rowid)",
+        (protocol,),
+    ):
+        times[run][stage] = seconds
+    return times
+
+
+def report_stages(db: sqlite3.Connection, protocol: str) -> List[str]:
+    """
+    Formats the distribution of the stage times over the runs.
+    """
+    by_stage = collections.OrderedDict()
+    for stages in stage_times(db, protocol).values():
+        for stage, seconds in stages.items():
+            by_stage.setdefault(stage, []).append(seconds)
+    lines = ["stage time (median / 90th percentile / longest):"]
+    for stage, values in by_stage.items():
+        lines.append(
+            "  {}: {} / {} / {} over {} runs".format(
+                stage,
+                format_duration(percentile(values, 0.5)),
+                format_duration(percentile(values, 0.9)),
+                format_duration(max(values)),
+                len(values),
+            )
+        )
+    return lines
+
+
+def report_columns(
+    db: sqlite3.Connection, protocol: str, limit: int = SLOWEST_COLUMNS
+) -> List[str]:
+    """
+    Formats the plate columns whose calls take longest per run.
+    """
+    lines = ["slowest columns (time per run):"]
+    for stage, labware, col, seconds in db.execute(
+        "SELECT c.stage, c.labware, c.col, "
+        "SUM(c.duration) / COUNT(DISTINCT c.run) AS per_run FROM calls c "
+        "JOIN runs r ON r.id = c.run "
+        "WHERE r.protocol = ? AND c.col IS NOT NULL "
+        "GROUP BY c.stage, c.labware, c.col ORDER BY per_run DESC LIMIT ?",
+        (protocol, limit),
+    ):
+        lines.append(
+            "  {} column {} in {}: {}".format(
+                labware, col + 1, stage, format_duration(seconds)
+            )
+        )
+    return lines
+
+
+def report_pauses(db: sqlite3.Connection, protocol: str) -> List[str]:
+    """
+    Formats the operator response times at the pauses, by stage.
+    """
+    by_stage = collections.OrderedDict()
+    for stage, seconds in db.execute(
+        "SELECT p.stage, ("
+        "  SELECT c.start + c.duration FROM calls c"
+        "  WHERE c.run = p.run AND c.rowid > p.rowid"
+        "  ORDER BY c.rowid LIMIT 1"
+        ") - p.start FROM calls p JOIN runs r ON r.id = p.run "
+        "WHERE r.protocol = ? AND p.command = 'pause' ORDER BY p.rowid",
+        (protocol,),
+    ):
+        if seconds is not None:
+            by_stage.setdefault(stage, []).append(seconds)
+    lines = ["pause responses (median / longest):"]
+    for stage, values in by_stage.items():
+        lines.append(
+            "  {}: {} / {} over {} pauses".format(
+                stage,
+                format_duration(percentile(values, 0.5)),
+                format_duration(max(values)),
+                len(values),
+            )
+        )
+    return lines
+
+
+def report_revisions(db: sqlite3.Connection, protocol: str) -> List[str]:
+    """
+    Formats the run times of each protocol revision and the stages that
+    changed against the revision before.
+    """
+    times = stage_times(db, protocol)
+    revisions = collections.OrderedDict()
+    for run, revision, start, end in db.execute(
+        "SELECT id, revision, start, end FROM runs WHERE protocol = ? "
+        "ORDER BY start",
+        (protocol,),
+    ):
+        revisions.setdefault(revision, []).append((run, start, end))
+
+    lines = ["revisions:"]
+    previous = None
+    for revision, runs in revisions.items():
+        stages = collections.OrderedDict()
+        for run, _, _ in runs:
+            for stage, seconds in times[run].items():
+                stages.setdefault(stage, []).append(seconds)
+        medians = {s: percentile(v, 0.5) for s, v in stages.items()}
+        lines.append(
+            "  {} from {}: {} runs, median {}".format(
+                revision,
+                datetime.date.fromtimestamp(runs[0][1]).isoformat(),
+                len(runs),
+                format_duration(percentile([e - s for _, s, e in runs], 0.5)),
+            )
+        )
+        if previous is not None:
+            for stage, seconds in medians.items():
+                before = previous.get(stage)
+                if before and abs(seconds - before) > REVISION_CHANGE * before:
+                    lines.append(
+                        "    {}: {} -> {}".format(
+                            stage,
+                            format_duration(before),
+                            format_duration(seconds),
+                        )
+                    )
+        previous = medians
+    return lines
+
+
+def report(
+    db: sqlite3.Connection, protocol: str = "", limit: int = SLOWEST_COLUMNS
+) -> List[str]:
+    """
+    Formats the full report.
+
+    Args:
+        db: The index.
+        protocol: Only report the protocols whose name contains this,
+            ignoring case.
+        limit: Number of slowest columns listed.
+
+    Returns:
+        The report lines.
+    """
+    lines = []
+    for name, runs in db.execute(
+        "SELECT protocol, COUNT(*) FROM runs GROUP BY protocol ORDER BY protocol"
+    ).fetchall():
+        if protocol.lower() not in name.lower():
+            continue
+        lines.append("{} ({} runs)".format(name, runs))
+        lines += report_stages(db, name)
+        lines += report_columns(db, name, limit)
+        lines += report_pauses(db, name)
+        lines += report_revisions(db, name)
+        lines.append("")
+    return lines
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        description="Index and summarize the trace files of real runs."
+    )
+    parser.add_argument(
+        "--db", type=Path, default=DATABASE, help="SQLite index file"
+    )
+    commands = parser.add_subparsers(dest="action")
+    commands.required = True
+    read = commands.add_parser(
+        "ingest", help="add trace files and App exports to the index"
+    )
+    read.add_argument(
+        "paths",
+        nargs="+",
+        type=Path,
+        help="trace files (.jsonl), App exports (.json) or directories",
+    )
+    read.add_argument(
+        "--protocol",
+        help="extraction, qpcr or the protocol file the exported runs were "
+        "made with",
+    )
+    read.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        default=[],
+        help="run() keyword argument of the exported runs as name=value",
+    )
+    read.add_argument(
+        "--fake",
+        action="store_true",
+        help="simulate with the fake context from ot2_sars_cov2.fake",
+    )
+    summary = commands.add_parser("report", help="summarize the index")
+    summary.add_argument(
+        "-p",
+        "--protocol",
+        default="",
+        help="only protocols whose name contains this, e.g. extraction",
+    )
+    summary.add_argument(
+        "-n",
+        type=int,
+        default=SLOWEST_COLUMNS,
+        help="number of slowest columns listed",
+    )
+    args = parser.parse_args(argv)
+
+    db = connect(args.db)
+    if args.action == "ingest":
+        reference = None
+        if args.protocol:
+            reference = simulate(
+                args.protocol, parse_params(args.param), args.fake
+            )
+        try:
+            files, runs, skipped = ingest(db, args.paths, reference)
+        except ValueError as error:
+            parser.error(str(error))
+        print("Read {} files, {} runs".format(files, runs))
+        for path in skipped:
+            print("Skipped {}: does not match the protocol".format(path))
+    else:
+        for line in report(db, args.protocol, args.n):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
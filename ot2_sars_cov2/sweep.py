@@ -0,0 +1,295 @@
+"""
+Settings sweep for the fastest protocol settings within the validated ranges.
+
+Every combination of the values in RANGES, or a random sample of them, is
+simulated against the fake context from fake.py in a pool of worker processes
+and scored by the estimated run time, the tips used up and the reagent drawn
+from the reagent labware. Candidates that fail to simulate, e.g. because they
+run out of tips, or that exceed a limit given with --limit are dropped. The
+rest are reduced to the Pareto front: the candidates that no other candidate
+beats on every score.
+
+RANGES names are either paths into the protocol's SETTINGS, with "." between
+the keys of nested dicts (e.g. "LIQUID_CLASSES.over_beads.ASPIRATE"), or run()
+keyword arguments, which are lower case.
+
+Usage:
+    python -m ot2_sars_cov2.sweep extraction -p num_samples=96
+    python -m ot2_sars_cov2.sweep qpcr --sample 20 --limit tips=20
+"""
+import argparse
+import concurrent.futures
+import copy
+import functools
+import itertools
+import json
+import os
+import random
+import sys
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    List,
+)
+
+from ot2_sars_cov2.benchmark import tips_used
+from ot2_sars_cov2.estimator import estimate, format_duration
+from ot2_sars_cov2.fake import ProtocolContext
+from ot2_sars_cov2.protocols import load_protocol, parse_params
+from ot2_sars_cov2.recorder import record
+
+# Values each setting may take; the protocol's own settings are always run
+# too, as the reference.
+RANGES = {
+    "extraction": {
+        "MIX_BEADS_BEFORE": [(3,), (5,)],
+        "MIX_BEADS_AFTER": [(1,), (2,)],
+        "MIX_WASH_AFTER": [(3,), (5,)],
+        "MIX_ELUTION_AFTER": [(3, 35), (5, 35)],
+        "LIQUID_CLASSES.bead_mix.DELAY_S": [2, 5],
+        "LIQUID_CLASSES.over_beads.ASPIRATE": [0.4, 50 / 94, 0.75],
+        "small_vol_mode": ["transfer", "distribute", "combined"],
+        "wash_mode": ["transfer", "distribute"],
+        "nearest_tip_stages": [
+            (),
+            (
+                "add_proteinase_k",
+                "add_beads",
+                "add_ms2",
+                "discard_supernatant",
+                "wash_beads",
+                "elute",
+            ),
+        ],
+        "TIP_MAX_DETOUR_MM": [None, 100],
+    },
+    "qpcr": {
+        "MIX_MASTER_MIX": [(3, 15), (5, 15)],
+        "MIX_RNA": [(2, 15), (3, 15)],
+        "LIQUID_CLASSES.master_mix.TOUCH_TIP": [None, (1.0, -1.0)],
+        "master_mix_first": [False, True],
+        "nearest_tip_stages": [
+            (),
+            ("aliquot_eluent", "add_master_mix", "distribute_master_mix"),
+        ],
+        "TIP_MAX_DETOUR_MM": [None, 100],
+    },
+}
+# Labware the reagents are drawn from, by label
+REAGENT_LABWARE = {
+    "extraction": ("Reagent Plate", "Reagent Reservoir"),
+    "qpcr": ("Reagent Plate",),
+}
+SCORES = ("estimated_s", "tips", "reagent_ul")
+
+
+def candidates(ranges: Dict[str, list]) -> List[Dict[str, Any]]:
+    """
+    Lists every combination of the values in the ranges.
+
+    Args:
+        ranges: The values each setting may take, by name.
+
+    Returns:
+        The settings of each candidate, by name.
+    """
+    names = sorted(ranges)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(ranges[name] for name in names))
+    ]
+
+
+def apply_settings(settings: dict, overrides: Dict[str, Any]) -> dict:
+    """
+    Copies a protocol's SETTINGS with some of the values replaced.
+
+    Args:
+        settings: The protocol's SETTINGS.
+        overrides: The new values by "."-separated path.
+
+    Returns:
+        The new settings.
+    """
+    settings = copy.deepcopy(settings)
+    for path, value in overrides.items():
+        *parents, key = path.split(".")
+        target = settings
+        for name in parents:
+            target = target[name]
+        if key not in target:
+            raise ValueError("Unknown setting: {}".format(path))
+        target[key] = value
+    return settings
+
+
+def evaluate(
+    protocol: str, params: Dict[str, Any], candidate: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Simulates one candidate and scores it.
+
+    Args:
+        protocol: The protocol name.
+        params: Keyword arguments for the protocol's run(), shared by every
+            candidate.
+        candidate: The candidate's settings and run() arguments, by name.
+
+    Returns:
+        The candidate with its scores, or with the "error" it failed with.
+    """
+    overrides = {k: v for k, v in candidate.items() if not k.islower()}
+    kwargs = dict(params)
+    kwargs.update({k: v for k, v in candidate.items() if k.islower()})
+    module = load_protocol(protocol)
+    module.SETTINGS = apply_settings(module.SETTINGS, overrides)
+    result = {"candidate": candidate}
+    try:
+        trace = record(module, ProtocolContext(), **kwargs)
+    except Exception as error:
+        result["error"] = "{}: {}".format(type(error).__name__, error)
+        return result
+    result.update(
+        {
+            "estimated_s": round(estimate(trace)["total"], 1),
+            "tips": sum(tips_used(trace).values()),
+            "reagent_ul": round(
+                sum(
+                    e["volume"] or 0
+                    for e in trace
+                    if e["command"] == "aspirate"
+                    and e.get("labware") in REAGENT_LABWARE[protocol]
+                ),
+                1,
+            ),
+        }
+    )
+    return result
+
+
+def pareto_front(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Keeps the results that no other result beats on every score.
+
+    Candidates with the same scores, typically ones that only differ in a
+    setting the run does not read, are collapsed into the first of them,
+    with the number of others in "equivalent".
+
+    Args:
+        results: Scored candidates from evaluate().
+
+    Returns:
+        The Pareto front, fastest first.
+    """
+
+    def scores(result):
+        return tuple(result[s] for s in SCORES)
+
+    def dominates(a, b):
+        return all(a[s] <= b[s] for s in SCORES) and any(
+            a[s] < b[s] for s in SCORES
+        )
+
+    front = {}
+    for result in results:
+        if any(dominates(other, result) for other in results):
+            continue
+        if scores(result) in front:
+            front[scores(result)]["equivalent"] += 1
+        else:
+            front[scores(result)] = dict(result, equivalent=0)
+    return [front[key] for key in sorted(front)]
+
+
+def describe(result: Dict[str, Any]) -> str:
+    """
+    Formats a scored candidate as one report line.
+    """
+    settings = ", ".join(
+        "{}={}".format(name, value)
+        for name, value in sorted(result["candidate"].items())
+    )
+    line = "{} est, {} tips, {}uL reagent: {}".format(
+        format_duration(result["estimated_s"]),
+        result["tips"],
+        result["reagent_ul"],
+        settings or "protocol settings",
+    )
+    if result.get("equivalent"):
+        line += " (+{} with the same scores)".format(result["equivalent"])
+    return line
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Sweep protocol settings for the fastest run."
+    )
+    parser.add_argument("protocol", choices=sorted(RANGES))
+    parser.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        default=[],
+        help="run() keyword argument as name=value, e.g. num_samples=30",
+    )
+    parser.add_argument(
+        "--limit",
+        action="append",
+        default=[],
+        help="highest allowed score as name=value, e.g. tips=100; "
+        "one of {}".format(", ".join(SCORES)),
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=0,
+        help="simulate this many random candidates instead of all of them",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="sampling seed")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes",
+    )
+    parser.add_argument(
+        "--json", type=Path, help="write every scored candidate to this file"
+    )
+    args = parser.parse_args(argv)
+    params = parse_params(args.param)
+    limits = parse_params(args.limit)
+    for name in limits:
+        if name not in SCORES:
+            parser.error("Unknown score: {}".format(name))
+
+    pool = candidates(RANGES[args.protocol])
+    if args.sample and args.sample < len(pool):
+        pool = random.Random(args.seed).sample(pool, args.sample)
+    pool.insert(0, {})
+    run = functools.partial(evaluate, args.protocol, params)
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+        results = list(executor.map(run, pool, chunksize=8))
+
+    reference, failed = results[0], [r for r in results if "error" in r]
+    if "error" in reference:
+        print("Protocol settings failed: {}".format(reference["error"]))
+        return 1
+    passed = [
+        r
+        for r in results
+        if "error" not in r
+        and all(r[name] <= limit for name, limit in limits.items())
+    ]
+    print("{} candidates, {} failed to simulate".format(len(pool), len(failed)))
+    print("reference  {}".format(describe(reference)))
+    for result in pareto_front(passed):
+        print("pareto     {}".format(describe(result)))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -39,8 +39,15 @@ Written by Rita Chen & Dany Fu, DAMP Lab 2020-03-22
 --------------------------------------------------------------------------------
 """
 
+import hashlib
+import inspect
+import json
 import math
+import time
 from typing import (
+    Callable,
+    Iterable,
+    List,
     Tuple,
 )
 
@@ -87,15 +94,166 @@ FILTER_TIP_20 = [
         "LABEL": "Filter Tip S-2",
     },
 ]
+# 384 well mode only. Swap in the definition of the plate the qPCR instrument
+# takes; this is the 384 well plate bundled with the robot software.
+QPCR_PLATE_384 = {  # 112uL per well, 384 wells
+    "NAME": "corning_384_wellplate_112ul_flat",
+    "LABEL": "Output Plate",  # no slot, sits on temp deck
+}
+RNA_PLATES_384 = [  # RNA plates 2 to 4, RNA_PLATE is the first
+    {
+        "NAME": "biorad_96_wellplate_200ul_pcr",
+        "LABEL": "RNA Plate {}".format(i + 2),
+        "SLOT": slot,
+    }
+    for i, slot in enumerate((5, 6, 9))
+]
+FILTER_TIP_20_384 = [
+    {
+        "NAME": "opentrons_96_filtertiprack_20ul",
+        "SLOT": slot,
+        "LABEL": "Filter Tip S-{}".format(slot),
+    }
+    for slot in (3, 10, 11)
+]
 
-ASPIRATE_DEPTH_BOTTOM = 2.00  # 2mm from bottle
 VOL_RNA = 10
 VOL_MASTER_MIX = 15  # Reaction volume
 TEMP = 4
-TOUCH_SPEED = 20.0
 TOUCH_RADIUS_SM_SM = 1.0
 TOUCH_HEIGHT_SM_SM = -1.0
 
+# Liquid classes, applied by transfer(): aspirate, dispense and blow-out flow
+# rates as multiples of the pipette's default flow rates, a delay with the tip
+# still in the liquid after each aspiration, an air gap drawn once the tip is
+# out, and the touch tip (radius, height) after the final dispense.
+LIQUID_CLASSES = {
+    "aqueous": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 0,
+        "TOUCH_TIP": None,
+    },
+    "rna_eluate": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 0,
+        "TOUCH_TIP": None,
+    },
+    "master_mix": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 0,
+        "TOUCH_TIP": (TOUCH_RADIUS_SM_SM, TOUCH_HEIGHT_SM_SM),
+    },
+}
+
+# Settings that trade run time against how gently the samples are handled, in
+# one place so they can be tuned together; see ot2_sars_cov2/sweep.py. Mixes
+# are (repetitions, volume).
+SETTINGS = {
+    "ASPIRATE_DEPTH_BOTTOM": 2.00,  # 2mm from bottle
+    "TOUCH_SPEED": 20.0,
+    "MIX_MASTER_MIX": (5, VOL_MASTER_MIX),
+    "MIX_RNA": (3, VOL_MASTER_MIX),  # mixes the final 25uL reaction
+    "LIQUID_CLASSES": LIQUID_CLASSES,
+    # The furthest, in mm, that a tip picked by nearest_tips() may lengthen
+    # the way to the next well; the next tip in rack order is taken when no
+    # free tip is that close. None for no limit.
+    "TIP_MAX_DETOUR_MM": None,
+}
+
+# Number of samples in the RNA plate, filled column-wise from A1. Only the
+# occupied columns are processed.
+NUM_SAMPLES = 96
+
+# Distribute master mix into the empty plate with a single tip before adding
+# RNA, instead of adding master mix on top of the aliquoted RNA.
+MASTER_MIX_FIRST = False
+
+# Set up a 384 well qPCR plate from up to four RNA plates, one per quadrant:
+# RNA plate n goes to the wells the 8 channel pipette reaches from A1, B1, A2
+# and B2 respectively, and takes its master mix from reagent plate column n.
+# NUM_SAMPLES counts the samples of all RNA plates, filled plate by plate.
+PLATE_384 = False
+
+# Rough per-command durations (s) for the plate preparation estimate
+EST_TIP_S = 8.0  # pick up or drop, including travel to the tip rack
+EST_COMMAND_S = 3.0  # aspirate, dispense, blow out or touch tip
+EST_MIX_REP_S = 1.5
+
+# Optimization passes applied to the plan of every stage, in order; see
+# OPTIMIZATION_PASSES. e.g. ("drop_mixes", "merge_aspirations")
+PLAN_PASSES = ()
+
+# Stages, by function name, that take each tip from the free tip column
+# closest to the way between the pipette's last location and its next one,
+# rather than in rack order; see nearest_tips(). e.g. ("add_master_mix",)
+# The plate columns themselves are always walked in order: every tip ends in
+# the trash, so the way from one column to the next does not depend on the
+# order, and a serpentine order would only change how long each column waits
+# between stages. See SETTINGS["TIP_MAX_DETOUR_MM"] to bound the detours.
+NEAREST_TIP_STAGES = ()
+
+# Append the timing of every pipette, module, delay and pause call to a JSONL
+# file on the robot, to find the slow steps on real hardware. Each run starts
+# with a line naming the protocol, its revision and the run() arguments; see
+# ot2_sars_cov2/runlog.py. Nothing is written while the protocol is simulated.
+TRACE = False
+TRACE_PATH = "/data/user_storage/qpcr_trace.jsonl"
+TRACE_INSTRUMENT_CALLS = (
+    "pick_up_tip",
+    "aspirate",
+    "dispense",
+    "mix",
+    "blow_out",
+    "touch_tip",
+    "air_gap",
+    "drop_tip",
+    "return_tip",
+)
+TRACE_MODULE_CALLS = (
+    "set_temperature",
+    "start_set_temperature",
+    "await_temperature",
+    "deactivate",
+)
+TRACE_PROTOCOL_CALLS = ("delay", "pause")
+TRACE_IN_PLACE_CALLS = ("mix", "blow_out", "touch_tip", "air_gap")
+
+# Journal the progress of the run to a JSONL file on the robot, one line for
+# every dispense: the number of dispenses done so far ("done"), the stage and
+# the plate columns it drew from and dispensed to. To resume an interrupted
+# run, set RESUME to the "done" of the last line, take any tip off the
+# pipette and start the run again with the deck as it was left. Everything
+# before that point is replayed without moving: the tips are marked used and
+# the racks replaced at the pauses are reset, while the liquid handling,
+# delays and operator pauses are skipped. A tip that was interrupted between
+# dispenses is replaced by a fresh one, which draws what it still held and
+# carries on from the next dispense.
+JOURNAL = False
+JOURNAL_PATH = "/data/user_storage/qpcr_journal.jsonl"
+RESUME = 0
+JOURNAL_INSTRUMENT_CALLS = (
+    "pick_up_tip",
+    "aspirate",
+    "dispense",
+    "mix",
+    "blow_out",
+    "touch_tip",
+    "air_gap",
+    "move_to",
+    "drop_tip",
+    "return_tip",
+)
+JOURNAL_PROTOCOL_CALLS = ("delay", "pause")
+
 
 # ----------------------------- Utility Methods --------------------------------
 def aliquot_eluent(
@@ -103,6 +261,8 @@ def aliquot_eluent(
     pipette: InstrumentContext = None,
     source_plate: Labware = None,
     destination_plate: Labware = [],
+    mix_after: Tuple[int, int] = None,
+    passes: Iterable[str] = (),
 ):
     """
     Aliquot 10 µL of the purified RNA extract to an empty Bio-Rad 96 well plate
@@ -113,14 +273,24 @@ def aliquot_eluent(
         pipette: Which Opentrons Pipette the operation will use.
         source_plate: The plate to aspirate from.
         destination_plate: The plate being dispensed to.
+        mix_after: Mixing to perform once the RNA is dispensed; used when the
+            master mix is already in the destination plate.
+        passes: Optimization passes applied to the plan of the stage.
     """
+    plan = []
     for column in range(num_cols):
-        transfer(
+        plan += transfer(
             volume_ul=VOL_RNA,
             pipette=pipette,
             source=source_plate[column],
             dest=destination_plate[column],
+            mix_after=mix_after,
+            touch_tip=(
+                (TOUCH_RADIUS_SM_SM, TOUCH_HEIGHT_SM_SM) if mix_after else None
+            ),
+            liquid="rna_eluate",
         )
+    execute_plan(pipette, plan, passes)
 
 
 def add_master_mix(
@@ -128,6 +298,7 @@ def add_master_mix(
     pipette: InstrumentContext = None,
     source_plate: Labware = None,
     destination_plate: Labware = [],
+    passes: Iterable[str] = (),
 ):
     """
     Transfer 15ul of reagent mix (reagent plate) to the aliquoted reaction
@@ -138,17 +309,171 @@ def add_master_mix(
         pipette: Which Opentrons Pipette the operation will use.
         source_plate: The plate to aspirate from.
         destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
     """
+    plan = []
     for c in range(num_cols):
-        transfer(
+        plan += transfer(
             volume_ul=VOL_MASTER_MIX,
             pipette=pipette,
             source=source_plate,
             dest=destination_plate[c],
-            mix_before=(5, VOL_MASTER_MIX),
-            mix_after=(5, VOL_MASTER_MIX),
-            touch_tip=(TOUCH_RADIUS_SM_SM, TOUCH_HEIGHT_SM_SM),
+            mix_before=SETTINGS["MIX_MASTER_MIX"],
+            mix_after=SETTINGS["MIX_MASTER_MIX"],
+            liquid="master_mix",
         )
+    execute_plan(pipette, plan, passes)
+
+
+def distribute_master_mix(
+    num_cols: int = 1,
+    pipette: InstrumentContext = None,
+    source_plate: Labware = None,
+    destination_plate: Labware = [],
+    passes: Iterable[str] = (),
+):
+    """
+    Distribute 15ul of reagent mix (reagent plate) to the empty reaction plate
+    with a single tip, ahead of aliquot_eluent.
+
+    Args:
+        num_cols: Number of columns to operate on.
+        pipette: Which Opentrons Pipette the operation will use.
+        source_plate: The plate to aspirate from.
+        destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
+    """
+    plan = distribute(
+        volume_ul=VOL_MASTER_MIX,
+        pipette=pipette,
+        source=source_plate,
+        dest=destination_plate[:num_cols],
+        mix_before=SETTINGS["MIX_MASTER_MIX"],
+        liquid="master_mix",
+    )
+    execute_plan(pipette, plan, passes)
+
+
+def estimate_plate_prep(
+    num_cols: int = 1,
+    master_mix_first: bool = False,
+) -> Tuple[int, float]:
+    """
+    Rough estimate of the pipetting commands issued by aliquot_eluent and the
+    master mix addition for either ordering.
+
+    Args:
+        num_cols: Number of columns to operate on.
+        master_mix_first: Whether the master mix is distributed first.
+
+    Returns:
+        The number of commands and the estimated duration in seconds.
+    """
+    master_mix_reps = SETTINGS["MIX_MASTER_MIX"][0]
+    if master_mix_first:
+        # one tip for all of the master mix, then RNA with a mix after
+        tip_commands = 2 + 2 * num_cols
+        commands = 1 + 3 * num_cols + 5 * num_cols
+        mix_reps = master_mix_reps + SETTINGS["MIX_RNA"][0] * num_cols
+    else:
+        tip_commands = 4 * num_cols
+        commands = 3 * num_cols + 6 * num_cols
+        mix_reps = 2 * master_mix_reps * num_cols
+    seconds = (
+        tip_commands * EST_TIP_S
+        + commands * EST_COMMAND_S
+        + mix_reps * EST_MIX_REP_S
+    )
+    return tip_commands + commands, seconds
+
+
+def working_volume(pipette: InstrumentContext) -> float:
+    """
+    The volume the pipette can hold with its tips attached, known before a tip
+    is picked up.
+
+    Args:
+        pipette: Which Opentrons Pipette the operation will use.
+
+    Returns:
+        The working volume in uL.
+    """
+    return min(pipette.max_volume, pipette.tip_racks[0].wells()[0].max_volume)
+
+
+def distribute(
+    volume_ul: int = 0,
+    pipette: InstrumentContext = None,
+    source: Labware = [],
+    dest: List[Labware] = [],
+    disposal_ul: int = 0,
+    mix_before: Tuple[int, int] = None,
+    liquid: str = "aqueous",
+) -> List[dict]:
+    """
+    Custom distribute function; a single tip serves every destination, with
+    each aspiration split across as many destinations as fit in the tip. The
+    tip never touches the destination contents so it can be reused. The steps
+    are returned as a plan for execute_plan().
+
+    Args:
+        volume_ul: The volume to dispense into each destination.
+        pipette: Which pipette to perform the operation with.
+        source: The labware that is being aspirated from.
+        dest: The labware columns being dispensed to.
+        disposal_ul: Extra volume aspirated with each multi-dispense and blown
+            back into the source.
+        mix_before: Mixing of the source before the first aspiration.
+        liquid: The LIQUID_CLASSES entry of the liquid; only its flow rates
+            apply, as the tip holds several dispenses at once.
+
+    Returns:
+        The plan for the distribution.
+    """
+    plan = [{"OP": "pick_up_tip"}]
+    liquid_class = SETTINGS["LIQUID_CLASSES"][liquid]
+    max_vol = working_volume(pipette)
+    per_load = max(1, (max_vol - disposal_ul) // volume_ul)
+    if per_load == 1:
+        disposal_ul = 0
+
+    if mix_before:
+        plan.append(
+            {
+                "OP": "mix",
+                "REPS": mix_before[0],
+                "VOL": min(mix_before[1], max_vol),
+                "LOC": source[0],
+            }
+        )
+    for i in range(0, len(dest), per_load):
+        load = dest[i : i + per_load]
+        plan.append(
+            {
+                "OP": "aspirate",
+                "VOL": volume_ul * len(load) + disposal_ul,
+                "LOC": source[0],
+                "RATE": liquid_class["ASPIRATE"],
+            }
+        )
+        for d in load:
+            plan.append(
+                {
+                    "OP": "dispense",
+                    "VOL": volume_ul,
+                    "LOC": d[0],
+                    "RATE": liquid_class["DISPENSE"],
+                }
+            )
+        plan.append(
+            {
+                "OP": "blow_out",
+                "LOC": source[0].top() if disposal_ul else load[-1][0].top(),
+                "RATE": liquid_class["BLOW_OUT"],
+            }
+        )
+    plan.append({"OP": "drop_tip"})
+    return plan
 
 
 def transfer(
@@ -157,16 +482,16 @@ def transfer(
     pipette: InstrumentContext = None,
     source: Labware = [],
     dest: Labware = [],
-    mix_before: Tuple[int] = None,
-    mix_after: Tuple[int] = None,
-    touch_tip: Tuple[int] = None,
-    delay_time_s: int = None,
-    protocol: protocol_api.ProtocolContext = None,
-):
+    mix_before: Tuple[int, int] = None,
+    mix_after: Tuple[int, int] = None,
+    touch_tip: Tuple[float, float] = None,
+    liquid: str = "aqueous",
+) -> List[dict]:
     """
     Custom transfer function; when the volume needed exceeds the pipette's max
     volume this function will prioritize tip reuse by pipetting to the top of
-    the wells until the last dispensation
+    the wells until the last dispensation. Nothing is sent to the pipette; the
+    steps are returned as a plan for execute_plan().
 
     Args:
         volume_ul: The requested pipetting volume.
@@ -176,19 +501,26 @@ def transfer(
         dest: The labware being dispensed to.
         mix_before: Whether to perform mixing before the transfer process.
         mix_after: Whether to perform mixing after the transfer process.
-        touch_tip: Whether to allow the tip to be submerged.
-        delay_time_s: How long to delay while aspirating.
-        protocol: The protocol context to operate on.
+        touch_tip: Touch tip radius and height after the final dispense; the
+            liquid class setting when not given.
+        liquid: The LIQUID_CLASSES entry of the liquid being transferred.
+
+    Returns:
+        The plan for the transfer.
     """
-    # must pick up tip first before proper working volume is calculated
-    pipette.pick_up_tip()
-    max_vol = pipette.hw_pipette["working_volume"]
+    plan = [{"OP": "pick_up_tip"}]
+    liquid_class = SETTINGS["LIQUID_CLASSES"][liquid]
+    if touch_tip is None:
+        touch_tip = liquid_class["TOUCH_TIP"]
+    air_gap = liquid_class["AIR_GAP"]
+
+    max_vol = working_volume(pipette)
     if mix_before and len(mix_before) == 2:
         mix_before_vol = max_vol if mix_before[1] > max_vol else mix_before[1]
     if mix_after and len(mix_after) == 2:
         mix_after_vol = max_vol if mix_after[1] > max_vol else mix_after[1]
 
-    n = math.ceil(volume_ul / max_vol)
+    n = math.ceil(volume_ul / (max_vol - air_gap))
     vol_ar = [
         volume_ul // n + (1 if x < volume_ul % n else 0) for x in range(n)
     ]
@@ -196,75 +528,849 @@ def transfer(
     # dispense to the top of the well so we can reuse the tips
     for v in vol_ar[:-1]:
         if mix_before:
-            if len(mix_before) == 1:
-                pipette.mix(
-                    repetitions=mix_before[0],
-                    volume=v,
-                    location=source[0],
-                )
-            if len(mix_before) == 2:
-                pipette.mix(
-                    repetitions=mix_before[0],
-                    volume=mix_before_vol,
-                    location=source[0],
-                )
-        pipette.aspirate(volume=v, location=source[0])
-        if delay_time_s:
-            pipette.air_gap(volume=0)
-            protocol.delay(seconds=delay_time_s)
+            plan.append(
+                {
+                    "OP": "mix",
+                    "REPS": mix_before[0],
+                    "VOL": v if len(mix_before) == 1 else mix_before_vol,
+                    "LOC": source[0],
+                }
+            )
+        plan += aspirate_steps(v, source[0], liquid_class)
 
-        dispense_vol = v if dispense_all else v - 10
-        pipette.dispense(volume=dispense_vol, location=dest[0].top())
-        pipette.blow_out(location=dest[0])
+        dispense_vol = (v if dispense_all else v - 10) + air_gap
+        plan.append(
+            {
+                "OP": "dispense",
+                "VOL": dispense_vol,
+                "LOC": dest[0].top(),
+                "RATE": liquid_class["DISPENSE"],
+            }
+        )
+        plan.append(
+            {
+                "OP": "blow_out",
+                "LOC": dest[0],
+                "RATE": liquid_class["BLOW_OUT"],
+            }
+        )
 
     # the final transfer
     if mix_before:
         if len(mix_before) == 1:
+            mix_vol = vol_ar[-1]
+        elif mix_after and len(mix_after) == 2:
+            mix_vol = mix_after_vol
+        else:
+            mix_vol = mix_before_vol
+        plan.append(
+            {
+                "OP": "mix",
+                "REPS": mix_before[0],
+                "VOL": mix_vol,
+                "LOC": source[0],
+            }
+        )
+    plan += aspirate_steps(vol_ar[-1], source[0], liquid_class)
+
+    dispense_vol = (vol_ar[-1] if dispense_all else vol_ar[-1] - 10) + air_gap
+    plan.append(
+        {
+            "OP": "dispense",
+            "VOL": dispense_vol,
+            "LOC": dest[0],
+            "RATE": liquid_class["DISPENSE"],
+        }
+    )
+
+    if mix_after:
+        plan.append(
+            {
+                "OP": "mix",
+                "REPS": mix_after[0],
+                "VOL": vol_ar[-1] if len(mix_after) == 1 else mix_after_vol,
+                "LOC": None,
+            }
+        )
+
+    plan.append(
+        {"OP": "blow_out", "LOC": dest[0], "RATE": liquid_class["BLOW_OUT"]}
+    )
+    if touch_tip:
+        plan.append(
+            {
+                "OP": "touch_tip",
+                "RADIUS": touch_tip[0],
+                "HEIGHT": touch_tip[1],
+            }
+        )
+    plan.append({"OP": "drop_tip"})
+    return plan
+
+
+def aspirate_steps(
+    volume_ul: float = 0, location=None, liquid_class: dict = None
+) -> List[dict]:
+    """
+    Plan steps for one aspiration: the aspiration itself, then the delay and
+    air gap of the liquid class.
+
+    Args:
+        volume_ul: The volume to aspirate.
+        location: The well or location to aspirate from.
+        liquid_class: The LIQUID_CLASSES entry of the liquid.
+
+    Returns:
+        The plan steps.
+    """
+    plan = [
+        {
+            "OP": "aspirate",
+            "VOL": volume_ul,
+            "LOC": location,
+            "RATE": liquid_class["ASPIRATE"],
+        }
+    ]
+    if liquid_class["DELAY_S"]:
+        # the tip is still in the liquid, so viscous liquid can catch up
+        plan.append({"OP": "delay", "SECONDS": liquid_class["DELAY_S"]})
+    if liquid_class["AIR_GAP"]:
+        plan.append({"OP": "air_gap", "VOL": liquid_class["AIR_GAP"]})
+    return plan
+
+
+def plan_well(location):
+    """
+    The well a plan location refers to.
+
+    Args:
+        location: A Well, a Location within a well or None.
+
+    Returns:
+        The Well, or None when the location is not in a well.
+    """
+    if location is None or not hasattr(location, "labware"):
+        return location
+    return location.labware.get_parent_labware_and_well()[1]
+
+
+def plan_loads(plan: List[dict], start: int) -> Tuple[List[dict], int]:
+    """
+    The load of the tip that starts at an aspiration: the aspiration, the
+    dispenses from the top of the destination wells that empty the tip and
+    the blow-out after them, if any.
+
+    Args:
+        plan: The plan.
+        start: Index of the aspiration in the plan.
+
+    Returns:
+        The steps of the load and the index of the step after it; no steps
+        when the tip is not loaded that way, e.g. when it dispenses into the
+        liquid, holds a disposal volume or mixes.
+    """
+    end = start + 1
+    while end < len(plan) and plan[end]["OP"] == "dispense":
+        end += 1
+    dispenses = plan[start + 1 : end]
+    if (
+        not dispenses
+        or sum(op["VOL"] for op in dispenses) != plan[start]["VOL"]
+        or any(
+            op["LOC"] is None or op["LOC"] != plan_well(op["LOC"]).top()
+            for op in dispenses
+        )
+    ):
+        return [], start
+    if end < len(plan) and plan[end]["OP"] == "blow_out":
+        end += 1
+    return plan[start:end], end
+
+
+def merge_aspirations(plan: List[dict], max_vol: float) -> List[dict]:
+    """
+    Optimization pass; back to back aspirations from the same location whose
+    dispenses do not touch the destination liquid, i.e. are made from the top
+    of the wells as by distribute(), are repacked into as few aspirations as
+    fit in the tip. The volume of each destination is dispensed in order, and
+    split across two aspirations where it does not fit in the first.
+
+    Args:
+        plan: The plan to optimize.
+        max_vol: The working volume of the pipette.
+
+    Returns:
+        The optimized plan.
+    """
+    result = []
+    i = 0
+    while i < len(plan):
+        op = plan[i]
+        loads = []
+        end = i
+        while end < len(plan) and plan[end]["OP"] == "aspirate":
+            load, after = plan_loads(plan, end)
+            if (
+                not load
+                or load[0]["LOC"] != op["LOC"]
+                or load[0].get("RATE") != op.get("RATE")
+                or (loads and load[-1]["OP"] != loads[0][-1]["OP"])
+            ):
+                break
+            loads.append(load)
+            end = after
+        total = sum(load[0]["VOL"] for load in loads)
+        if len(loads) < 2 or math.ceil(total / max_vol) >= len(loads):
+            result.append(op)
+            i += 1
+            continue
+
+        # the volume of each destination, in order
+        volumes = []
+        for load in loads:
+            for step in load[1:]:
+                if step["OP"] != "dispense":
+                    continue
+                if volumes and volumes[-1]["LOC"] == step["LOC"]:
+                    volumes[-1] = dict(
+                        volumes[-1], VOL=volumes[-1]["VOL"] + step["VOL"]
+                    )
+                else:
+                    volumes.append(step)
+        blow_out = loads[0][-1] if loads[0][-1]["OP"] == "blow_out" else None
+        while volumes:
+            dispenses = []
+            room = max_vol
+            while volumes and room > 0:
+                vol = min(volumes[0]["VOL"], room)
+                dispenses.append(dict(volumes[0], VOL=vol))
+                room -= vol
+                if vol == volumes[0]["VOL"]:
+                    volumes.pop(0)
+                else:
+                    volumes[0] = dict(volumes[0], VOL=volumes[0]["VOL"] - vol)
+            result.append(dict(op, VOL=max_vol - room))
+            result += dispenses
+            if blow_out:
+                result.append(dict(blow_out, LOC=dispenses[-1]["LOC"]))
+        i = end
+    return result
+
+
+def drop_redundant_blow_outs(plan: List[dict], max_vol: float) -> List[dict]:
+    """
+    Optimization pass; removes blow-outs of a tip that has not handled any
+    liquid since it was picked up or last blown out, when the blow-out would
+    not move the pipette either.
+
+    Args:
+        plan: The plan to optimize.
+        max_vol: The working volume of the pipette.
+
+    Returns:
+        The optimized plan.
+    """
+    result = []
+    empty = True
+    here = None
+    for op in plan:
+        if op["OP"] == "blow_out":
+            if empty and op["LOC"] in (None, here):
+                continue
+            empty = True
+        elif op["OP"] == "pick_up_tip":
+            empty = True
+        elif op["OP"] in ("aspirate", "dispense", "mix", "air_gap"):
+            empty = False
+        if op.get("LOC") is not None:
+            here = op["LOC"]
+        result.append(op)
+    return result
+
+
+def drop_redundant_mixes(plan: List[dict], max_vol: float) -> List[dict]:
+    """
+    Optimization pass; removes a mix of a well the same tip has already mixed,
+    unless liquid was dispensed into the well since. This covers re-mixing the
+    source before every part of a split transfer.
+
+    Args:
+        plan: The plan to optimize.
+        max_vol: The working volume of the pipette.
+
+    Returns:
+        The optimized plan.
+    """
+    result = []
+    mixed = []
+    here = None
+    for op in plan:
+        if op.get("LOC") is not None:
+            here = op["LOC"]
+        well = plan_well(here)
+        if op["OP"] == "pick_up_tip":
+            mixed = []
+        elif op["OP"] == "dispense":
+            mixed = [w for w in mixed if w != well]
+        elif op["OP"] == "mix":
+            if well in mixed:
+                continue
+            mixed.append(well)
+        result.append(op)
+    return result
+
+
+def plan_point(location):
+    """
+    The deck position of a plan location.
+
+    Args:
+        location: A Well or a Location.
+
+    Returns:
+        The Point; the top of the well for a Well.
+    """
+    if hasattr(location, "point"):
+        return location.point
+    return location.top().point
+
+
+def nearest_tips(pipette: InstrumentContext) -> Callable:
+    """
+    Makes a plan pass that picks up each tip from the free tip column of the
+    pipette's racks with the shortest way from the previous location of the
+    plan to the tip and on to the next location, instead of from the next
+    column in rack order. A plan is taken to start at the trash. Tips that
+    lengthen the way by more than SETTINGS["TIP_MAX_DETOUR_MM"] are passed
+    over for the next tip in rack order.
+
+    Args:
+        pipette: The pipette whose tips are picked.
+
+    Returns:
+        The plan pass.
+    """
+    trash = plan_point(pipette.trash_container.wells()[0])
+
+    def distance(a, b):
+        return math.hypot(a.x - b.x, a.y - b.y)
+
+    def detour(a, tip, b):
+        return distance(a, tip) + distance(tip, b) - distance(a, b)
+
+    def pick(plan: List[dict], max_vol: float) -> List[dict]:
+        limit = SETTINGS["TIP_MAX_DETOUR_MM"]
+        result = []
+        taken = []
+        here = trash
+        for i, op in enumerate(plan):
+            if op["OP"] == "pick_up_tip" and op.get("LOC") is None:
+                there = next(
+                    (
+                        plan_point(step["LOC"])
+                        for step in plan[i + 1 :]
+                        if step.get("LOC") is not None
+                    ),
+                    here,
+                )
+                free = [
+                    column[0]
+                    for rack in pipette.tip_racks
+                    for column in rack.columns()
+                    if column[0] not in taken
+                    and all(well.has_tip for well in column[: pipette.channels])
+                ]
+                near = [
+                    well
+                    for well in free
+                    if limit is None
+                    or detour(here, plan_point(well), there) <= limit
+                ]
+                # with no tips left, pick_up_tip() reports it as usual
+                if free:
+                    tip = min(
+                        near,
+                        key=lambda well: detour(here, plan_point(well), there),
+                        default=free[0],
+                    )
+                    taken.append(tip)
+                    op = dict(op, LOC=tip)
+            if op["OP"] == "drop_tip":
+                here = trash
+            elif op.get("LOC") is not None:
+                here = plan_point(op["LOC"])
+            result.append(op)
+        return result
+
+    return pick
+
+
+OPTIMIZATION_PASSES = {
+    "merge_aspirations": merge_aspirations,
+    "drop_blow_outs": drop_redundant_blow_outs,
+    "drop_mixes": drop_redundant_mixes,
+}
+
+
+def execute_plan(
+    pipette: InstrumentContext = None,
+    plan: List[dict] = [],
+    passes: Iterable[str] = (),
+    protocol: protocol_api.ProtocolContext = None,
+):
+    """
+    Runs the optimization passes over a plan and sends the result to the
+    pipette.
+
+    Args:
+        pipette: Which pipette to perform the operation with.
+        plan: The plan built by transfer(), distribute() or a stage.
+        passes: Names of the OPTIMIZATION_PASSES, or pass functions such as
+            the one from nearest_tips(), to apply in order.
+        protocol: The protocol context to operate on; needed for delays.
+    """
+    max_vol = working_volume(pipette)
+    for name in passes:
+        if isinstance(name, str):
+            plan = OPTIMIZATION_PASSES[name](plan, max_vol)
+        else:
+            plan = name(plan, max_vol)
+
+    for op in plan:
+        if op["OP"] == "pick_up_tip":
+            pipette.pick_up_tip(op.get("LOC"))
+        elif op["OP"] == "drop_tip":
+            pipette.drop_tip()
+        elif op["OP"] == "mix":
             pipette.mix(
-                repetitions=mix_before[0],
-                volume=vol_ar[-1],
-                location=source[0],
+                repetitions=op["REPS"], volume=op["VOL"], location=op["LOC"]
             )
-        if len(mix_before) == 2:
-            pipette.mix(
-                repetitions=mix_before[0],
-                volume=mix_after_vol,
-                location=source[0],
+        elif op["OP"] == "aspirate":
+            pipette.aspirate(
+                volume=op["VOL"], location=op["LOC"], rate=op.get("RATE", 1.0)
             )
-    pipette.aspirate(volume=vol_ar[-1], location=source[0])
-    if delay_time_s:
-        pipette.air_gap(volume=0)
-        protocol.delay(seconds=delay_time_s)
+        elif op["OP"] == "dispense":
+            pipette.dispense(
+                volume=op["VOL"], location=op["LOC"], rate=op.get("RATE", 1.0)
+            )
+        elif op["OP"] == "blow_out":
+            # blow_out() takes no rate, the flow rate is restored right after
+            default_rate = pipette.flow_rate.blow_out
+            pipette.flow_rate.blow_out = default_rate * op.get("RATE", 1.0)
+            pipette.blow_out(location=op["LOC"])
+            pipette.flow_rate.blow_out = default_rate
+        elif op["OP"] == "touch_tip":
+            pipette.touch_tip(
+                radius=op["RADIUS"],
+                v_offset=op["HEIGHT"],
+                speed=SETTINGS["TOUCH_SPEED"],
+            )
+        elif op["OP"] == "air_gap":
+            pipette.air_gap(volume=op["VOL"])
+        elif op["OP"] == "delay":
+            protocol.delay(seconds=op["SECONDS"])
+        else:
+            raise ValueError("Unknown plan op: {}".format(op["OP"]))
 
-    dispense_vol = vol_ar[-1] if dispense_all else vol_ar[-1] - 10
-    pipette.dispense(volume=dispense_vol, location=dest[0])
 
-    if mix_after:
-        if len(mix_after) == 1:
-            pipette.mix(repetitions=mix_after[0], volume=vol_ar[-1])
-        if len(mix_after) == 2:
-            pipette.mix(repetitions=mix_after[0], volume=mix_after_vol)
+def trace_stage(frame) -> str:
+    """
+    Names the protocol stage being run: the outermost function below run()
+    that a call is nested in.
 
-    pipette.blow_out(location=dest[0])
-    if touch_tip:
-        pipette.touch_tip(
-            radius=touch_tip[0],
-            v_offset=touch_tip[1],
-            speed=TOUCH_SPEED,
+    Args:
+        frame: The stack frame the call was made from.
+
+    Returns:
+        The stage name, or "run" for calls made by run() itself.
+    """
+    stage = "run"
+    while frame is not None:
+        if frame.f_globals is globals():
+            if frame.f_code.co_name == "run":
+                break
+            stage = frame.f_code.co_name
+        frame = frame.f_back
+    return stage
+
+
+def trace_location(location) -> dict:
+    """
+    Describes where a traced call happened.
+
+    Args:
+        location: The Well or Location passed to the call.
+
+    Returns:
+        The labware label and the plate column index, when known.
+    """
+    if location is None:
+        return {}
+    if hasattr(location, "labware"):
+        labware, well = location.labware.get_parent_labware_and_well()
+    else:
+        labware, well = location.parent, location
+    fields = {"labware": labware.name if labware is not None else None}
+    if well is not None:
+        fields["column"] = int(well.well_name[1:]) - 1
+    return fields
+
+
+def trace_calls(
+    obj,
+    names: Iterable[str] = (),
+    path: str = TRACE_PATH,
+    state: dict = None,
+    **fields
+):
+    """
+    Replaces methods of a pipette, module or protocol context with ones that
+    append a JSONL line to the trace file for every call: stage, command,
+    plate column, volume, start time and duration.
+
+    Args:
+        obj: The context whose calls are traced.
+        names: The methods to trace, where the context has them.
+        path: The trace file on the robot.
+        state: Shared by every traced context; tracks the last location of
+            each context and skips calls made from within a traced call.
+        **fields: Written with every call, e.g. the pipette mount.
+    """
+
+    def traced(name, func):
+        def wrapper(*args, **kwargs):
+            if state["DEPTH"]:
+                return func(*args, **kwargs)
+            # these happen where the pipette already is when not given one
+            location = kwargs.get("location")
+            if location is None and name in TRACE_IN_PLACE_CALLS:
+                location = state["HERE"].get(id(obj))
+            else:
+                state["HERE"][id(obj)] = location
+
+            start = time.time()
+            state["DEPTH"] += 1
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                state["DEPTH"] -= 1
+            entry = dict(
+                fields,
+                stage=trace_stage(inspect.currentframe().f_back),
+                command=name,
+                volume=kwargs.get("volume"),
+                start=start,
+                duration_s=round(time.time() - start, 3),
+            )
+            entry.update(trace_location(location))
+            with open(path, "a") as trace_file:
+                trace_file.write(json.dumps(entry) + "\n")
+            return result
+
+        return wrapper
+
+    for name in names:
+        if hasattr(obj, name):
+            setattr(obj, name, traced(name, getattr(obj, name)))
+
+
+def protocol_revision() -> str:
+    """
+    Names the revision of the protocol: a digest of the code of its functions
+    and of its constants, so runs of the same file share it.
+
+    Returns:
+        The first 12 hex digits of the digest.
+    """
+    digest = hashlib.sha1()
+
+    def add_code(code):
+        digest.update(code.co_code)
+        digest.update(repr(code.co_names).encode())
+        for const in code.co_consts:
+            if inspect.iscode(const):
+                add_code(const)
+            elif isinstance(const, frozenset):
+                # set literals; their order changes between interpreters
+                digest.update(repr(sorted(const, key=repr)).encode())
+            else:
+                digest.update(repr(const).encode())
+
+    for name, value in sorted(globals().items()):
+        if inspect.isfunction(value):
+            add_code(value.__code__)
+        elif name.isupper():
+            # functions, e.g. the optimization passes, by name
+            text = json.dumps(
+                value, default=lambda obj: getattr(obj, "__name__", None)
+            )
+            digest.update(text.encode())
+    return digest.hexdigest()[:12]
+
+
+def trace_run(path: str = TRACE_PATH, **params):
+    """
+    Starts a run in the trace file with a line naming the protocol and its
+    revision; the calls traced after it belong to the run.
+
+    Args:
+        path: The trace file on the robot.
+        **params: The run() arguments, written with the line.
+    """
+    entry = {
+        "command": "run",
+        "protocol": metadata["protocolName"],
+        "revision": protocol_revision(),
+        "start": time.time(),
+        "params": params,
+    }
+    with open(path, "a") as trace_file:
+        trace_file.write(json.dumps(entry) + "\n")
+
+
+def take_next_tip(pipette: InstrumentContext, location=None):
+    """
+    Marks the tips the pipette would pick up next as used, without moving.
+
+    Args:
+        pipette: Which Opentrons Pipette the operation will use.
+        location: The tip well the pick up was given, if any.
+    """
+    if location is not None:
+        location.parent.use_tips(location, pipette.channels)
+        return
+    for rack in pipette.tip_racks:
+        well = rack.next_tip(pipette.channels)
+        if well is not None:
+            rack.use_tips(well, pipette.channels)
+            return
+
+
+def journal_calls(
+    obj,
+    names: Iterable[str] = (),
+    path: str = JOURNAL_PATH,
+    state: dict = None,
+    **fields
+):
+    """
+    Replaces methods of a pipette or protocol context with ones that replay
+    the run without moving until state["RESUME"] dispenses are done, and
+    append a JSONL line to the journal file for every dispense after that.
+
+    A run interrupted with a tip on the pipette is resumed with a fresh tip
+    if the interrupted one still had liquid to move: it first draws what that
+    tip held for its remaining dispenses from the same source, and the
+    dispenses already done are not repeated. Otherwise the mixes, touch tips
+    and blow outs the tip had left are skipped, along with its drop.
+
+    Args:
+        obj: The context whose calls are journaled.
+        names: The methods to journal, where the context has them.
+        path: The journal file on the robot; nothing is written if not given.
+        state: Shared by every journaled context; counts the dispenses done,
+            tracks the tip, volume held and last aspirate and dispense of
+            each context and skips calls made from within a journaled call.
+        **fields: Written with every line, e.g. the pipette mount.
+    """
+
+    def replay(here, name, kwargs):
+        if name == "pick_up_tip":
+            take_next_tip(obj, kwargs.get("location"))
+            here["TIP"], here["HELD"] = True, 0
+        elif name in ("drop_tip", "return_tip"):
+            here["TIP"] = False
+        elif name == "aspirate":
+            here["HELD"] += kwargs["volume"]
+        elif name == "dispense":
+            # air gaps are dispensed with the liquid, so this can go below 0
+            here["HELD"] = max(0, here["HELD"] - kwargs["volume"])
+        elif name == "blow_out":
+            here["HELD"] = 0
+
+    def journaled(name, func):
+        def wrapper(*args, **kwargs):
+            if state["DEPTH"]:
+                return func(*args, **kwargs)
+            if name == "pick_up_tip" and args:
+                kwargs["location"] = args[0]
+                args = ()
+            here = state["HERE"].setdefault(id(obj), {"TIP": False})
+            if state["DONE"] < state["RESUME"]:
+                replay(here, name, kwargs)
+                if name in ("aspirate", "dispense"):
+                    here[name] = kwargs
+                if name == "dispense":
+                    state["DONE"] += 1
+                return None
+
+            if here["TIP"]:
+                # the tip the run was interrupted with is off the pipette
+                if name not in ("aspirate", "dispense", "air_gap"):
+                    here["TIP"] = name not in ("drop_tip", "return_tip")
+                    return None
+                here["TIP"] = False
+                obj.pick_up_tip()
+                if here["HELD"]:
+                    obj.aspirate(**dict(here["aspirate"], volume=here["HELD"]))
+
+            if name in ("aspirate", "dispense"):
+                here[name] = kwargs
+            state["DEPTH"] += 1
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                state["DEPTH"] -= 1
+            if name != "dispense":
+                return result
+
+            state["DONE"] += 1
+            if not path:
+                return result
+            entry = dict(
+                fields,
+                done=state["DONE"],
+                stage=trace_stage(inspect.currentframe().f_back),
+                time=time.time(),
+            )
+            for call, key in (("aspirate", "source"), ("dispense", "dest")):
+                entry[key] = trace_location(here.get(call, {}).get("location"))
+            with open(path, "a") as journal_file:
+                journal_file.write(json.dumps(entry) + "\n")
+            return result
+
+        return wrapper
+
+    for name in names:
+        if hasattr(obj, name):
+            setattr(obj, name, journaled(name, getattr(obj, name)))
+
+
+def quadrant_columns(plate: Labware, quadrant: int = 0) -> List[List]:
+    """
+    The columns of one quadrant of a 384 well plate, as the 8 channel pipette
+    reaches them: every other row and every other column, starting from A1,
+    B1, A2 or B2.
+
+    Args:
+        plate: The 384 well plate.
+        quadrant: The quadrant, 0 to 3.
+
+    Returns:
+        12 columns of 8 wells, in the order of the columns of a 96 well plate.
+    """
+    row, col = quadrant % 2, quadrant // 2
+    return [column[row::2] for column in plate.columns()[col::2]]
+
+
+def well_map(
+    rna_plates: List[Labware] = [],
+    destinations: List[List] = [],
+    plate_cols: List[int] = [],
+) -> List[str]:
+    """
+    Lists which qPCR plate wells each RNA plate column goes to.
+
+    Args:
+        rna_plates: The RNA plates.
+        destinations: The qPCR plate columns each RNA plate goes to.
+        plate_cols: Number of columns to operate on in each RNA plate.
+
+    Returns:
+        One line per RNA plate column.
+    """
+    lines = []
+    for plate, dest, num_cols in zip(rna_plates, destinations, plate_cols):
+        for c in range(num_cols):
+            lines.append(
+                "{} column {}: {} {} to {}".format(
+                    plate.name,
+                    c + 1,
+                    dest[c][0].parent.name,
+                    dest[c][0].well_name,
+                    dest[c][-1].well_name,
+                )
+            )
+    return lines
+
+
+def tip_columns_left(tip_racks: List[Labware] = []) -> int:
+    """
+    Counts the full tip columns left in the tip racks.
+
+    Args:
+        tip_racks: The tip racks of the pipette.
+
+    Returns:
+        The number of columns still holding a tip in row A.
+    """
+    return sum(
+        1
+        for rack in tip_racks
+        for column in rack.columns()
+        if column[0].has_tip
+    )
+
+
+def sample_columns(num_samples: int, channels: int, max_cols: int) -> int:
+    """
+    Converts a sample count into the number of occupied plate columns.
+
+    Args:
+        num_samples: Number of samples loaded, filled column-wise from A1.
+        channels: Number of channels on the pipette addressing the plate.
+        max_cols: Number of columns available on the plate.
+
+    Returns:
+        The number of columns that contain samples.
+    """
+    num_cols = math.ceil(num_samples / channels)
+    if not 0 < num_cols <= max_cols:
+        raise ValueError(
+            "num_samples must be between 1 and {}, got {}".format(
+                channels * max_cols, num_samples
+            )
         )
-    pipette.drop_tip()
+    return num_cols
 
 
 # ------------------------------ Primary Method --------------------------------
 
 
-def run(protocol: protocol_api.ProtocolContext):
+def run(
+    protocol: protocol_api.ProtocolContext,
+    num_samples: int = NUM_SAMPLES,
+    master_mix_first: bool = MASTER_MIX_FIRST,
+    plan_passes: Iterable[str] = PLAN_PASSES,
+    nearest_tip_stages: Iterable[str] = NEAREST_TIP_STAGES,
+    trace: bool = TRACE,
+    trace_path: str = TRACE_PATH,
+    plate_384: bool = PLATE_384,
+    journal: bool = JOURNAL,
+    journal_path: str = JOURNAL_PATH,
+    resume: int = RESUME,
+):
     """
     Run the qPCR Assay.
 
     Args:
         protocol: The Opentrons Protocol Context controlling the execution of
             the protocol.
+        num_samples: Number of samples in the RNA plate; only the occupied
+            columns are processed.
+        master_mix_first: Distribute the master mix into the empty plate with
+            a single tip, then add RNA and mix.
+        plan_passes: Names of the OPTIMIZATION_PASSES applied to the plan of
+            every stage.
+        nearest_tip_stages: Names of the stages that pick up the tip nearest
+            their way instead of the next one in the rack.
+        trace: Append the timing of every call to trace_path.
+        trace_path: The JSONL trace file on the robot.
+        plate_384: Set up a 384 well qPCR plate from up to four RNA plates.
+        journal: Append a line to journal_path for every dispense.
+        journal_path: The JSONL journal file on the robot.
+        resume: Number of dispenses done before the run was interrupted; the
+            run up to that point is replayed without moving.
 
 
     """
@@ -277,7 +1383,7 @@ def run(protocol: protocol_api.ProtocolContext):
         location=TEMP_DECK_2["SLOT"],
     )
     qPCR_plate = temp_deck_1.load_labware(
-        QPCR_PLATE["NAME"],
+        (QPCR_PLATE_384 if plate_384 else QPCR_PLATE)["NAME"],
         label=QPCR_PLATE["LABEL"],
     )
     rna_plate = protocol.load_labware(
@@ -289,31 +1395,141 @@ def run(protocol: protocol_api.ProtocolContext):
         REAGENT_PLATE["NAME"],
         label=REAGENT_PLATE["LABEL"],
     )
-    mastermix = reagent_plate.columns()[0]
     tip_20 = [
         protocol.load_labware(i["NAME"], location=i["SLOT"], label=i["LABEL"])
-        for i in FILTER_TIP_20
+        for i in FILTER_TIP_20 + (FILTER_TIP_20_384 if plate_384 else [])
     ]
     p20 = protocol.load_instrument(
         P10_MULTI["NAME"], P10_MULTI["POSITION"], tip_racks=tip_20
     )
-    p20.well_bottom_clearance.aspirate = ASPIRATE_DEPTH_BOTTOM
-    p20.well_bottom_clearance.dispense = ASPIRATE_DEPTH_BOTTOM
-
-    num_cols = len(qPCR_plate.columns())
+    p20.well_bottom_clearance.aspirate = SETTINGS["ASPIRATE_DEPTH_BOTTOM"]
+    p20.well_bottom_clearance.dispense = SETTINGS["ASPIRATE_DEPTH_BOTTOM"]
 
-    temp_deck_1.set_temperature(celsius=TEMP)
-    temp_deck_2.set_temperature(celsius=TEMP)
+    if trace and not protocol.is_simulating():
+        trace_run(
+            trace_path,
+            num_samples=num_samples,
+            master_mix_first=master_mix_first,
+            plan_passes=list(plan_passes),
+            nearest_tip_stages=list(nearest_tip_stages),
+            plate_384=plate_384,
+        )
+        state = {"DEPTH": 0, "HERE": {}}
+        trace_calls(
+            p20, TRACE_INSTRUMENT_CALLS, trace_path, state, mount=p20.mount
+        )
+        for module in (temp_deck_1, temp_deck_2):
+            trace_calls(
+                module,
+                TRACE_MODULE_CALLS,
+                trace_path,
+                state,
+                module=str(module.geometry.parent),
+            )
+        trace_calls(protocol, TRACE_PROTOCOL_CALLS, trace_path, state)
+    if journal or resume:
+        path = journal_path if journal else None
+        state = {"DEPTH": 0, "DONE": 0, "RESUME": resume, "HERE": {}}
+        journal_calls(
+            p20, JOURNAL_INSTRUMENT_CALLS, path, state, mount=p20.mount
+        )
+        journal_calls(protocol, JOURNAL_PROTOCOL_CALLS, path, state)
+    if resume:
+        protocol.comment("Resuming after {} dispenses".format(resume))
 
-    aliquot_eluent(
-        num_cols=num_cols,
-        pipette=p20,
-        source_plate=rna_plate.columns(),
-        destination_plate=qPCR_plate.columns(),
-    )
-    add_master_mix(
-        num_cols=num_cols,
-        pipette=p20,
-        source_plate=mastermix,
-        destination_plate=qPCR_plate.columns(),
+    num_cols = sample_columns(
+        num_samples, p20.channels, len(qPCR_plate.wells()) // p20.channels
     )
+    for name in plan_passes:
+        if name not in OPTIMIZATION_PASSES:
+            raise ValueError("Unknown plan pass: {}".format(name))
+    passes = {}
+    for stage in ("aliquot_eluent", "add_master_mix", "distribute_master_mix"):
+        passes[stage] = list(plan_passes)
+        if stage in nearest_tip_stages:
+            passes[stage].append(nearest_tips(p20))
+    for stage in nearest_tip_stages:
+        if stage not in passes:
+            raise ValueError("Unknown stage: {}".format(stage))
+
+    rna_plates = [rna_plate]
+    cols_per_plate = len(rna_plate.columns())
+    for i in RNA_PLATES_384[: math.ceil(num_cols / cols_per_plate) - 1]:
+        rna_plates.append(
+            protocol.load_labware(
+                i["NAME"], location=i["SLOT"], label=i["LABEL"]
+            )
+        )
+    plate_cols = [
+        min(cols_per_plate, num_cols - p * cols_per_plate)
+        for p in range(len(rna_plates))
+    ]
+    if plate_384:
+        destinations = [
+            quadrant_columns(qPCR_plate, q) for q in range(len(rna_plates))
+        ]
+        for line in well_map(rna_plates, destinations, plate_cols):
+            protocol.comment(line)
+    else:
+        destinations = [qPCR_plate.columns()]
+
+    for label, mode in (
+        ("Standard", False),
+        ("Master-mix-first", True),
+    ):
+        commands, seconds = estimate_plate_prep(num_cols, mode)
+        protocol.comment(
+            "{} plate prep estimate: {} commands, {}m{:02d}s".format(
+                label, commands, int(seconds // 60), int(seconds % 60)
+            )
+        )
+
+    # Both modules ramp while the run carries on; the run only waits for them
+    # once the master mix is handled.
+    temp_deck_1.start_set_temperature(celsius=TEMP)
+    temp_deck_2.start_set_temperature(celsius=TEMP)
+
+    for p, rna_plate in enumerate(rna_plates):
+        mastermix = reagent_plate.columns()[p]
+        tips_needed = (
+            plate_cols[p] + 1 if master_mix_first else 2 * plate_cols[p]
+        )
+        if tip_columns_left(tip_20) < tips_needed:
+            protocol.pause("Replace the 20uL tips")
+            p20.reset_tipracks()
+
+        if master_mix_first:
+            temp_deck_1.await_temperature(celsius=TEMP)
+            temp_deck_2.await_temperature(celsius=TEMP)
+            distribute_master_mix(
+                num_cols=plate_cols[p],
+                pipette=p20,
+                source_plate=mastermix,
+                destination_plate=destinations[p],
+                passes=passes["distribute_master_mix"],
+            )
+            aliquot_eluent(
+                num_cols=plate_cols[p],
+                pipette=p20,
+                source_plate=rna_plate.columns(),
+                destination_plate=destinations[p],
+                mix_after=SETTINGS["MIX_RNA"],
+                passes=passes["aliquot_eluent"],
+            )
+        else:
+            aliquot_eluent(
+                num_cols=plate_cols[p],
+                pipette=p20,
+                source_plate=rna_plate.columns(),
+                destination_plate=destinations[p],
+                passes=passes["aliquot_eluent"],
+            )
+            temp_deck_1.await_temperature(celsius=TEMP)
+            temp_deck_2.await_temperature(celsius=TEMP)
+            add_master_mix(
+                num_cols=plate_cols[p],
+                pipette=p20,
+                source_plate=mastermix,
+                destination_plate=destinations[p],
+                passes=passes["add_master_mix"],
+            )
@@ -19,8 +19,15 @@ bead mix. Prepare the required amount of Binding Bead Mix on each day of use.
 Written by Rita Chen & Dany Fu, DAMP Lab 2020-10-26
 --------------------------------------------------------------------------------
 """
+import hashlib
+import inspect
+import json
 import math
+import time
 from typing import (
+    Callable,
+    Iterable,
+    List,
     Tuple,
 )
 
@@ -40,6 +47,8 @@ metadata = {
 # Hardware
 TEMP_DECK = {"NAME": "Temperature Module GEN2", "SLOT": 7}
 MAG_DECK = {"NAME": "Magnetic Module", "SLOT": 10}  # gen 1 magnets
+# qPCR setup only, keeps the reagent plate cold in place of the SM4 tip rack
+QPCR_TEMP_DECK = {"NAME": "Temperature Module", "SLOT": 4}
 
 # Labware
 OUTPUT_PLATE = {  # 200uL per well, 96 wells
@@ -77,6 +86,24 @@ FILTER_TIP_20 = [
         "LABEL": "Filter Tip SM4",
     },
 ]
+# qPCR setup only, the second rack moves over for the temperature module
+QPCR_FILTER_TIP_20 = [
+    {
+        "NAME": "opentrons_96_filtertiprack_20ul",
+        "SLOT": 1,
+        "LABEL": "Filter Tip SM1",
+    },
+    {
+        "NAME": "opentrons_96_filtertiprack_20ul",
+        "SLOT": 5,
+        "LABEL": "Filter Tip SM5",
+    },
+]
+QPCR_PLATE = {  # 200uL per well, 96 wells
+    "NAME": "biorad_96_wellplate_200ul_pcr",
+    "SLOT": 8,  # replaces the waste reservoir once the beads are washed
+    "LABEL": "qPCR Plate",
+}
 FILTER_TIP_200 = [
     {
         "NAME": "opentrons_96_filtertiprack_200ul",
@@ -112,16 +139,14 @@ WASH_BUFFER = "Wash Buffer"
 ETHANOL1 = "Ethanol_1"
 ETHANOL2 = "Ethanol_2"
 ELUTION = "Elution Solution"
+ELUTION_STAGED = "Staged Elution Solution"
+MASTER_MIX = "Master Mix"
 
 DEFAULT_ASPIRATE_SPEED = 94
 DEFAULT_DISPENSE_SPEED = 94
 ASPIRATE_SPEED = 50
 DISPENSE_SPEED = 50
 
-DEPTH_BOTTOM_MID = 2.00  # 2mm from bottom
-DEPTH_BOTTOM_LOW = 1.00
-TOUCH_SPEED = 20.0  # minimum speed
-
 # 10uL pipette with deepwell plate
 TOUCH_RADIUS_SM_LG = 1.00
 TOUCH_HEIGHT_SM_LG = -3.0
@@ -134,6 +159,94 @@ TOUCH_HEIGHT_LG_LG = -7.0
 TOUCH_RADIUS_LG_SM = 0.8
 TOUCH_HEIGHT_LG_SM = -1.0
 
+# 10uL pipette with PCR plate
+TOUCH_RADIUS_SM_SM = 1.0
+TOUCH_HEIGHT_SM_SM = -1.0
+
+# Liquid classes, applied by transfer(): aspirate, dispense and blow-out flow
+# rates as multiples of the pipette's default flow rates, a delay with the tip
+# still in the liquid after each aspiration, an air gap drawn once the tip is
+# out, and the touch tip (radius, height) after the final dispense.
+LIQUID_CLASSES = {
+    "aqueous": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 0,
+        "TOUCH_TIP": None,
+    },
+    # viscous, keeps dripping from the tip
+    "bead_mix": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 5,
+        "AIR_GAP": 10,
+        "TOUCH_TIP": (TOUCH_RADIUS_LG_LG, TOUCH_HEIGHT_LG_LG),
+    },
+    "wash_buffer": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 0,
+        "TOUCH_TIP": (TOUCH_RADIUS_LG_LG, TOUCH_HEIGHT_LG_LG),
+    },
+    # volatile, creeps out of the tip
+    "ethanol": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 10,
+        "TOUCH_TIP": (TOUCH_RADIUS_LG_LG, TOUCH_HEIGHT_LG_LG),
+    },
+    "elution": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 0,
+        "TOUCH_TIP": (TOUCH_RADIUS_LG_LG, TOUCH_HEIGHT_LG_LG),
+    },
+    # supernatant and eluate, drawn slowly to leave the bead pellet behind
+    "over_beads": {
+        "ASPIRATE": ASPIRATE_SPEED / DEFAULT_ASPIRATE_SPEED,
+        "DISPENSE": DISPENSE_SPEED / DEFAULT_DISPENSE_SPEED,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 0,
+        "TOUCH_TIP": None,
+    },
+    "rna_eluate": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 0,
+        "TOUCH_TIP": None,
+    },
+    "master_mix": {
+        "ASPIRATE": 1.0,
+        "DISPENSE": 1.0,
+        "BLOW_OUT": 1.0,
+        "DELAY_S": 0,
+        "AIR_GAP": 0,
+        "TOUCH_TIP": (TOUCH_RADIUS_SM_SM, TOUCH_HEIGHT_SM_SM),
+    },
+}
+# Liquid classes that settle in the source well; with the "resuspend" plan
+# pass, the source is only mixed again after this many aspirations or seconds
+# since its last mix. Other liquids are mixed before their first draw only.
+RESUSPEND = {
+    "bead_mix": {"DRAWS": 4, "SECONDS": 60},
+}
+# Rough per-command durations (s) for timing the plan
+EST_TIP_S = 8.0  # pick up or drop, including travel to the tip rack
+EST_COMMAND_S = 3.0  # aspirate, dispense, blow out or touch tip
+EST_MIX_REP_S = 1.5
+
 VOL_10 = 10
 VOL_250 = 250
 VOL_500 = 500
@@ -144,9 +257,180 @@ VOL_PK = 5
 VOL_BEAD = 275
 VOL_ELUTE = 50
 VOL_WASTE = 485
+VOL_RNA = 10
+VOL_MASTER_MIX = 15  # Reaction volume
+
+# Source columns each reagent may use, and the volume it needs per sample. A
+# reagent is loaded into the fewest of its columns that hold it, with the sample
+# columns split evenly between them.
+REAGENT_LAYOUT = {
+    PROTEINASE_K: {"LABWARE": "plate", "COLS": [0], "VOL": VOL_PK},
+    MS2: {"LABWARE": "plate", "COLS": [1], "VOL": VOL_MS2},
+    ELUTION: {"LABWARE": "reservoir", "COLS": [10], "VOL": VOL_ELUTE},
+    BEADS: {"LABWARE": "reservoir", "COLS": [0, 1], "VOL": VOL_BEAD},
+    WASH_BUFFER: {"LABWARE": "reservoir", "COLS": [2, 3, 4], "VOL": VOL_500},
+    ETHANOL1: {"LABWARE": "reservoir", "COLS": [5, 6, 7], "VOL": VOL_500},
+    ETHANOL2: {"LABWARE": "reservoir", "COLS": [8, 9], "VOL": VOL_250},
+    # qPCR setup only
+    MASTER_MIX: {"LABWARE": "plate", "COLS": [11], "VOL": VOL_MASTER_MIX},
+}
+# Source well volumes by labware: the volume left once the tips no longer
+# reach the liquid at the bottom clearance, and the most that is loaded
+SOURCE_WELL_VOL = {
+    REAGENT_PLATE["NAME"]: {"DEAD": 8, "MAX": 200},
+    REAGENT_RESERVOIR["NAME"]: {"DEAD": 1500, "MAX": 20000},  # ~2.5mm floor
+}
 
 TEMP = 4
-MAGDECK_ENGAGE_HEIGHT = 12
+
+# Settings that trade run time against how gently the samples are handled, in
+# one place so they can be tuned together; see ot2_sars_cov2/sweep.py. Mixes
+# are (repetitions, volume) before and after each transfer; without a volume
+# the working volume of the tip is mixed.
+SETTINGS = {
+    "DEPTH_BOTTOM_MID": 2.00,  # 2mm from bottom
+    "DEPTH_BOTTOM_LOW": 1.00,
+    "DEPTH_ABOVE_SAMPLE": 10.00,  # clears the 485uL lysate in the deepwell
+    "TOUCH_SPEED": 20.0,  # minimum speed
+    "MAGDECK_ENGAGE_HEIGHT": 12,
+    "MIX_SMALL_VOL_BEFORE": (2, VOL_10),
+    "MIX_SMALL_VOL_AFTER": (3, VOL_10),
+    "MIX_BEADS_BEFORE": (5,),
+    "MIX_BEADS_AFTER": (2,),
+    "MIX_WASH_BEFORE": (3,),
+    "MIX_WASH_AFTER": (5,),
+    "MIX_ELUTION_BEFORE": (3, 175),
+    "MIX_ELUTION_AFTER": (5, 35),
+    "MIX_MASTER_MIX": (5, VOL_MASTER_MIX),
+    "LIQUID_CLASSES": LIQUID_CLASSES,
+    # The furthest, in mm, that a tip picked by nearest_tips() may lengthen
+    # the way to the next well; the next tip in rack order is taken when no
+    # free tip is that close. None for no limit.
+    "TIP_MAX_DETOUR_MM": None,
+}
+
+# Number of samples loaded in the reaction plate, filled column-wise from A1.
+# Only the occupied columns are processed.
+NUM_SAMPLES = 96
+
+# How Proteinase K and MS2 are added to the samples:
+#   "transfer": new tip per column with mixing before and after
+#   "distribute": one tip per reagent, dispensed from above the sample
+#   "combined": one tip adds MS2 and Proteinase K to a column in a single pass
+SMALL_VOL_MODE = "transfer"
+DISPOSAL_SM = 5  # extra volume per multi-dispense with the 20uL tips
+AIR_GAP_SM = 2  # between the MS2 and Proteinase K in the "combined" tip
+
+# How Wash Buffer and Ethanol are added to the samples:
+#   "transfer": new tip per column with mixing before and after
+#   "distribute": one tip per reagent source column, dispensed from the top of
+#       the well; mixing is left to the shake that follows off-deck
+WASH_MODE = "transfer"
+
+# Run work that does not touch the reaction plate while the beads settle on
+# the magnet, e.g. staging the Elution Solution in the reagent plate.
+FILL_DELAYS = False
+ELUTION_STAGING_COL = 2  # first free reagent plate column
+STAGED_COLS_PER_WELL = 2  # sample columns served by each staging well
+VOL_STAGING_OVERAGE = 10
+EST_STAGING_TRIP_S = 11.0  # one 20uL aspirate and dispense, including travel
+
+# Continue with the qPCR assay setup in the same run: the eluate in the output
+# plate is aliquoted into a qPCR plate and the master mix is added, as in
+# qPCR_taqpath_multiplex.py. The reagent plate sits on a second temperature
+# module in slot 4 and the second 20uL tip rack moves to slot 5.
+QPCR_SETUP = False
+
+# Park the supernatant tip of each column in the 200uL rack in slot 2 and pick
+# it up again for the same column in every later discard round, instead of
+# using a new tip per column per round. The parked rack is not used for
+# anything else and is discarded with its tips after the run.
+PARK_TIPS = False
+
+# Optimization passes applied to the plan of every stage, in order; see
+# OPTIMIZATION_PASSES. e.g. ("drop_mixes", "merge_aspirations")
+PLAN_PASSES = ()
+
+# Stages, by function name, that take each tip from the free tip column
+# closest to the way between the pipette's last location and its next one,
+# rather than in rack order; see nearest_tips(). e.g. ("add_beads", "elute")
+# The plate columns themselves are always walked in order: every tip ends in
+# the trash, so the way from one column to the next does not depend on the
+# order, and a serpentine order would only change how long each column waits
+# between stages. See SETTINGS["TIP_MAX_DETOUR_MM"] to bound the detours.
+NEAREST_TIP_STAGES = ()
+
+# Append the timing of every pipette, module, delay and pause call to a JSONL
+# file on the robot, to find the slow steps on real hardware. Each run starts
+# with a line naming the protocol, its revision and the run() arguments; see
+# ot2_sars_cov2/runlog.py. Nothing is written while the protocol is simulated.
+TRACE = False
+TRACE_PATH = "/data/user_storage/rna_extraction_trace.jsonl"
+TRACE_INSTRUMENT_CALLS = (
+    "pick_up_tip",
+    "aspirate",
+    "dispense",
+    "mix",
+    "blow_out",
+    "touch_tip",
+    "air_gap",
+    "drop_tip",
+    "return_tip",
+)
+TRACE_MODULE_CALLS = (
+    "engage",
+    "disengage",
+    "set_temperature",
+    "start_set_temperature",
+    "await_temperature",
+    "deactivate",
+)
+TRACE_PROTOCOL_CALLS = ("delay", "pause")
+TRACE_IN_PLACE_CALLS = ("mix", "blow_out", "touch_tip", "air_gap")
+
+# Journal the progress of the run to a JSONL file on the robot, one line for
+# every dispense: the number of dispenses done so far ("done"), the stage and
+# the plate columns it drew from and dispensed to. To resume an interrupted
+# run, set RESUME to the "done" of the last line, take any tip off the
+# pipettes, putting a parked supernatant tip back in its well in the parking
+# rack, and start the run again with the deck as it was left. Everything
+# before that point is replayed without moving: the tips are marked used, the
+# racks replaced at the pauses are reset and the tracked liquid volumes are
+# worked out again, while the liquid handling, delays and operator pauses are
+# skipped. A tip that was interrupted between dispenses is replaced by a fresh
+# one, which draws what it still held and carries on from the next dispense.
+JOURNAL = False
+JOURNAL_PATH = "/data/user_storage/rna_extraction_journal.jsonl"
+RESUME = 0
+JOURNAL_INSTRUMENT_CALLS = (
+    "pick_up_tip",
+    "aspirate",
+    "dispense",
+    "mix",
+    "blow_out",
+    "touch_tip",
+    "air_gap",
+    "move_to",
+    "drop_tip",
+    "return_tip",
+)
+JOURNAL_PROTOCOL_CALLS = ("delay", "pause")
+
+# Track the liquid volume in the reservoirs, reagent plate and reaction plate
+# and aspirate MENISCUS_DEPTH below the surface the liquid has once the
+# aspiration is done, instead of at the bottom clearance. The beads are left
+# out, they are aspirated at the bottom where they were just mixed.
+TRACK_LIQUID = False
+MENISCUS_DEPTH = 3.0  # mm
+TRACKED_REAGENTS = (
+    PROTEINASE_K,
+    MS2,
+    WASH_BUFFER,
+    ETHANOL1,
+    ETHANOL2,
+    ELUTION,
+    MASTER_MIX,
+)
 
 
 # ----------------------------- Utility Methods --------------------------------
@@ -155,44 +439,115 @@ MAGDECK_ENGAGE_HEIGHT = 12
 def make_reagent_map(
     reagent_plate: Labware,
     reagent_reservoir: Labware,
+    num_cols: int = 12,
+    channels: int = 8,
+    staged: bool = False,
 ):
     """
-    Utility Method to generate static reagent map with given labware.
+    Utility Method to generate the reagent map for the samples being run,
+    following the REAGENT_LAYOUT and the SOURCE_WELL_VOL of the labware.
 
     Args:
         reagent_plate: 96 Well Plate for Reagents.
         reagent_reservoir: Reagent Reservoir.
+        num_cols: Number of sample columns the reagents are needed for.
+        channels: Number of channels on the pipettes.
+        staged: The Elution Solution is staged in the reagent plate first,
+            see stage_elution().
 
+    Returns:
+        For every reagent, its source columns with the volume loaded in the
+        column ("VOL") and the sample columns it serves ("COLS").
     """
-    return {
-        PROTEINASE_K: [  # 5uL per sample, 528uL in the well
-            {"VOL": 528, "WELL": reagent_plate.columns()[0]}
-        ],
-        MS2: [  # 5uL per sample, 528uL in the well
-            {"VOL": 528, "WELL": reagent_plate.columns()[1]}
-        ],
-        ELUTION: [  # 50uL per sample, 5.28mL in the well
-            {"VOL": 5280, "WELL": reagent_reservoir.columns()[10]}
-        ],
-        BEADS: [  # 275uL per sample, 14.52mL in the well
-            {"VOL": 14520, "WELL": reagent_reservoir.columns()[0]},
-            {"VOL": 14520, "WELL": reagent_reservoir.columns()[1]},
-        ],
-        WASH_BUFFER: [  # 500uL per sample, 17.6mL in the well
-            {"VOL": 17600, "WELL": reagent_reservoir.columns()[2]},
-            {"VOL": 17600, "WELL": reagent_reservoir.columns()[3]},
-            {"VOL": 17600, "WELL": reagent_reservoir.columns()[4]},
-        ],
-        ETHANOL1: [
-            {"VOL": 17600, "WELL": reagent_reservoir.columns()[5]},
-            {"VOL": 17600, "WELL": reagent_reservoir.columns()[6]},
-            {"VOL": 17600, "WELL": reagent_reservoir.columns()[7]},
-        ],
-        ETHANOL2: [
-            {"VOL": 13200, "WELL": reagent_reservoir.columns()[8]},
-            {"VOL": 13200, "WELL": reagent_reservoir.columns()[9]},
-        ],
-    }
+    labware = {"plate": reagent_plate, "reservoir": reagent_reservoir}
+    reagent_map = {}
+    for reagent, layout in REAGENT_LAYOUT.items():
+        plate = labware[layout["LABWARE"]]
+        wells = plate.columns()[layout["COLS"][0]]
+        dead_vol = SOURCE_WELL_VOL[plate.load_name]["DEAD"]
+        max_vol = SOURCE_WELL_VOL[plate.load_name]["MAX"]
+
+        def source_vol(cols: int) -> float:
+            if reagent == ELUTION and staged:
+                # stage_elution() fills a whole staging well, overage
+                # included, for every STAGED_COLS_PER_WELL sample columns
+                vol = math.ceil(cols / STAGED_COLS_PER_WELL) * (
+                    layout["VOL"] * STAGED_COLS_PER_WELL + VOL_STAGING_OVERAGE
+                )
+            else:
+                vol = cols * layout["VOL"]
+            return vol * channels / len(wells) + dead_vol
+
+        for num_sources in range(1, len(layout["COLS"]) + 1):
+            most_cols = math.ceil(num_cols / num_sources)
+            if source_vol(most_cols) <= max_vol:
+                break
+        else:
+            raise ValueError(
+                "{} for {} columns does not fit in {} source columns".format(
+                    reagent, num_cols, len(layout["COLS"])
+                )
+            )
+
+        reagent_map[reagent] = []
+        for s in range(num_sources):
+            cols = list(
+                range(
+                    s * num_cols // num_sources,
+                    (s + 1) * num_cols // num_sources,
+                )
+            )
+            reagent_map[reagent].append(
+                {
+                    "VOL": math.ceil(source_vol(len(cols))) * len(wells),
+                    "WELL": plate.columns()[layout["COLS"][s]],
+                    "COLS": cols,
+                }
+            )
+    return reagent_map
+
+
+def loading_sheet(
+    reagent_map: dict = None, reagents: Iterable[str] = ()
+) -> List[str]:
+    """
+    Lists what to load into each reagent source column.
+
+    Args:
+        reagent_map: The reagent map from make_reagent_map().
+        reagents: The reagents used by the run.
+
+    Returns:
+        One line per source column.
+    """
+    lines = []
+    for reagent in reagents:
+        for entry in reagent_map[reagent]:
+            wells = entry["WELL"]
+            lines.append(
+                "{} column {}: {}uL {}{}".format(
+                    wells[0].parent.name,
+                    wells[0].well_name[1:],
+                    entry["VOL"] // len(wells),
+                    reagent,
+                    " in each well" if len(wells) > 1 else "",
+                )
+            )
+    return lines
+
+
+def working_volume(pipette: InstrumentContext) -> float:
+    """
+    The volume the pipette can hold with its tips attached, known before a tip
+    is picked up.
+
+    Args:
+        pipette: Which Opentrons Pipette the operation will use.
+
+    Returns:
+        The working volume in uL.
+    """
+    return min(pipette.max_volume, pipette.tip_racks[0].wells()[0].max_volume)
 
 
 def transfer(
@@ -204,13 +559,13 @@ def transfer(
     mix_before: Tuple[int, int] = None,
     mix_after: Tuple[int, int] = None,
     touch_tip: Tuple[float, float] = None,
-    delay_time_s: int = None,
-    protocol: protocol_api.ProtocolContext = None,
-):
+    liquid: str = "aqueous",
+) -> List[dict]:
     """
     Custom transfer function; when the volume needed exceeds the pipette's max
     volume this function will prioritize tip reuse by pipetting to the top of
-    the wells until the last dispensation
+    the wells until the last dispensation. Nothing is sent to the pipette; the
+    steps are returned as a plan for execute_plan().
 
     Args:
         volume_ul: The requested pipetting volume.
@@ -220,21 +575,26 @@ def transfer(
         dest: The labware being dispensed to.
         mix_before: Whether to perform mixing before the transfer process.
         mix_after: Whether to perform mixing after the transfer process.
-        touch_tip: Whether to allow the tip to be submerged.
-        delay_time_s: How long to delay while aspirating.
-        protocol: The protocol context to operate on.
-    """
+        touch_tip: Touch tip radius and height after the final dispense; the
+            liquid class setting when not given.
+        liquid: The LIQUID_CLASSES entry of the liquid being transferred.
 
-    # must pick up tip first before proper working volume is calculated
-    pipette.pick_up_tip()
+    Returns:
+        The plan for the transfer.
+    """
+    plan = [{"OP": "pick_up_tip"}]
+    liquid_class = SETTINGS["LIQUID_CLASSES"][liquid]
+    if touch_tip is None:
+        touch_tip = liquid_class["TOUCH_TIP"]
+    air_gap = liquid_class["AIR_GAP"]
 
-    max_vol = pipette.hw_pipette["working_volume"]
+    max_vol = working_volume(pipette)
     if mix_before and len(mix_before) == 2:
         mix_before_vol = max_vol if mix_before[1] > max_vol else mix_before[1]
     if mix_after and len(mix_after) == 2:
         mix_after_vol = max_vol if mix_after[1] > max_vol else mix_after[1]
 
-    n = math.ceil(volume_ul / max_vol)
+    n = math.ceil(volume_ul / (max_vol - air_gap))
     vol_ar = [
         volume_ul // n + (1 if x < volume_ul % n else 0) for x in range(n)
     ]
@@ -242,80 +602,599 @@ def transfer(
     # dispense to the top of the well so we can reuse the tips
     for v in vol_ar[:-1]:
         if mix_before:
-            if len(mix_before) == 1:
-                pipette.mix(
-                    repetitions=mix_before[0],
-                    volume=v,
-                    location=source[0],
-                )
-            if len(mix_before) == 2:
-                pipette.mix(
-                    repetitions=mix_before[0],
-                    volume=mix_before_vol,
-                    location=source[0],
-                )
-        pipette.aspirate(volume=v, location=source[0])
-        if delay_time_s:
-            pipette.air_gap(volume=0)
-            protocol.delay(seconds=delay_time_s)
-
-        dispense_vol = v if dispense_all else v - 10
-        pipette.dispense(volume=dispense_vol, location=dest[0].top())
-        pipette.blow_out(location=dest[0])
+            plan.append(
+                {
+                    "OP": "mix",
+                    "REPS": mix_before[0],
+                    "VOL": v if len(mix_before) == 1 else mix_before_vol,
+                    "LOC": source[0],
+                    "LIQUID": liquid,
+                }
+            )
+        plan += aspirate_steps(v, source[0], liquid_class)
+
+        dispense_vol = (v if dispense_all else v - 10) + air_gap
+        plan.append(
+            {
+                "OP": "dispense",
+                "VOL": dispense_vol,
+                "LOC": dest[0].top(),
+                "RATE": liquid_class["DISPENSE"],
+            }
+        )
+        plan.append(
+            {
+                "OP": "blow_out",
+                "LOC": dest[0],
+                "RATE": liquid_class["BLOW_OUT"],
+            }
+        )
 
     # the final transfer
     if mix_before:
         if len(mix_before) == 1:
-            pipette.mix(
-                repetitions=mix_before[0],
-                volume=vol_ar[-1],
-                location=source[0],
+            mix_vol = vol_ar[-1]
+        elif mix_after and len(mix_after) == 2:
+            mix_vol = mix_after_vol
+        else:
+            mix_vol = mix_before_vol
+        plan.append(
+            {
+                "OP": "mix",
+                "REPS": mix_before[0],
+                "VOL": mix_vol,
+                "LOC": source[0],
+                "LIQUID": liquid,
+            }
+        )
+    plan += aspirate_steps(vol_ar[-1], source[0], liquid_class)
+
+    dispense_vol = (vol_ar[-1] if dispense_all else vol_ar[-1] - 10) + air_gap
+    plan.append(
+        {
+            "OP": "dispense",
+            "VOL": dispense_vol,
+            "LOC": dest[0],
+            "RATE": liquid_class["DISPENSE"],
+        }
+    )
+
+    if mix_after:
+        plan.append(
+            {
+                "OP": "mix",
+                "REPS": mix_after[0],
+                "VOL": vol_ar[-1] if len(mix_after) == 1 else mix_after_vol,
+                "LOC": None,
+            }
+        )
+
+    plan.append(
+        {"OP": "blow_out", "LOC": dest[0], "RATE": liquid_class["BLOW_OUT"]}
+    )
+    if touch_tip:
+        plan.append(
+            {
+                "OP": "touch_tip",
+                "RADIUS": touch_tip[0],
+                "HEIGHT": touch_tip[1],
+            }
+        )
+    plan.append({"OP": "drop_tip"})
+    return plan
+
+
+def distribute(
+    volume_ul: int = 0,
+    pipette: InstrumentContext = None,
+    source: Labware = [],
+    dest: List[Labware] = [],
+    disposal_ul: int = 0,
+    mix_before: Tuple[int, int] = None,
+    dispense_height: float = None,
+    liquid: str = "aqueous",
+) -> List[dict]:
+    """
+    Custom distribute function; a single tip serves every destination, with
+    each aspiration split across as many destinations as fit in the tip. The
+    tip never touches the destination contents so it can be reused. The steps
+    are returned as a plan for execute_plan().
+
+    Args:
+        volume_ul: The volume to dispense into each destination.
+        pipette: Which pipette to perform the operation with.
+        source: The labware that is being aspirated from.
+        dest: The labware columns being dispensed to.
+        disposal_ul: Extra volume aspirated with each multi-dispense and blown
+            back into the source.
+        mix_before: Mixing of the source before the first aspiration.
+        dispense_height: Height above the well bottom to dispense from; the
+            top of the well when not given.
+        liquid: The LIQUID_CLASSES entry of the liquid; only its flow rates
+            apply, as the tip holds several dispenses at once.
+
+    Returns:
+        The plan for the distribution.
+    """
+    plan = [{"OP": "pick_up_tip"}]
+    liquid_class = SETTINGS["LIQUID_CLASSES"][liquid]
+    max_vol = working_volume(pipette)
+
+    # volumes larger than the tip are split evenly, one destination at a time
+    n = math.ceil(volume_ul / max_vol)
+    vol_ar = [
+        volume_ul // n + (1 if x < volume_ul % n else 0) for x in range(n)
+    ]
+    per_load = max(1, (max_vol - disposal_ul) // volume_ul)
+    if per_load == 1:
+        disposal_ul = 0
+
+    if mix_before:
+        plan.append(
+            {
+                "OP": "mix",
+                "REPS": mix_before[0],
+                "VOL": min(mix_before[1], max_vol),
+                "LOC": source[0],
+            }
+        )
+    for i in range(0, len(dest), per_load):
+        load = dest[i : i + per_load]
+        for v in vol_ar:
+            plan.append(
+                {
+                    "OP": "aspirate",
+                    "VOL": v * len(load) + disposal_ul,
+                    "LOC": source[0],
+                    "RATE": liquid_class["ASPIRATE"],
+                }
             )
-        if len(mix_before) == 2:
-            pipette.mix(
-                repetitions=mix_before[0],
-                volume=mix_after_vol,
-                location=source[0],
+            for d in load:
+                if dispense_height is None:
+                    location = d[0].top()
+                else:
+                    location = d[0].bottom(z=dispense_height)
+                plan.append(
+                    {
+                        "OP": "dispense",
+                        "VOL": v,
+                        "LOC": location,
+                        "RATE": liquid_class["DISPENSE"],
+                    }
+                )
+            if disposal_ul:
+                location = source[0].top()
+            plan.append(
+                {
+                    "OP": "blow_out",
+                    "LOC": location,
+                    "RATE": liquid_class["BLOW_OUT"],
+                }
             )
-    pipette.aspirate(volume=vol_ar[-1], location=source[0])
-    if delay_time_s:
-        pipette.air_gap(volume=0)
-        protocol.delay(seconds=delay_time_s)
+    plan.append({"OP": "drop_tip"})
+    return plan
 
-    dispense_vol = vol_ar[-1] if dispense_all else vol_ar[-1] - 10
-    pipette.dispense(volume=dispense_vol, location=dest[0])
 
-    if mix_after:
-        if len(mix_after) == 1:
-            pipette.mix(repetitions=mix_after[0], volume=vol_ar[-1])
-        if len(mix_after) == 2:
-            pipette.mix(repetitions=mix_after[0], volume=mix_after_vol)
+def aspirate_steps(
+    volume_ul: float = 0, location=None, liquid_class: dict = None
+) -> List[dict]:
+    """
+    Plan steps for one aspiration: the aspiration itself, then the delay and
+    air gap of the liquid class.
 
-    pipette.blow_out(location=dest[0])
-    if touch_tip:
-        pipette.touch_tip(
-            radius=touch_tip[0],
-            v_offset=touch_tip[1],
-            speed=TOUCH_SPEED,
+    Args:
+        volume_ul: The volume to aspirate.
+        location: The well or location to aspirate from.
+        liquid_class: The LIQUID_CLASSES entry of the liquid.
+
+    Returns:
+        The plan steps.
+    """
+    plan = [
+        {
+            "OP": "aspirate",
+            "VOL": volume_ul,
+            "LOC": location,
+            "RATE": liquid_class["ASPIRATE"],
+        }
+    ]
+    if liquid_class["DELAY_S"]:
+        # the tip is still in the liquid, so viscous liquid can catch up
+        plan.append({"OP": "delay", "SECONDS": liquid_class["DELAY_S"]})
+    if liquid_class["AIR_GAP"]:
+        plan.append({"OP": "air_gap", "VOL": liquid_class["AIR_GAP"]})
+    return plan
+
+
+def plan_well(location):
+    """
+    The well a plan location refers to.
+
+    Args:
+        location: A Well, a Location within a well or None.
+
+    Returns:
+        The Well, or None when the location is not in a well.
+    """
+    if location is None or not hasattr(location, "labware"):
+        return location
+    return location.labware.get_parent_labware_and_well()[1]
+
+
+def plan_loads(plan: List[dict], start: int) -> Tuple[List[dict], int]:
+    """
+    The load of the tip that starts at an aspiration: the aspiration, the
+    dispenses from the top of the destination wells that empty the tip and
+    the blow-out after them, if any.
+
+    Args:
+        plan: The plan.
+        start: Index of the aspiration in the plan.
+
+    Returns:
+        The steps of the load and the index of the step after it; no steps
+        when the tip is not loaded that way, e.g. when it dispenses into the
+        liquid, holds a disposal volume or mixes.
+    """
+    end = start + 1
+    while end < len(plan) and plan[end]["OP"] == "dispense":
+        end += 1
+    dispenses = plan[start + 1 : end]
+    if (
+        not dispenses
+        or sum(op["VOL"] for op in dispenses) != plan[start]["VOL"]
+        or any(
+            op["LOC"] is None or op["LOC"] != plan_well(op["LOC"]).top()
+            for op in dispenses
         )
-    pipette.drop_tip()
+    ):
+        return [], start
+    if end < len(plan) and plan[end]["OP"] == "blow_out":
+        end += 1
+    return plan[start:end], end
+
+
+def merge_aspirations(plan: List[dict], max_vol: float) -> List[dict]:
+    """
+    Optimization pass; back to back aspirations from the same location whose
+    dispenses do not touch the destination liquid, i.e. are made from the top
+    of the wells as by distribute(), are repacked into as few aspirations as
+    fit in the tip. The volume of each destination is dispensed in order, and
+    split across two aspirations where it does not fit in the first.
+
+    Args:
+        plan: The plan to optimize.
+        max_vol: The working volume of the pipette.
+
+    Returns:
+        The optimized plan.
+    """
+    result = []
+    i = 0
+    while i < len(plan):
+        op = plan[i]
+        loads = []
+        end = i
+        while end < len(plan) and plan[end]["OP"] == "aspirate":
+            load, after = plan_loads(plan, end)
+            if (
+                not load
+                or load[0]["LOC"] != op["LOC"]
+                or load[0].get("RATE") != op.get("RATE")
+                or (loads and load[-1]["OP"] != loads[0][-1]["OP"])
+            ):
+                break
+            loads.append(load)
+            end = after
+        total = sum(load[0]["VOL"] for load in loads)
+        if len(loads) < 2 or math.ceil(total / max_vol) >= len(loads):
+            result.append(op)
+            i += 1
+            continue
+
+        # the volume of each destination, in order
+        volumes = []
+        for load in loads:
+            for step in load[1:]:
+                if step["OP"] != "dispense":
+                    continue
+                if volumes and volumes[-1]["LOC"] == step["LOC"]:
+                    volumes[-1] = dict(
+                        volumes[-1], VOL=volumes[-1]["VOL"] + step["VOL"]
+                    )
+                else:
+                    volumes.append(step)
+        blow_out = loads[0][-1] if loads[0][-1]["OP"] == "blow_out" else None
+        while volumes:
+            dispenses = []
+            room = max_vol
+            while volumes and room > 0:
+                vol = min(volumes[0]["VOL"], room)
+                dispenses.append(dict(volumes[0], VOL=vol))
+                room -= vol
+                if vol == volumes[0]["VOL"]:
+                    volumes.pop(0)
+                else:
+                    volumes[0] = dict(volumes[0], VOL=volumes[0]["VOL"] - vol)
+            result.append(dict(op, VOL=max_vol - room))
+            result += dispenses
+            if blow_out:
+                result.append(dict(blow_out, LOC=dispenses[-1]["LOC"]))
+        i = end
+    return result
+
+
+def drop_redundant_blow_outs(plan: List[dict], max_vol: float) -> List[dict]:
+    """
+    Optimization pass; removes blow-outs of a tip that has not handled any
+    liquid since it was picked up or last blown out, when the blow-out would
+    not move the pipette either.
+
+    Args:
+        plan: The plan to optimize.
+        max_vol: The working volume of the pipette.
+
+    Returns:
+        The optimized plan.
+    """
+    result = []
+    empty = True
+    here = None
+    for op in plan:
+        if op["OP"] == "blow_out":
+            if empty and op["LOC"] in (None, here):
+                continue
+            empty = True
+        elif op["OP"] == "pick_up_tip":
+            empty = True
+        elif op["OP"] in ("aspirate", "dispense", "mix", "air_gap"):
+            empty = False
+        if op.get("LOC") is not None:
+            here = op["LOC"]
+        result.append(op)
+    return result
+
+
+def drop_redundant_mixes(plan: List[dict], max_vol: float) -> List[dict]:
+    """
+    Optimization pass; removes a mix of a well the same tip has already mixed,
+    unless liquid was dispensed into the well since. This covers re-mixing the
+    source before every part of a split transfer.
+
+    Args:
+        plan: The plan to optimize.
+        max_vol: The working volume of the pipette.
+
+    Returns:
+        The optimized plan.
+    """
+    result = []
+    mixed = []
+    here = None
+    for op in plan:
+        if op.get("LOC") is not None:
+            here = op["LOC"]
+        well = plan_well(here)
+        if op["OP"] == "pick_up_tip":
+            mixed = []
+        elif op["OP"] == "dispense":
+            mixed = [w for w in mixed if w != well]
+        elif op["OP"] == "mix":
+            if well in mixed:
+                continue
+            mixed.append(well)
+        result.append(op)
+    return result
+
+
+def plan_seconds(op: dict) -> float:
+    """
+    Rough duration of a plan step.
+
+    Args:
+        op: The plan step.
+
+    Returns:
+        The estimated duration in seconds.
+    """
+    if op["OP"] in ("pick_up_tip", "drop_tip"):
+        return EST_TIP_S
+    if op["OP"] == "mix":
+        return EST_MIX_REP_S * op["REPS"]
+    if op["OP"] == "delay":
+        return op["SECONDS"]
+    return EST_COMMAND_S
+
+
+def schedule_resuspension(plan: List[dict], max_vol: float) -> List[dict]:
+    """
+    Optimization pass; a source well is mixed before it is drawn from only
+    when its liquid has had time to settle, as set in RESUSPEND, instead of
+    before every aspiration.
+
+    Args:
+        plan: The plan to optimize.
+        max_vol: The working volume of the pipette.
+
+    Returns:
+        The optimized plan.
+    """
+    result = []
+    mixed = {}  # well -> [draws since the last mix, time of the last mix]
+    clock = 0.0
+    for op in plan:
+        well = plan_well(op.get("LOC"))
+        if op["OP"] == "mix" and "LIQUID" in op:
+            settling = RESUSPEND.get(op["LIQUID"])
+            if well in mixed:
+                draws, last_mix = mixed[well]
+                if not settling or (
+                    draws < settling["DRAWS"]
+                    and clock - last_mix < settling["SECONDS"]
+                ):
+                    continue
+            mixed[well] = [0, clock]
+        elif op["OP"] == "aspirate" and well in mixed:
+            mixed[well][0] += 1
+        clock += plan_seconds(op)
+        result.append(op)
+    return result
+
+
+def plan_point(location):
+    """
+    The deck position of a plan location.
+
+    Args:
+        location: A Well or a Location.
 
+    Returns:
+        The Point; the top of the well for a Well.
+    """
+    if hasattr(location, "point"):
+        return location.point
+    return location.top().point
 
-def reagent_low(
-    quantity_remaining: int = 0,
-    quantity_to_transfer: int = 0,
-) -> bool:
+
+def nearest_tips(pipette: InstrumentContext) -> Callable:
     """
-    Checks to see if our Reagent is low.
+    Makes a plan pass that picks up each tip from the free tip column of the
+    pipette's racks with the shortest way from the previous location of the
+    plan to the tip and on to the next location, instead of from the next
+    column in rack order. A plan is taken to start at the trash. Tips that
+    lengthen the way by more than SETTINGS["TIP_MAX_DETOUR_MM"] are passed
+    over for the next tip in rack order.
 
     Args:
-        quantity_remaining: The quantity remaining
-        quantity_to_transfer: The quantity to transfer.
+        pipette: The pipette whose tips are picked.
 
     Returns:
-        True if we have enough reagent remaining, else False.
+        The plan pass.
+    """
+    trash = plan_point(pipette.trash_container.wells()[0])
+
+    def distance(a, b):
+        return math.hypot(a.x - b.x, a.y - b.y)
+
+    def detour(a, tip, b):
+        return distance(a, tip) + distance(tip, b) - distance(a, b)
+
+    def pick(plan: List[dict], max_vol: float) -> List[dict]:
+        limit = SETTINGS["TIP_MAX_DETOUR_MM"]
+        result = []
+        taken = []
+        here = trash
+        for i, op in enumerate(plan):
+            if op["OP"] == "pick_up_tip" and op.get("LOC") is None:
+                there = next(
+                    (
+                        plan_point(step["LOC"])
+                        for step in plan[i + 1 :]
+                        if step.get("LOC") is not None
+                    ),
+                    here,
+                )
+                free = [
+                    column[0]
+                    for rack in pipette.tip_racks
+                    for column in rack.columns()
+                    if column[0] not in taken
+                    and all(well.has_tip for well in column[: pipette.channels])
+                ]
+                near = [
+                    well
+                    for well in free
+                    if limit is None
+                    or detour(here, plan_point(well), there) <= limit
+                ]
+                # with no tips left, pick_up_tip() reports it as usual
+                if free:
+                    tip = min(
+                        near,
+                        key=lambda well: detour(here, plan_point(well), there),
+                        default=free[0],
+                    )
+                    taken.append(tip)
+                    op = dict(op, LOC=tip)
+            if op["OP"] == "drop_tip":
+                here = trash
+            elif op.get("LOC") is not None:
+                here = plan_point(op["LOC"])
+            result.append(op)
+        return result
+
+    return pick
+
+
+OPTIMIZATION_PASSES = {
+    "merge_aspirations": merge_aspirations,
+    "drop_blow_outs": drop_redundant_blow_outs,
+    "drop_mixes": drop_redundant_mixes,
+    "resuspend": schedule_resuspension,
+}
+
+
+def execute_plan(
+    pipette: InstrumentContext = None,
+    plan: List[dict] = [],
+    passes: Iterable[str] = (),
+    protocol: protocol_api.ProtocolContext = None,
+):
     """
-    return True if quantity_remaining < quantity_to_transfer else False
+    Runs the optimization passes over a plan and sends the result to the
+    pipette.
+
+    Args:
+        pipette: Which pipette to perform the operation with.
+        plan: The plan built by transfer(), distribute() or a stage.
+        passes: Names of the OPTIMIZATION_PASSES, or pass functions such as
+            the one from track_liquid(), to apply in order.
+        protocol: The protocol context to operate on; needed for delays.
+    """
+    max_vol = working_volume(pipette)
+    for name in passes:
+        if isinstance(name, str):
+            plan = OPTIMIZATION_PASSES[name](plan, max_vol)
+        else:
+            plan = name(plan, max_vol)
+
+    for op in plan:
+        if op["OP"] == "pick_up_tip":
+            pipette.pick_up_tip(op.get("LOC"))
+        elif op["OP"] == "drop_tip":
+            pipette.drop_tip()
+        elif op["OP"] == "return_tip":
+            pipette.return_tip()
+        elif op["OP"] == "mix":
+            pipette.mix(
+                repetitions=op["REPS"], volume=op["VOL"], location=op["LOC"]
+            )
+        elif op["OP"] == "aspirate":
+            pipette.aspirate(
+                volume=op["VOL"], location=op["LOC"], rate=op.get("RATE", 1.0)
+            )
+        elif op["OP"] == "dispense":
+            pipette.dispense(
+                volume=op["VOL"], location=op["LOC"], rate=op.get("RATE", 1.0)
+            )
+        elif op["OP"] == "blow_out":
+            # blow_out() takes no rate, the flow rate is restored right after
+            default_rate = pipette.flow_rate.blow_out
+            pipette.flow_rate.blow_out = default_rate * op.get("RATE", 1.0)
+            pipette.blow_out(location=op["LOC"])
+            pipette.flow_rate.blow_out = default_rate
+        elif op["OP"] == "touch_tip":
+            pipette.touch_tip(
+                radius=op["RADIUS"],
+                v_offset=op["HEIGHT"],
+                speed=SETTINGS["TOUCH_SPEED"],
+            )
+        elif op["OP"] == "air_gap":
+            pipette.air_gap(volume=op["VOL"])
+        elif op["OP"] == "delay":
+            protocol.delay(seconds=op["SECONDS"])
+        else:
+            raise ValueError("Unknown plan op: {}".format(op["OP"]))
 
 
 def add_proteinase_k(
@@ -323,6 +1202,7 @@ def add_proteinase_k(
     pipette: InstrumentContext = None,
     source_plate: Labware = None,
     destination_plate: Labware = [],
+    passes: Iterable[str] = (),
 ):
     """
     Adds Proteinase K to selected columns.
@@ -332,18 +1212,105 @@ def add_proteinase_k(
         pipette: Which Opentrons Pipette the operation will use.
         source_plate: The plate to aspirate from.
         destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
 
     """
+    plan = []
     for c in range(num_cols):
-        transfer(
+        plan += transfer(
             volume_ul=VOL_PK,
             pipette=pipette,
             source=source_plate,
             dest=destination_plate[c],
-            mix_before=(2, VOL_10),
-            mix_after=(3, VOL_10),
+            mix_before=SETTINGS["MIX_SMALL_VOL_BEFORE"],
+            mix_after=SETTINGS["MIX_SMALL_VOL_AFTER"],
             touch_tip=(TOUCH_RADIUS_SM_LG, TOUCH_HEIGHT_SM_LG),
         )
+    execute_plan(pipette, plan, passes)
+
+
+def distribute_small_volume(
+    num_cols: int = 0,
+    volume_ul: int = 0,
+    pipette: InstrumentContext = None,
+    source_plate: Labware = None,
+    destination_plate: Labware = [],
+    passes: Iterable[str] = (),
+):
+    """
+    Adds a small volume reagent (Proteinase K or MS2) to selected columns with
+    a single tip, dispensing from above the sample.
+
+    Args:
+        num_cols: Number of columns to operate on.
+        volume_ul: The volume to add to each well, in uL.
+        pipette: Which Opentrons Pipette the operation will use.
+        source_plate: The plate to aspirate from.
+        destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
+    """
+    plan = distribute(
+        volume_ul=volume_ul,
+        pipette=pipette,
+        source=source_plate,
+        dest=destination_plate[:num_cols],
+        disposal_ul=DISPOSAL_SM,
+        mix_before=SETTINGS["MIX_SMALL_VOL_BEFORE"],
+        dispense_height=SETTINGS["DEPTH_ABOVE_SAMPLE"],
+    )
+    execute_plan(pipette, plan, passes)
+
+
+def add_proteinase_k_ms2(
+    num_cols: int = 0,
+    pipette: InstrumentContext = None,
+    pk_source: Labware = None,
+    ms2_source: Labware = None,
+    destination_plate: Labware = [],
+    passes: Iterable[str] = (),
+):
+    """
+    Adds MS2 and Proteinase K to selected columns in a single pass with one
+    tip, ahead of the bead mix. The Proteinase K is mixed first with a tip of
+    its own, which is dropped, and the pass tip mixes the MS2. For every
+    column MS2 is drawn first and held behind an air gap of AIR_GAP_SM, so the
+    two reagents do not meet inside the tip. The outside of the tip still
+    carries traces of MS2 into the Proteinase K well on every draw; every
+    sample receives both reagents within the same pass, so the carry-over
+    only matters for Proteinase K left over after the run. Use the
+    "distribute" mode where the reagents must stay unmixed.
+
+    Args:
+        num_cols: Number of columns to operate on.
+        pipette: Which Opentrons Pipette the operation will use.
+        pk_source: The Proteinase K column to aspirate from.
+        ms2_source: The MS2 column to aspirate from.
+        destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
+    """
+    reps, vol = SETTINGS["MIX_SMALL_VOL_BEFORE"]
+    plan = [
+        {"OP": "pick_up_tip"},
+        {"OP": "mix", "REPS": reps, "VOL": vol, "LOC": pk_source[0]},
+        {"OP": "drop_tip"},
+        {"OP": "pick_up_tip"},
+        {"OP": "mix", "REPS": reps, "VOL": vol, "LOC": ms2_source[0]},
+    ]
+    for c in range(num_cols):
+        dest = destination_plate[c][0].bottom(z=SETTINGS["DEPTH_ABOVE_SAMPLE"])
+        plan += [
+            {"OP": "aspirate", "VOL": VOL_MS2, "LOC": ms2_source[0]},
+            {"OP": "air_gap", "VOL": AIR_GAP_SM},
+            {"OP": "aspirate", "VOL": VOL_PK, "LOC": pk_source[0]},
+            {
+                "OP": "dispense",
+                "VOL": VOL_MS2 + AIR_GAP_SM + VOL_PK,
+                "LOC": dest,
+            },
+            {"OP": "blow_out", "LOC": dest},
+        ]
+    plan.append({"OP": "drop_tip"})
+    execute_plan(pipette, plan, passes)
 
 
 def add_beads(
@@ -352,6 +1319,7 @@ def add_beads(
     source_plate: Labware = [],
     destination_plate: Labware = [],
     protocol: protocol_api.ProtocolContext = None,
+    passes: Iterable[str] = (),
 ):
     """
     Adds Magnetic Beads to selected columns.
@@ -359,34 +1327,26 @@ def add_beads(
     Args:
         num_cols: Number of columns to operate on.
         pipette: Which Opentrons Pipette the operation will use.
-        source_plate: The plate to aspirate from.
+        source_plate: The reagent map entries to aspirate from.
         destination_plate: The plate being dispensed to.
         protocol: The protocol context to operate on.
+        passes: Optimization passes applied to the plan of the stage.
     """
-    s = 0
-    reagent_vol = source_plate[s]["VOL"]
-    for c in range(num_cols):
-        vol_transfer = VOL_BEAD * pipette.channels
-        if reagent_low(
-            quantity_remaining=reagent_vol,
-            quantity_to_transfer=vol_transfer,
-        ):
-            s += 1
-            reagent_vol = source_plate[s]["VOL"]
-
-        transfer(
-            volume_ul=VOL_BEAD,
-            pipette=pipette,
-            source=source_plate[s]["WELL"],
-            dest=destination_plate[c],
-            mix_before=(5,),
-            mix_after=(2,),
-            touch_tip=(TOUCH_RADIUS_LG_LG, TOUCH_HEIGHT_LG_LG),
-            delay_time_s=5,
-            protocol=protocol,
-        )
-
-        reagent_vol -= vol_transfer
+    plan = []
+    for source in source_plate:
+        for c in source["COLS"]:
+            if c >= num_cols:
+                break
+            plan += transfer(
+                volume_ul=VOL_BEAD,
+                pipette=pipette,
+                source=source["WELL"],
+                dest=destination_plate[c],
+                mix_before=SETTINGS["MIX_BEADS_BEFORE"],
+                mix_after=SETTINGS["MIX_BEADS_AFTER"],
+                liquid="bead_mix",
+            )
+    execute_plan(pipette, plan, passes, protocol)
 
 
 def add_ms2(
@@ -394,6 +1354,7 @@ def add_ms2(
     pipette: InstrumentContext = None,
     source_plate: Labware = None,
     destination_plate: Labware = [],
+    passes: Iterable[str] = (),
 ):
     """
     Adds MS2 to selected columns.
@@ -403,17 +1364,20 @@ def add_ms2(
         pipette: Which Opentrons Pipette the operation will use.
         source_plate: The plate to aspirate from.
         destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
     """
+    plan = []
     for c in range(num_cols):
-        transfer(
-            volume_ul=VOL_PK,
+        plan += transfer(
+            volume_ul=VOL_MS2,
             pipette=pipette,
             source=source_plate,
             dest=destination_plate[c],
-            mix_before=(2, VOL_10),
-            mix_after=(3, VOL_10),
+            mix_before=SETTINGS["MIX_SMALL_VOL_BEFORE"],
+            mix_after=SETTINGS["MIX_SMALL_VOL_AFTER"],
             touch_tip=(TOUCH_RADIUS_SM_LG, TOUCH_HEIGHT_SM_LG),
         )
+    execute_plan(pipette, plan, passes)
 
 
 def discard_supernatant(
@@ -421,6 +1385,8 @@ def discard_supernatant(
     pipette: InstrumentContext = None,
     source_plate: Labware = [],
     destination_plate: Labware = [],
+    passes: Iterable[str] = (),
+    park_rack: Labware = None,
 ):
     """
     Discared Supernatant.
@@ -430,18 +1396,27 @@ def discard_supernatant(
         pipette: Which Opentrons Pipette the operation will use.
         source_plate: The plate to aspirate from.
         destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
+        park_rack: Tip rack holding a tip per column between the discard
+            rounds; a new tip per column is used if not given.
     """
-    pipette.well_bottom_clearance.aspirate = DEPTH_BOTTOM_LOW
-    pipette.flow_rate.aspirate = ASPIRATE_SPEED
-    pipette.flow_rate.dispense = DISPENSE_SPEED
+    pipette.well_bottom_clearance.aspirate = SETTINGS["DEPTH_BOTTOM_LOW"]
+    plan = []
     for c in range(num_cols):
-        transfer(
+        steps = transfer(
             volume_ul=VOL_WASTE,
             dispense_all=False,
             pipette=pipette,
             source=source_plate[c],
             dest=destination_plate[0],
+            liquid="over_beads",
         )
+        if park_rack is not None:
+            # the tip only ever touches the supernatant of this column
+            steps[0] = {"OP": "pick_up_tip", "LOC": park_rack.columns()[c][0]}
+            steps[-1] = {"OP": "return_tip"}
+        plan += steps
+    execute_plan(pipette, plan, passes)
     reset_pipette_depth(pipette)
 
 
@@ -449,6 +1424,13 @@ def wash_beads(
     protocol: protocol_api.ProtocolContext,
     source_plate: Labware = None,
     volume_ul: int = 0,
+    num_cols: int = 0,
+    wash_mode: str = WASH_MODE,
+    deferred: List[dict] = None,
+    passes: Iterable[str] = (),
+    refills: List[list] = None,
+    liquid: str = "wash_buffer",
+    park_rack: Labware = None,
 ):
     """
     Perform a Bead Wash.
@@ -457,13 +1439,19 @@ def wash_beads(
         protocol: The protocol context to operate on.
         source_plate: The plate to perform the wash on.
         volume_ul: What volume of liquid to use for the wash, in uL.
+        num_cols: Number of columns to operate on.
+        wash_mode: How the wash is added; "transfer" or "distribute".
+        deferred: Steps that may run while the beads settle.
+        passes: Optimization passes applied to the plan of the stage.
+        refills: Tip racks to replace at the pauses left in the run.
+        liquid: The LIQUID_CLASSES entry of the wash solution.
+        park_rack: Tip rack holding the supernatant tip of each column.
 
     """
     mag_deck = protocol.loaded_modules[MAG_DECK["SLOT"]]
     p300 = protocol.loaded_instruments[P300_MULTI["POSITION"]]
     reaction_plate = protocol.loaded_labwares[MAG_DECK["SLOT"]]
     waste_reservior = protocol.loaded_labwares[WASTE_RESERVOIR["SLOT"]]
-    num_cols = len(reaction_plate.columns())
 
     # 2. Remove the plate from the magnetic stand
     mag_deck.disengage()
@@ -474,15 +1462,18 @@ def wash_beads(
         source_plate=source_plate,
         destination_plate=reaction_plate.columns(),
         volume_ul=volume_ul,
+        wash_mode=wash_mode,
+        passes=passes,
+        liquid=liquid,
     )
 
     # 3. Reseal the plate, then shake at 1,050 rpm for 1 minute.
     # Step 3 happen outside of OT-2.
-    protocol.pause()
+    operator_pause(protocol, refills)
 
     # 4. Place the plate back on the magnetic stand for 2 minutes, or until all the beads have collected.
-    mag_deck.engage(height=MAGDECK_ENGAGE_HEIGHT)
-    protocol.delay(minutes=2)
+    mag_deck.engage(height=SETTINGS["MAGDECK_ENGAGE_HEIGHT"])
+    fill_delay(protocol, deferred, minutes=2, busy={REACTION_PLATE["LABEL"]})
 
     # 5. Keeping the plate on the magnet, discard the supernatant from each well.
     # IMPORTANT! Avoid disturbing the beads.
@@ -491,6 +1482,8 @@ def wash_beads(
         pipette=p300,
         source_plate=reaction_plate.columns(),
         destination_plate=waste_reservior.columns(),
+        passes=passes,
+        park_rack=park_rack,
     )
 
 
@@ -500,6 +1493,9 @@ def wash(
     source_plate: Labware = None,
     destination_plate: Labware = None,
     volume_ul: int = 0,
+    wash_mode: str = WASH_MODE,
+    passes: Iterable[str] = (),
+    liquid: str = "wash_buffer",
 ):
     """
     Performs a Wash, aspirating from the selected source plate to the
@@ -508,31 +1504,38 @@ def wash(
     Args:
         num_cols: Number of columns to operate on.
         pipette: Which Opentrons Pipette the operation will use.
-        source_plate: The plate to aspirate from.
+        source_plate: The reagent map entries to aspirate from.
         destination_plate: The plate being dispensed to.
         volume_ul: What volume of liquid to use for the wash, in uL.
+        wash_mode: How the wash is added; "transfer" or "distribute".
+        passes: Optimization passes applied to the plan of the stage.
+        liquid: The LIQUID_CLASSES entry of the wash solution.
     """
-    s = 0
-    reagent_vol = source_plate[s]["VOL"]
-    for c in range(num_cols):
-        vol_transfer = volume_ul * pipette.channels
-        if reagent_low(
-            quantity_remaining=reagent_vol,
-            quantity_to_transfer=vol_transfer,
-        ):
-            s += 1
-            reagent_vol = source_plate[s]["VOL"]
-
-        transfer(
-            volume_ul=volume_ul,
-            pipette=pipette,
-            source=source_plate[s]["WELL"],
-            dest=destination_plate[c],
-            mix_before=(3,),
-            mix_after=(5,),
-            touch_tip=(TOUCH_RADIUS_LG_LG, TOUCH_HEIGHT_LG_LG),
-        )
-        reagent_vol -= vol_transfer
+    plan = []
+    for source in source_plate:
+        dest = [destination_plate[c] for c in source["COLS"] if c < num_cols]
+        if wash_mode == "distribute":
+            # one tip per reagent source column, never touching the samples
+            if dest:
+                plan += distribute(
+                    volume_ul=volume_ul,
+                    pipette=pipette,
+                    source=source["WELL"],
+                    dest=dest,
+                    liquid=liquid,
+                )
+            continue
+        for d in dest:
+            plan += transfer(
+                volume_ul=volume_ul,
+                pipette=pipette,
+                source=source["WELL"],
+                dest=d,
+                mix_before=SETTINGS["MIX_WASH_BEFORE"],
+                mix_after=SETTINGS["MIX_WASH_AFTER"],
+                liquid=liquid,
+            )
+    execute_plan(pipette, plan, passes)
 
 
 def elute(
@@ -540,6 +1543,8 @@ def elute(
     pipette: InstrumentContext = None,
     source_plate: Labware = None,
     destination_plate: Labware = [],
+    staged_plate: List[dict] = None,
+    passes: Iterable[str] = (),
 ):
     """
     Performs an Elution on the passed in destination plate aspirating from the
@@ -550,26 +1555,267 @@ def elute(
         pipette: Which Opentrons Pipette the operation will use.
         source_plate: The plate to aspirate from.
         destination_plate: The plate being dispensed to.
+        staged_plate: Staging wells from stage_elution(); used instead of the
+            source plate when given.
+        passes: Optimization passes applied to the plan of the stage.
     """
-    pipette.well_bottom_clearance.aspirate = DEPTH_BOTTOM_LOW
+    pipette.well_bottom_clearance.aspirate = SETTINGS["DEPTH_BOTTOM_LOW"]
+    plan = []
     for c in range(num_cols):
-        transfer(
+        if staged_plate:
+            source = staged_plate[c // STAGED_COLS_PER_WELL]["WELL"]
+            mix_before = None
+        else:
+            source = source_plate["WELL"]
+            mix_before = SETTINGS["MIX_ELUTION_BEFORE"]
+        plan += transfer(
             volume_ul=VOL_ELUTE,
             pipette=pipette,
-            source=source_plate["WELL"],
+            source=source,
             dest=destination_plate[c],
-            mix_before=(3, 175),
-            mix_after=(5, 35),
-            touch_tip=(TOUCH_RADIUS_LG_LG, TOUCH_HEIGHT_LG_LG),
+            mix_before=mix_before,
+            mix_after=SETTINGS["MIX_ELUTION_AFTER"],
+            liquid="elution",
         )
+    execute_plan(pipette, plan, passes)
     reset_pipette_depth(pipette)
 
 
+def stage_elution(
+    num_cols: int = 0,
+    pipette: InstrumentContext = None,
+    source_plate: dict = None,
+    staging_plate: Labware = [],
+    passes: Iterable[str] = (),
+) -> List[dict]:
+    """
+    Aliquots Elution Solution from the reservoir into staging wells of the
+    reagent plate, so that elute() does not need to go back to the reservoir.
+
+    Args:
+        num_cols: Number of sample columns to stage elution for.
+        pipette: Which Opentrons Pipette the operation will use.
+        source_plate: The reagent map entry to aspirate from.
+        staging_plate: The reagent plate columns used for staging.
+        passes: Optimization passes applied to the plan of the stage.
+
+    Returns:
+        Reagent map entries for the staging wells, one per
+        STAGED_COLS_PER_WELL sample columns.
+    """
+    num_wells = math.ceil(num_cols / STAGED_COLS_PER_WELL)
+    vol_well = VOL_ELUTE * STAGED_COLS_PER_WELL + VOL_STAGING_OVERAGE
+    staging = staging_plate[
+        ELUTION_STAGING_COL : ELUTION_STAGING_COL + num_wells
+    ]
+    plan = distribute(
+        volume_ul=vol_well,
+        pipette=pipette,
+        source=source_plate["WELL"],
+        dest=staging,
+        liquid="elution",
+    )
+    execute_plan(pipette, plan, passes)
+    return [{"VOL": vol_well, "WELL": well} for well in staging]
+
+
+def deferred_step(
+    name: str,
+    func: Callable,
+    uses: Iterable[str] = (),
+    seconds: float = 0,
+    before: str = None,
+) -> dict:
+    """
+    Declares a step that can run whenever its labware is free.
+
+    Args:
+        name: Name of the step, for the run log.
+        func: Performs the step when called without arguments.
+        uses: Labels of the labware and pipette mounts the step touches.
+        seconds: Estimated duration of the step.
+        before: Name of the stage that depends on the step.
+    """
+    return {
+        "NAME": name,
+        "FUNC": func,
+        "USES": set(uses),
+        "SECONDS": seconds,
+        "BEFORE": before,
+    }
+
+
+def fill_delay(
+    protocol: protocol_api.ProtocolContext,
+    deferred: List[dict] = None,
+    minutes: float = 0,
+    busy: Iterable[str] = (),
+):
+    """
+    Waits for the given time, running deferred steps that fit in the window
+    and do not touch any busy labware.
+
+    Args:
+        protocol: The protocol context to operate on.
+        deferred: Steps waiting to run; completed steps are removed.
+        minutes: The length of the wait.
+        busy: Labels of the labware that must not be touched.
+    """
+    window_s = minutes * 60
+    start = time.monotonic()
+    planned_s = 0
+    for step in list(deferred or []):
+        if step["USES"] & set(busy):
+            continue
+        if planned_s + step["SECONDS"] > window_s:
+            continue
+        protocol.comment("Running {} during the delay".format(step["NAME"]))
+        step["FUNC"]()
+        deferred.remove(step)
+        planned_s += step["SECONDS"]
+
+    # simulated commands take no time, so rely on the estimates instead
+    if protocol.is_simulating():
+        elapsed_s = planned_s
+    else:
+        elapsed_s = time.monotonic() - start
+    if elapsed_s < window_s:
+        protocol.delay(seconds=window_s - elapsed_s)
+
+
+def run_deferred(deferred: List[dict] = None, before: str = None):
+    """
+    Runs the deferred steps a stage depends on that have not run yet.
+
+    Args:
+        deferred: Steps waiting to run; completed steps are removed.
+        before: The stage about to start.
+    """
+    for step in list(deferred or []):
+        if step["BEFORE"] == before:
+            step["FUNC"]()
+            deferred.remove(step)
+
+
+def tip_demand(
+    num_cols: int = 0,
+    reagent_map: dict = None,
+    small_vol_mode: str = SMALL_VOL_MODE,
+    wash_mode: str = WASH_MODE,
+    fill_delays: bool = FILL_DELAYS,
+    qpcr_setup: bool = QPCR_SETUP,
+    capacity: dict = None,
+    park_tips: bool = PARK_TIPS,
+) -> List[dict]:
+    """
+    Tip columns each pipette picks up between the operator pauses of the run.
+
+    Args:
+        num_cols: Number of columns to operate on.
+        reagent_map: The reagent map from make_reagent_map().
+        small_vol_mode: How Proteinase K and MS2 are added.
+        wash_mode: How Wash Buffer and Ethanol are added.
+        fill_delays: Whether the Elution Solution is staged with the p20.
+        qpcr_setup: Whether the qPCR plate is set up in the same run.
+        capacity: Tip columns in the racks of each pipette, by mount.
+        park_tips: Whether the supernatant tips come from the parking rack.
+
+    Returns:
+        The tip columns by mount, before the first pause, between each pair
+        of pauses and after the last one.
+    """
+    p20, p300 = P20_MULTI["POSITION"], P300_MULTI["POSITION"]
+    small_vol_tips = {"transfer": 2 * num_cols, "distribute": 2, "combined": 2}
+    p20_tips = small_vol_tips[small_vol_mode]
+    # the staging tip is only picked up if the p20 has any left
+    staging_tips = 1 if fill_delays and p20_tips < capacity[p20] else 0
+
+    def wash_tips(reagent):
+        if wash_mode == "distribute":
+            return len(reagent_map[reagent])
+        return num_cols
+
+    discard_tips = 0 if park_tips else num_cols
+    return [
+        # lysis and bead binding, until the plate is shaken
+        {p20: p20_tips, p300: num_cols},
+        {p20: staging_tips, p300: discard_tips + wash_tips(WASH_BUFFER)},
+        {p300: discard_tips + wash_tips(ETHANOL1)},
+        {p300: discard_tips + wash_tips(ETHANOL2)},
+        {p300: discard_tips},
+        # elution, until the eluate is shaken off the beads
+        {p300: num_cols},
+        {p20: 2 * num_cols if qpcr_setup else 0, p300: num_cols},
+    ]
+
+
+def plan_tip_refills(
+    demand: List[dict] = None, capacity: dict = None
+) -> List[List[str]]:
+    """
+    Picks the operator pauses at which the tip racks of each pipette are
+    replaced, as late as possible so that they are replaced the fewest times.
+
+    Args:
+        demand: Tip columns by mount between the pauses, from tip_demand().
+        capacity: Tip columns in the racks of each pipette, by mount.
+
+    Returns:
+        For every pause of the run, the mounts whose tip racks are replaced.
+
+    Raises:
+        ValueError: A pipette needs more tips between two pauses than its
+            racks hold.
+    """
+    refills = [[] for _ in demand[1:]]
+    for mount, total in capacity.items():
+        left = total
+        for i, tips in enumerate(demand):
+            needed = tips.get(mount, 0)
+            if needed > total:
+                raise ValueError(
+                    "The {} pipette needs {} tip columns between two pauses, "
+                    "its racks hold {}".format(mount, needed, total)
+                )
+            if needed > left:
+                refills[i - 1].append(mount)
+                left = total
+            left -= needed
+    return refills
+
+
+def operator_pause(
+    protocol: protocol_api.ProtocolContext,
+    refills: List[list] = None,
+    msg: str = None,
+):
+    """
+    Pauses for the operator, who also replaces the tip racks planned for this
+    pause.
+
+    Args:
+        protocol: The protocol context to operate on.
+        refills: Tip racks to replace at each pause left in the run; the entry
+            for this pause is removed.
+        msg: What the operator needs to do.
+    """
+    racks = refills.pop(0) if refills else []
+    if racks:
+        note = "replace the tip racks in slot {}".format(
+            ", ".join(str(rack.parent) for rack in racks)
+        )
+        msg = "{}, then {}".format(msg, note) if msg else note.capitalize()
+    protocol.pause(msg)
+    for rack in racks:
+        rack.reset()
+
+
 def make_qPCR_plate(
     num_cols: int = 0,
     pipette: InstrumentContext = None,
     source_plate: Labware = [],
     destination_plate: Labware = [],
+    passes: Iterable[str] = (),
 ):
     """
     Makes a qPCR (quantitative polymerase chain reaction) plate.
@@ -579,20 +1825,445 @@ def make_qPCR_plate(
         pipette: Which Opentrons Pipette the operation will use.
         source_plate: The plate to aspirate from.
         destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
 
     """
-    pipette.well_bottom_clearance.aspirate = DEPTH_BOTTOM_LOW
+    pipette.well_bottom_clearance.aspirate = SETTINGS["DEPTH_BOTTOM_LOW"]
+    plan = []
     for c in range(num_cols):
-        transfer(
+        plan += transfer(
             volume_ul=VOL_ELUTE,
             pipette=pipette,
             source=source_plate[c],
             dest=destination_plate[c],
             touch_tip=(TOUCH_RADIUS_LG_SM, TOUCH_HEIGHT_LG_SM),
+            liquid="over_beads",
         )
+    execute_plan(pipette, plan, passes)
     reset_pipette_depth(pipette)
 
 
+def aliquot_eluent(
+    num_cols: int = 1,
+    pipette: InstrumentContext = None,
+    source_plate: Labware = None,
+    destination_plate: Labware = [],
+    passes: Iterable[str] = (),
+):
+    """
+    Aliquot 10 µL of the purified RNA extract to an empty Bio-Rad 96 well plate
+    at the beginning of the qPCR assay preparation.
+
+    Args:
+        num_cols: Number of columns to operate on.
+        pipette: Which Opentrons Pipette the operation will use.
+        source_plate: The plate to aspirate from.
+        destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
+    """
+    plan = []
+    for c in range(num_cols):
+        plan += transfer(
+            volume_ul=VOL_RNA,
+            pipette=pipette,
+            source=source_plate[c],
+            dest=destination_plate[c],
+            liquid="rna_eluate",
+        )
+    execute_plan(pipette, plan, passes)
+
+
+def add_master_mix(
+    num_cols: int = 1,
+    pipette: InstrumentContext = None,
+    source_plate: Labware = None,
+    destination_plate: Labware = [],
+    passes: Iterable[str] = (),
+):
+    """
+    Transfer 15ul of reagent mix (reagent plate) to the aliquoted reaction
+    plate (aliquot_eluent)
+
+    Args:
+        num_cols: Number of columns to operate on.
+        pipette: Which Opentrons Pipette the operation will use.
+        source_plate: The plate to aspirate from.
+        destination_plate: The plate being dispensed to.
+        passes: Optimization passes applied to the plan of the stage.
+    """
+    plan = []
+    for c in range(num_cols):
+        plan += transfer(
+            volume_ul=VOL_MASTER_MIX,
+            pipette=pipette,
+            source=source_plate,
+            dest=destination_plate[c],
+            mix_before=SETTINGS["MIX_MASTER_MIX"],
+            mix_after=SETTINGS["MIX_MASTER_MIX"],
+            liquid="master_mix",
+        )
+    execute_plan(pipette, plan, passes)
+
+
+def liquid_height(well, volume_ul: float = 0) -> float:
+    """
+    Height of the liquid in a well, taking the cross-section at the top of the
+    well; tapered wells fill higher, so the estimate keeps the tip submerged.
+
+    Args:
+        well: The well holding the liquid.
+        volume_ul: The volume in the well.
+
+    Returns:
+        The height above the bottom of the well in mm.
+    """
+    if well.diameter:
+        area = math.pi * (well.diameter / 2) ** 2
+    elif well.length and well.width:
+        area = well.length * well.width
+    else:
+        area = well.max_volume / well.depth
+    return volume_ul / area
+
+
+def make_liquid_levels(
+    reagent_map: dict = None,
+    reaction_plate: Labware = [],
+    num_cols: int = 0,
+) -> dict:
+    """
+    Starting volumes of the wells followed by track_liquid().
+
+    Args:
+        reagent_map: The reagent map; the TRACKED_REAGENTS are followed.
+        reaction_plate: The reaction plate columns, holding the samples.
+        num_cols: Number of columns to operate on.
+
+    Returns:
+        The volume in uL by well. Wells not listed are taken to be empty.
+    """
+    levels = {}
+    for reagent in TRACKED_REAGENTS:
+        for entry in reagent_map[reagent]:
+            for well in entry["WELL"]:
+                levels[well] = entry["VOL"] / len(entry["WELL"])
+    for column in reaction_plate[:num_cols]:
+        for well in column:
+            levels[well] = VOL_SAMPLE
+    return levels
+
+
+def track_liquid(levels: dict = None, channels: int = 8) -> Callable:
+    """
+    Makes a plan pass that follows the liquid in the wells: aspirations from a
+    followed well move up to MENISCUS_DEPTH below the surface left once the
+    aspiration is done, and every aspiration and dispense updates the volumes.
+
+    Args:
+        levels: The volume in uL by well, from make_liquid_levels(); updated
+            as plans run.
+        channels: Number of channels on the pipettes; all of them reach into
+            a reservoir well at once.
+
+    Returns:
+        The plan pass.
+    """
+
+    def track(plan: List[dict], max_vol: float) -> List[dict]:
+        result = []
+        for op in plan:
+            well = plan_well(op.get("LOC"))
+            if well is None or op["OP"] not in ("aspirate", "dispense"):
+                result.append(op)
+                continue
+            shared = len(well.parent.rows()) == 1
+            volume = op["VOL"] * (channels if shared else 1)
+            if op["OP"] == "dispense":
+                levels[well] = levels.get(well, 0) + volume
+            elif well in levels:
+                levels[well] = max(0, levels[well] - volume)
+                z = liquid_height(well, levels[well]) - MENISCUS_DEPTH
+                if z > SETTINGS["DEPTH_BOTTOM_MID"]:
+                    op = dict(op, LOC=well.bottom(z=z))
+            result.append(op)
+        return result
+
+    return track
+
+
+def trace_stage(frame) -> str:
+    """
+    Names the protocol stage being run: the outermost function below run()
+    that a call is nested in.
+
+    Args:
+        frame: The stack frame the call was made from.
+
+    Returns:
+        The stage name, or "run" for calls made by run() itself.
+    """
+    stage = "run"
+    while frame is not None:
+        if frame.f_globals is globals():
+            if frame.f_code.co_name == "run":
+                break
+            stage = frame.f_code.co_name
+        frame = frame.f_back
+    return stage
+
+
+def trace_location(location) -> dict:
+    """
+    Describes where a traced call happened.
+
+    Args:
+        location: The Well or Location passed to the call.
+
+    Returns:
+        The labware label and the plate column index, when known.
+    """
+    if location is None:
+        return {}
+    if hasattr(location, "labware"):
+        labware, well = location.labware.get_parent_labware_and_well()
+    else:
+        labware, well = location.parent, location
+    fields = {"labware": labware.name if labware is not None else None}
+    if well is not None:
+        fields["column"] = int(well.well_name[1:]) - 1
+    return fields
+
+
+def trace_calls(
+    obj,
+    names: Iterable[str] = (),
+    path: str = TRACE_PATH,
+    state: dict = None,
+    **fields
+):
+    """
+    Replaces methods of a pipette, module or protocol context with ones that
+    append a JSONL line to the trace file for every call: stage, command,
+    plate column, volume, start time and duration.
+
+    Args:
+        obj: The context whose calls are traced.
+        names: The methods to trace, where the context has them.
+        path: The trace file on the robot.
+        state: Shared by every traced context; tracks the last location of
+            each context and skips calls made from within a traced call.
+        **fields: Written with every call, e.g. the pipette mount.
+    """
+
+    def traced(name, func):
+        def wrapper(*args, **kwargs):
+            if state["DEPTH"]:
+                return func(*args, **kwargs)
+            # these happen where the pipette already is when not given one
+            location = kwargs.get("location")
+            if location is None and name in TRACE_IN_PLACE_CALLS:
+                location = state["HERE"].get(id(obj))
+            else:
+                state["HERE"][id(obj)] = location
+
+            start = time.time()
+            state["DEPTH"] += 1
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                state["DEPTH"] -= 1
+            entry = dict(
+                fields,
+                stage=trace_stage(inspect.currentframe().f_back),
+                command=name,
+                volume=kwargs.get("volume"),
+                start=start,
+                duration_s=round(time.time() - start, 3),
+            )
+            entry.update(trace_location(location))
+            with open(path, "a") as trace_file:
+                trace_file.write(json.dumps(entry) + "\n")
+            return result
+
+        return wrapper
+
+    for name in names:
+        if hasattr(obj, name):
+            setattr(obj, name, traced(name, getattr(obj, name)))
+
+
+def protocol_revision() -> str:
+    """
+    Names the revision of the protocol: a digest of the code of its functions
+    and of its constants, so runs of the same file share it.
+
+    Returns:
+        The first 12 hex digits of the digest.
+    """
+    digest = hashlib.sha1()
+
+    def add_code(code):
+        digest.update(code.co_code)
+        digest.update(repr(code.co_names).encode())
+        for const in code.co_consts:
+            if inspect.iscode(const):
+                add_code(const)
+            elif isinstance(const, frozenset):
+                # set literals; their order changes between interpreters
+                digest.update(repr(sorted(const, key=repr)).encode())
+            else:
+                digest.update(repr(const).encode())
+
+    for name, value in sorted(globals().items()):
+        if inspect.isfunction(value):
+            add_code(value.__code__)
+        elif name.isupper():
+            # functions, e.g. the optimization passes, by name
+            text = json.dumps(
+                value, default=lambda obj: getattr(obj, "__name__", None)
+            )
+            digest.update(text.encode())
+    return digest.hexdigest()[:12]
+
+
+def trace_run(path: str = TRACE_PATH, **params):
+    """
+    Starts a run in the trace file with a line naming the protocol and its
+    revision; the calls traced after it belong to the run.
+
+    Args:
+        path: The trace file on the robot.
+        **params: The run() arguments, written with the line.
+    """
+    entry = {
+        "command": "run",
+        "protocol": metadata["protocolName"],
+        "revision": protocol_revision(),
+        "start": time.time(),
+        "params": params,
+    }
+    with open(path, "a") as trace_file:
+        trace_file.write(json.dumps(entry) + "\n")
+
+
+def take_next_tip(pipette: InstrumentContext, location=None):
+    """
+    Marks the tips the pipette would pick up next as used, without moving.
+
+    Args:
+        pipette: Which Opentrons Pipette the operation will use.
+        location: The tip well the pick up was given, if any.
+    """
+    if location is not None:
+        location.parent.use_tips(location, pipette.channels)
+        return
+    for rack in pipette.tip_racks:
+        well = rack.next_tip(pipette.channels)
+        if well is not None:
+            rack.use_tips(well, pipette.channels)
+            return
+
+
+def journal_calls(
+    obj,
+    names: Iterable[str] = (),
+    path: str = JOURNAL_PATH,
+    state: dict = None,
+    **fields
+):
+    """
+    Replaces methods of a pipette or protocol context with ones that replay
+    the run without moving until state["RESUME"] dispenses are done, and
+    append a JSONL line to the journal file for every dispense after that.
+
+    A run interrupted with a tip on the pipette is resumed with a fresh tip
+    if the interrupted one still had liquid to move: it first draws what that
+    tip held for its remaining dispenses from the same source, and the
+    dispenses already done are not repeated. Otherwise the mixes, touch tips
+    and blow outs the tip had left are skipped, along with its drop.
+
+    Args:
+        obj: The context whose calls are journaled.
+        names: The methods to journal, where the context has them.
+        path: The journal file on the robot; nothing is written if not given.
+        state: Shared by every journaled context; counts the dispenses done,
+            tracks the tip, volume held and last aspirate and dispense of
+            each context and skips calls made from within a journaled call.
+        **fields: Written with every line, e.g. the pipette mount.
+    """
+
+    def replay(here, name, kwargs):
+        if name == "pick_up_tip":
+            take_next_tip(obj, kwargs.get("location"))
+            here["TIP"], here["HELD"] = True, 0
+        elif name in ("drop_tip", "return_tip"):
+            here["TIP"] = False
+        elif name == "aspirate":
+            here["HELD"] += kwargs["volume"]
+        elif name == "dispense":
+            # air gaps are dispensed with the liquid, so this can go below 0
+            here["HELD"] = max(0, here["HELD"] - kwargs["volume"])
+        elif name == "blow_out":
+            here["HELD"] = 0
+
+    def journaled(name, func):
+        def wrapper(*args, **kwargs):
+            if state["DEPTH"]:
+                return func(*args, **kwargs)
+            if name == "pick_up_tip" and args:
+                kwargs["location"] = args[0]
+                args = ()
+            here = state["HERE"].setdefault(id(obj), {"TIP": False})
+            if state["DONE"] < state["RESUME"]:
+                replay(here, name, kwargs)
+                if name in ("aspirate", "dispense"):
+                    here[name] = kwargs
+                if name == "dispense":
+                    state["DONE"] += 1
+                return None
+
+            if here["TIP"]:
+                # the tip the run was interrupted with is off the pipette
+                if name not in ("aspirate", "dispense", "air_gap"):
+                    here["TIP"] = name not in ("drop_tip", "return_tip")
+                    return None
+                here["TIP"] = False
+                obj.pick_up_tip()
+                if here["HELD"]:
+                    obj.aspirate(**dict(here["aspirate"], volume=here["HELD"]))
+
+            if name in ("aspirate", "dispense"):
+                here[name] = kwargs
+            state["DEPTH"] += 1
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                state["DEPTH"] -= 1
+            if name != "dispense":
+                return result
+
+            state["DONE"] += 1
+            if not path:
+                return result
+            entry = dict(
+                fields,
+                done=state["DONE"],
+                stage=trace_stage(inspect.currentframe().f_back),
+                time=time.time(),
+            )
+            for call, key in (("aspirate", "source"), ("dispense", "dest")):
+                entry[key] = trace_location(here.get(call, {}).get("location"))
+            with open(path, "a") as journal_file:
+                journal_file.write(json.dumps(entry) + "\n")
+            return result
+
+        return wrapper
+
+    for name in names:
+        if hasattr(obj, name):
+            setattr(obj, name, journaled(name, getattr(obj, name)))
+
+
 def reset_pipette_depth(pipette: InstrumentContext):
     """
     Resets the selected Pipette's Depth
@@ -600,28 +2271,77 @@ def reset_pipette_depth(pipette: InstrumentContext):
     Args:
         pipette: Which Opentrons Pipette the operation will use.
     """
-    pipette.well_bottom_clearance.aspirate = DEPTH_BOTTOM_MID
-    pipette.well_bottom_clearance.dispense = DEPTH_BOTTOM_MID
+    pipette.well_bottom_clearance.aspirate = SETTINGS["DEPTH_BOTTOM_MID"]
+    pipette.well_bottom_clearance.dispense = SETTINGS["DEPTH_BOTTOM_MID"]
 
 
-def reset_pipette_speed(pipette: InstrumentContext):
+def sample_columns(num_samples: int, channels: int, max_cols: int) -> int:
     """
-    Resets the selected Pipette's Speed
+    Converts a sample count into the number of occupied plate columns.
 
     Args:
-        pipette: Which Opentrons Pipette the operation will use.
+        num_samples: Number of samples loaded, filled column-wise from A1.
+        channels: Number of channels on the pipette addressing the plate.
+        max_cols: Number of columns available on the plate.
+
+    Returns:
+        The number of columns that contain samples.
     """
-    pipette.flow_rate.aspirate = DEFAULT_ASPIRATE_SPEED
-    pipette.flow_rate.dispense = DEFAULT_DISPENSE_SPEED
+    num_cols = math.ceil(num_samples / channels)
+    if not 0 < num_cols <= max_cols:
+        raise ValueError(
+            "num_samples must be between 1 and {}, got {}".format(
+                channels * max_cols, num_samples
+            )
+        )
+    return num_cols
 
 
-def run(protocol: protocol_api.ProtocolContext):
+def run(
+    protocol: protocol_api.ProtocolContext,
+    num_samples: int = NUM_SAMPLES,
+    small_vol_mode: str = SMALL_VOL_MODE,
+    wash_mode: str = WASH_MODE,
+    fill_delays: bool = FILL_DELAYS,
+    qpcr_setup: bool = QPCR_SETUP,
+    plan_passes: Iterable[str] = PLAN_PASSES,
+    nearest_tip_stages: Iterable[str] = NEAREST_TIP_STAGES,
+    trace: bool = TRACE,
+    trace_path: str = TRACE_PATH,
+    track_liquid_levels: bool = TRACK_LIQUID,
+    park_tips: bool = PARK_TIPS,
+    journal: bool = JOURNAL,
+    journal_path: str = JOURNAL_PATH,
+    resume: int = RESUME,
+):
     """
     Run the RNA Extraction.
 
     Args:
         protocol: The Opentrons Protocol Context controlling the execution of
             the protocol.
+        num_samples: Number of samples in the reaction plate; only the
+            occupied columns are processed.
+        small_vol_mode: How Proteinase K and MS2 are added; "transfer",
+            "distribute" or "combined".
+        wash_mode: How Wash Buffer and Ethanol are added; "transfer" or
+            "distribute".
+        fill_delays: Run independent steps while the beads settle instead of
+            waiting idle.
+        qpcr_setup: Set up the qPCR plate from the eluate in the same run.
+        plan_passes: Names of the OPTIMIZATION_PASSES applied to the plan of
+            every stage.
+        nearest_tip_stages: Names of the stages that pick up the tip nearest
+            their way instead of the next one in the rack.
+        trace: Append the timing of every call to trace_path.
+        trace_path: The JSONL trace file on the robot.
+        track_liquid_levels: Aspirate just below the liquid surface of the
+            reagents and samples instead of at the bottom of the well.
+        park_tips: Reuse one tip per column for every supernatant discard.
+        journal: Append a line to journal_path for every dispense.
+        journal_path: The JSONL journal file on the robot.
+        resume: Number of dispenses done before the run was interrupted; the
+            run up to that point is replayed without moving.
 
     """
     temp_deck = protocol.load_module(
@@ -638,11 +2358,20 @@ def run(protocol: protocol_api.ProtocolContext):
         REACTION_PLATE["NAME"], label=REACTION_PLATE["LABEL"]
     )
 
-    reagent_plate = protocol.load_labware(
-        REAGENT_PLATE["NAME"],
-        location=REAGENT_PLATE["SLOT"],
-        label=REAGENT_PLATE["LABEL"],
-    )
+    if qpcr_setup:
+        # The reagent plate holds the master mix as well, so keep it cold
+        qpcr_temp_deck = protocol.load_module(
+            QPCR_TEMP_DECK["NAME"], location=QPCR_TEMP_DECK["SLOT"]
+        )
+        reagent_plate = qpcr_temp_deck.load_labware(
+            REAGENT_PLATE["NAME"], label=REAGENT_PLATE["LABEL"]
+        )
+    else:
+        reagent_plate = protocol.load_labware(
+            REAGENT_PLATE["NAME"],
+            location=REAGENT_PLATE["SLOT"],
+            label=REAGENT_PLATE["LABEL"],
+        )
 
     reagent_reservior = protocol.load_labware(
         REAGENT_RESERVOIR["NAME"],
@@ -659,7 +2388,7 @@ def run(protocol: protocol_api.ProtocolContext):
     # Load in 2 of 20ul filter tiprack
     tip_20 = [
         protocol.load_labware(i["NAME"], location=i["SLOT"], label=i["LABEL"])
-        for i in FILTER_TIP_20
+        for i in (QPCR_FILTER_TIP_20 if qpcr_setup else FILTER_TIP_20)
     ]
     p20 = protocol.load_instrument(
         P20_MULTI["NAME"], P20_MULTI["POSITION"], tip_racks=tip_20
@@ -676,20 +2405,167 @@ def run(protocol: protocol_api.ProtocolContext):
     )
     reset_pipette_depth(p300)
 
-    reagent_map = make_reagent_map(reagent_plate, reagent_reservior)
-    num_cols = len(reaction_plate.columns())
+    if trace and not protocol.is_simulating():
+        trace_run(
+            trace_path,
+            num_samples=num_samples,
+            small_vol_mode=small_vol_mode,
+            wash_mode=wash_mode,
+            fill_delays=fill_delays,
+            qpcr_setup=qpcr_setup,
+            plan_passes=list(plan_passes),
+            nearest_tip_stages=list(nearest_tip_stages),
+            track_liquid_levels=track_liquid_levels,
+            park_tips=park_tips,
+        )
+        state = {"DEPTH": 0, "HERE": {}}
+        for pipette in (p20, p300):
+            trace_calls(
+                pipette,
+                TRACE_INSTRUMENT_CALLS,
+                trace_path,
+                state,
+                mount=pipette.mount,
+            )
+        modules = [temp_deck, mag_deck]
+        if qpcr_setup:
+            modules.append(qpcr_temp_deck)
+        for module in modules:
+            trace_calls(
+                module,
+                TRACE_MODULE_CALLS,
+                trace_path,
+                state,
+                module=str(module.geometry.parent),
+            )
+        trace_calls(protocol, TRACE_PROTOCOL_CALLS, trace_path, state)
+    if journal or resume:
+        path = journal_path if journal else None
+        state = {"DEPTH": 0, "DONE": 0, "RESUME": resume, "HERE": {}}
+        for pipette in (p20, p300):
+            journal_calls(
+                pipette,
+                JOURNAL_INSTRUMENT_CALLS,
+                path,
+                state,
+                mount=pipette.mount,
+            )
+        journal_calls(protocol, JOURNAL_PROTOCOL_CALLS, path, state)
+    if resume:
+        protocol.comment("Resuming after {} dispenses".format(resume))
+
+    num_cols = sample_columns(
+        num_samples, p300.channels, len(reaction_plate.columns())
+    )
+    reagent_map = make_reagent_map(
+        reagent_plate,
+        reagent_reservior,
+        num_cols,
+        p300.channels,
+        staged=fill_delays,
+    )
+    if small_vol_mode not in ("transfer", "distribute", "combined"):
+        raise ValueError("Unknown small_vol_mode: {}".format(small_vol_mode))
+    if wash_mode not in ("transfer", "distribute"):
+        raise ValueError("Unknown wash_mode: {}".format(wash_mode))
+    for name in plan_passes:
+        if name not in OPTIMIZATION_PASSES:
+            raise ValueError("Unknown plan pass: {}".format(name))
+    # Tips are only refilled at the pauses the run needs anyway
+    park_rack = None
+    if park_tips:
+        park_rack = tip_200[0]
+        p300.tip_racks = tip_200[1:]
+    tip_racks = {p20.mount: p20.tip_racks, p300.mount: p300.tip_racks}
+    capacity = {
+        mount: sum(len(rack.columns()) for rack in racks)
+        for mount, racks in tip_racks.items()
+    }
+    refills = [
+        [rack for mount in mounts for rack in tip_racks[mount]]
+        for mounts in plan_tip_refills(
+            tip_demand(
+                num_cols,
+                reagent_map,
+                small_vol_mode,
+                wash_mode,
+                fill_delays,
+                qpcr_setup,
+                capacity,
+                park_tips,
+            ),
+            capacity,
+        )
+    ]
+    if track_liquid_levels:
+        levels = make_liquid_levels(
+            reagent_map, reaction_plate.columns(), num_cols
+        )
+        plan_passes = list(plan_passes) + [track_liquid(levels, p300.channels)]
+    passes = {}
+    for stage, pipette in (
+        ("add_proteinase_k", p20),
+        ("distribute_small_volume", p20),
+        ("add_proteinase_k_ms2", p20),
+        ("add_beads", p300),
+        ("add_ms2", p20),
+        ("discard_supernatant", p300),
+        ("wash_beads", p300),
+        ("stage_elution", p20),
+        ("elute", p300),
+        ("make_qPCR_plate", p300),
+        ("aliquot_eluent", p20),
+        ("add_master_mix", p20),
+    ):
+        passes[stage] = list(plan_passes)
+        if stage in nearest_tip_stages:
+            passes[stage].append(nearest_tips(pipette))
+    for stage in nearest_tip_stages:
+        if stage not in passes:
+            raise ValueError("Unknown stage: {}".format(stage))
+
+    # The app shows these in the run preview, before the deck is loaded
+    reagents = [r for r in REAGENT_LAYOUT if qpcr_setup or r != MASTER_MIX]
+    for line in loading_sheet(reagent_map, reagents):
+        protocol.comment(line)
+
+    # Start cooling the output plate; the run only waits for it right before
+    # the eluate is transferred.
+    temp_deck.start_set_temperature(celsius=TEMP)
+    if qpcr_setup:
+        qpcr_temp_deck.start_set_temperature(celsius=TEMP)
 
     # ------------------------------ Lyse Sample -------------------------------
 
 
     # 1. Mix and add 5 μL of Proteinase K to each well of reaction plate that
     # already contains 200 μL of sample.
-    add_proteinase_k(
-        num_cols=num_cols,
-        pipette=p20,
-        source_plate=reagent_map[PROTEINASE_K][0]["WELL"],
-        destination_plate=reaction_plate.columns(),
-    )
+    if small_vol_mode == "combined":
+        add_proteinase_k_ms2(
+            num_cols=num_cols,
+            pipette=p20,
+            pk_source=reagent_map[PROTEINASE_K][0]["WELL"],
+            ms2_source=reagent_map[MS2][0]["WELL"],
+            destination_plate=reaction_plate.columns(),
+            passes=passes["add_proteinase_k_ms2"],
+        )
+    elif small_vol_mode == "distribute":
+        distribute_small_volume(
+            num_cols=num_cols,
+            volume_ul=VOL_PK,
+            pipette=p20,
+            source_plate=reagent_map[PROTEINASE_K][0]["WELL"],
+            destination_plate=reaction_plate.columns(),
+            passes=passes["distribute_small_volume"],
+        )
+    else:
+        add_proteinase_k(
+            num_cols=num_cols,
+            pipette=p20,
+            source_plate=reagent_map[PROTEINASE_K][0]["WELL"],
+            destination_plate=reaction_plate.columns(),
+            passes=passes["add_proteinase_k"],
+        )
 
     # 2. Mix and add 275 μL of bead solution to each well
     add_beads(
@@ -698,27 +2574,78 @@ def run(protocol: protocol_api.ProtocolContext):
         source_plate=reagent_map[BEADS],
         destination_plate=reaction_plate.columns(),
         protocol=protocol,
+        passes=passes["add_beads"],
     )
 
     # 3. Add 5 μL of MS2 Phage Control to each well
-    add_ms2(
-        num_cols=num_cols,
-        pipette=p20,
-        source_plate=reagent_map[MS2][0]["WELL"],
-        destination_plate=reaction_plate.columns(),
-    )
+    if small_vol_mode == "distribute":
+        distribute_small_volume(
+            num_cols=num_cols,
+            volume_ul=VOL_MS2,
+            pipette=p20,
+            source_plate=reagent_map[MS2][0]["WELL"],
+            destination_plate=reaction_plate.columns(),
+            passes=passes["distribute_small_volume"],
+        )
+    elif small_vol_mode != "combined":
+        add_ms2(
+            num_cols=num_cols,
+            pipette=p20,
+            source_plate=reagent_map[MS2][0]["WELL"],
+            destination_plate=reaction_plate.columns(),
+            passes=passes["add_ms2"],
+        )
+
+    # Steps that do not depend on the reaction plate, run in the first delay
+    # they fit in, or right before the stage that needs them.
+    # The p20 is done once the MS2 is added, so its remaining tips can be
+    # used for staging.
+    deferred = []
+    p20_tip_left = any(rack.next_tip(p20.channels) for rack in tip_20)
+    if fill_delays and not p20_tip_left:
+        protocol.comment("No 20uL tips left, not staging the Elution Solution")
+    elif fill_delays:
+        trips = math.ceil(
+            (VOL_ELUTE * STAGED_COLS_PER_WELL + VOL_STAGING_OVERAGE)
+            / p20.hw_pipette["working_volume"]
+        )
+        deferred.append(
+            deferred_step(
+                name="stage_elution",
+                func=lambda: reagent_map.update(
+                    {
+                        ELUTION_STAGED: stage_elution(
+                            num_cols=num_cols,
+                            pipette=p20,
+                            source_plate=reagent_map[ELUTION][0],
+                            staging_plate=reagent_plate.columns(),
+                            passes=passes["stage_elution"],
+                        )
+                    }
+                ),
+                uses={
+                    REAGENT_RESERVOIR["LABEL"],
+                    REAGENT_PLATE["LABEL"],
+                    P20_MULTI["POSITION"],
+                },
+                seconds=EST_STAGING_TRIP_S
+                * trips
+                * math.ceil(num_cols / STAGED_COLS_PER_WELL),
+                before="elute",
+            )
+        )
 
     # 4. Seal the plate then shake at 1,050 rpm for 2 minutes.
     # 5. Incubate at 65°C for 5 minutes, shake at 1,050 rpm for 5 minutes.
     # Step 4-5 happens outside of OT2
-    protocol.pause()
+    operator_pause(protocol, refills)
 
     # 6. Place the sealed plate on the magnetic stand for 10 minutes or until
     # all of the beads have collected.
     mag_deck.engage(
-        height=MAGDECK_ENGAGE_HEIGHT
+        height=SETTINGS["MAGDECK_ENGAGE_HEIGHT"]
     )  # Raise the Magnetic Module’s magnets.
-    protocol.delay(minutes=10)
+    fill_delay(protocol, deferred, minutes=10, busy={REACTION_PLATE["LABEL"]})
 
     """
     WASH BEADS
@@ -730,58 +2657,124 @@ def run(protocol: protocol_api.ProtocolContext):
         pipette=p300,
         source_plate=reaction_plate.columns(),
         destination_plate=waste_reservior.columns(),
+        passes=passes["discard_supernatant"],
+        park_rack=park_rack,
     )
     # Steps 2-7
     wash_beads(
-        protocol, source_plate=reagent_map[WASH_BUFFER], volume_ul=VOL_500
+        protocol,
+        source_plate=reagent_map[WASH_BUFFER],
+        volume_ul=VOL_500,
+        num_cols=num_cols,
+        wash_mode=wash_mode,
+        deferred=deferred,
+        passes=passes["wash_beads"],
+        refills=refills,
+        park_rack=park_rack,
+    )
+    wash_beads(
+        protocol,
+        source_plate=reagent_map[ETHANOL1],
+        volume_ul=VOL_500,
+        num_cols=num_cols,
+        wash_mode=wash_mode,
+        deferred=deferred,
+        passes=passes["wash_beads"],
+        refills=refills,
+        liquid="ethanol",
+        park_rack=park_rack,
+    )
+    wash_beads(
+        protocol,
+        source_plate=reagent_map[ETHANOL2],
+        volume_ul=VOL_250,
+        num_cols=num_cols,
+        wash_mode=wash_mode,
+        deferred=deferred,
+        passes=passes["wash_beads"],
+        refills=refills,
+        liquid="ethanol",
+        park_rack=park_rack,
     )
-
-    # add more 300uL tips
-    protocol.pause()
-    for t in tip_200:
-        t.reset()
-
-    wash_beads(protocol, source_plate=reagent_map[ETHANOL1], volume_ul=VOL_500)
-    wash_beads(protocol, source_plate=reagent_map[ETHANOL2], volume_ul=VOL_250)
 
     # 8. Dry the beads by shaking the plate (uncovered) at 1,050 rpm for 2
     # minutes. This happens outside of OT2
-    protocol.pause()
-
-    # add more 300uL tips
-    for t in tip_200:
-        t.reset()
+    operator_pause(protocol, refills)
 
     # ------------------------ Elute the Nucleic Acid --------------------------
 
-    temp_deck.set_temperature(celsius=TEMP)
     # 1. Add 50 μL of Elution Solution to each sample, then seal the plate
     mag_deck.disengage()
+    run_deferred(deferred, before="elute")
     elute(
         num_cols=num_cols,
         pipette=p300,
         source_plate=reagent_map[ELUTION][0],
         destination_plate=reaction_plate.columns(),
+        staged_plate=reagent_map.get(ELUTION_STAGED),
+        passes=passes["elute"],
     )
     # 2. Shake at 1,050 rpm for 5 minutes.
     # 3. Incubate at 65°C for 10 minutes.
     # 4. Shake at 1,050 rpm for 5 minutes.
     # Step 2-4 happen outside of OT-2.
-    protocol.pause()
+    if qpcr_setup:
+        operator_pause(
+            protocol,
+            refills,
+            "Replace the waste reservoir with an empty qPCR plate and add the "
+            "master mix to column 12 of the reagent plate",
+        )
+        del protocol.deck[WASTE_RESERVOIR["SLOT"]]
+        qpcr_plate = protocol.load_labware(
+            QPCR_PLATE["NAME"],
+            location=QPCR_PLATE["SLOT"],
+            label=QPCR_PLATE["LABEL"],
+        )
+    else:
+        operator_pause(protocol, refills)
 
     # 5. Place the sealed plate on the magnetic stand for 3 minutes or until
     # clear to collect the beads against the magnets.
-    mag_deck.engage(height=MAGDECK_ENGAGE_HEIGHT)
-    protocol.delay(minutes=3)
+    mag_deck.engage(height=SETTINGS["MAGDECK_ENGAGE_HEIGHT"])
+    fill_delay(protocol, deferred, minutes=3, busy={REACTION_PLATE["LABEL"]})
 
     # 6. Keeping the plate on the magnet, transfer the eluates to a fresh
     # standard (not deep-well) plate, then seal the plate with MicroAmp™ Clear
     # Adhesive Film. Note: Significant bead carry over may adversely impact
     # RT-PCR performance. Leave the output plate on the Temperature Module, and
     # immediately proceed to the qPCR assay preparation protocol.
+    temp_deck.await_temperature(celsius=TEMP)
     make_qPCR_plate(
         num_cols=num_cols,
         pipette=p300,
         source_plate=reaction_plate.columns(),
         destination_plate=output_plate.columns(),
+        passes=passes["make_qPCR_plate"],
     )
+    if not qpcr_setup:
+        return
+
+    # ------------------------- qPCR Assay Preparation -------------------------
+
+    # 5. Set up the reaction plate from the eluate, which stays cold on the
+    # Temperature Module.
+    aliquot_eluent(
+        num_cols=num_cols,
+        pipette=p20,
+        source_plate=output_plate.columns(),
+        destination_plate=qpcr_plate.columns(),
+        passes=passes["aliquot_eluent"],
+    )
+    qpcr_temp_deck.await_temperature(celsius=TEMP)
+    add_master_mix(
+        num_cols=num_cols,
+        pipette=p20,
+        source_plate=reagent_map[MASTER_MIX][0]["WELL"],
+        destination_plate=qpcr_plate.columns(),
+        passes=passes["add_master_mix"],
+    )
+
+    # 6. Seal the plate, vortex for 10 seconds, then centrifuge for 1 minute
+    # at 2000 rpm. This happens outside of OT2
+    protocol.comment("Seal, vortex and centrifuge the qPCR plate")
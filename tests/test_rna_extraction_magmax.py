@@ -0,0 +1,113 @@
+"""
+Tests of the RNA extraction protocol, recorded against the fake context from
+ot2_sars_cov2.fake.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import collections
+import json
+import math
+import re
+
+import pytest
+
+from ot2_sars_cov2.fake import ProtocolContext
+from ot2_sars_cov2.protocols import load_protocol
+from ot2_sars_cov2.recorder import record
+
+CHANNELS = 8
+
+
+def run_extraction(**params):
+    return record("extraction", ProtocolContext(), **params)
+
+
+@pytest.mark.parametrize("num_samples", [8, 40, 96])
+def test_loading_sheet_covers_staged_elution(num_samples):
+    module = load_protocol("extraction")
+    trace = run_extraction(
+        num_samples=num_samples, small_vol_mode="combined", fill_delays=True
+    )
+    (line,) = [
+        entry["text"]
+        for entry in trace
+        if entry["command"] == "comment"
+        and entry["text"].endswith(module.ELUTION)
+    ]
+    column, loaded = re.match(
+        r"Reagent Reservoir column (\d+): (\d+)uL", line
+    ).groups()
+    aspirates = [
+        entry
+        for entry in trace
+        if entry["command"] == "aspirate"
+        and entry["labware"] == module.REAGENT_RESERVOIR["LABEL"]
+        and entry["well"] == "A" + column
+    ]
+    assert {entry["stage"] for entry in aspirates} == {"fill_delay"}
+
+    drawn = sum(entry["volume"] for entry in aspirates) * CHANNELS
+    dead = module.SOURCE_WELL_VOL[module.REAGENT_RESERVOIR["NAME"]]["DEAD"]
+    assert int(loaded) == math.ceil(drawn + dead)
+
+
+def dispenses(trace):
+    return [
+        (entry["labware"], entry["well"], entry["volume"])
+        for entry in trace
+        if entry["command"] == "dispense"
+    ]
+
+
+def test_resume_inside_distribute_tip(tmp_path):
+    params = {"num_samples": 48, "small_vol_mode": "distribute"}
+    path = tmp_path / "journal.jsonl"
+    full = run_extraction(journal=True, journal_path=str(path), **params)
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(lines) == len(dispenses(full))
+
+    # the second column of the Proteinase K tip, which holds a third
+    done = lines[1]["done"]
+    assert lines[1]["dest"] == {"labware": "Reaction Plate", "column": 1}
+    resumed = run_extraction(resume=done, **params)
+    assert dispenses(resumed) == dispenses(full)[done:]
+
+    commands = [
+        entry
+        for entry in resumed
+        if entry["stage"] == "distribute_small_volume"
+    ][:3]
+    assert [entry["command"] for entry in commands] == [
+        "pick_up_tip",
+        "aspirate",
+        "dispense",
+    ]
+    # the fresh tip draws what the interrupted one held for column 3
+    module = load_protocol("extraction")
+    assert commands[1]["volume"] == module.VOL_PK + module.DISPOSAL_SM
+
+
+def test_merge_aspirations_repacks_wash_distribute():
+    params = {"num_samples": 96, "wash_mode": "distribute"}
+    plain = run_extraction(**params)
+    merged = run_extraction(plan_passes=("merge_aspirations",), **params)
+
+    def aspirates(trace):
+        return [
+            entry
+            for entry in trace
+            if entry["command"] == "aspirate" and entry["stage"] == "wash_beads"
+        ]
+
+    assert len(aspirates(merged)) < len(aspirates(plain))
+    # the 200uL tips are filled to the brim
+    assert max(entry["volume"] for entry in aspirates(merged)) == 200
+
+    def dispensed(trace):
+        volumes = collections.Counter()
+        for entry in trace:
+            if entry["command"] == "dispense":
+                volumes[entry["labware"], entry["well"]] += entry["volume"]
+        return volumes
+
+    assert dispensed(merged) == dispensed(plain)